@@ -59,4 +59,42 @@ AGENT_CONFIG = {
 DATABASE_CONFIG = {
     'path': DATA_DIR / 'agency.db',
     'timeout': 30,
+    'pool_size': int(os.getenv('DB_POOL_SIZE', 8)),
+    'read_pool_size': int(os.getenv('DB_READ_POOL_SIZE', 4)),  # read-only snapshot connections for analytics; 0 disables
+    'result_cache_entries': 256,  # cached analytics results, dropped on any database change; 0 disables
+    'result_cache_bytes': 8388608,  # 8 MiB
+    'idle_timeout': 300,  # seconds before an unused pooled connection is closed
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT', 30000)),  # milliseconds
+    'busy_retries': 5,  # retries of a write that still hit a lock after busy_timeout
+    'busy_retry_base_delay': 0.05,  # seconds, doubled per retry with full jitter
+    'busy_retry_max_delay': 2.0,
+    'cache_size': -65536,  # negative values are KiB, i.e. 64 MiB per connection
+    'mmap_size': 268435456,  # 256 MiB
+    'bulk_chunk_size': 5000,  # rows per executemany batch in bulk inserts
+    'backup_pages_per_step': 1024,  # pages copied per online backup step
+    'backup_step_sleep': 0.005,  # seconds to yield to writers between steps
+    'backup_keep': 5,
+    'backup_max_age_days': 30,
+    'write_behind': os.getenv('DB_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'),
+    'group_commit_max_ops': 500,
+    'group_commit_max_delay': 0.005,  # seconds
+    'async_workers': 4,  # executor threads behind AsyncDatabaseManager
+    'async_max_in_flight': 32,
+    'page_size': 500,  # rows fetched per query by the keyset readers
+    'auto_vacuum': 'INCREMENTAL',  # applies to newly created databases only
+    'archive_after_days': 90,
+    'archive_dir': None,  # defaults to an "archive" directory next to the database
+    'instrument_queries': os.getenv('DB_INSTRUMENT_QUERIES', '').lower() in ('1', 'true', 'yes'),
+    'slow_query_ms': 250,  # statements at least this slow are logged when instrumented
+    'shard_dir': DATA_DIR / 'shards',  # one database file per tenant, see ShardRouter
+    'max_open_shards': 16,  # least recently used shards beyond this are closed
+    'shard_pool_size': 4,  # pooled connections per open shard
+    'shard_fan_out_workers': 4,
+    'compression': 'auto',  # 'zstd', 'zlib', or None; 'auto' prefers zstd when zstandard is installed
+    'compress_min_bytes': 1024,  # message content and history values at least this long are compressed
+    'history_snapshot_interval': 16,  # title/description history stores a full value every this many changes
+    'latency_sketch_accuracy': 0.01,  # relative error of the completion-time percentiles
+    'export_format': 'auto',  # 'parquet' or 'npy' for columnar exports; 'auto' prefers parquet when pyarrow is installed
 } 
\ No newline at end of file
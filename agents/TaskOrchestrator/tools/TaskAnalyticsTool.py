@@ -3,20 +3,81 @@ from pydantic import Field
 import json
 from datetime import datetime
 from typing import Optional, Dict, List, Any
-from tools.database_manager import DatabaseManager
+from tools.database_manager import DatabaseManager, parse_timestamp
 
 # Initialize database manager
 db_manager = DatabaseManager()
 
+def task_metrics(rows):
+    metrics = []
+    for row in rows:
+        metrics.append({
+            "status": row["status"],
+            "task_count": row["tasks"],
+            "avg_completion_time_minutes": (
+                row["completion_minutes_sum"] / row["completions"] if row["completions"] else None
+            ),
+            "avg_priority": row["priority_sum"] / row["tasks"] if row["tasks"] else None
+        })
+    return metrics
+
+def workload_analysis(rows):
+    workload = []
+    for row in rows:
+        if row["tasks"]:
+            workload.append({
+                "agent": row["agent"],
+                "active_tasks": row["tasks"],
+                "avg_priority": row["priority_sum"] / row["tasks"]
+            })
+    return workload
+
+def completion_trends(rows):
+    trends = []
+    for row in rows:
+        if row["completions"]:
+            trends.append({
+                "date": row["day"],
+                "completed_tasks": row["completions"],
+                "avg_execution_time_minutes": row["completion_minutes_sum"] / row["completions"]
+            })
+    return trends
+
+def error_analysis(rows):
+    errors = {}
+    for row in rows:
+        if not row["error_type"] or not row["tasks"]:
+            continue
+        error = errors.setdefault(row["error_type"], {
+            "error_type": row["error_type"], "error_count": 0, "affected_agents": 0, "priority_sum": 0
+        })
+        error["error_count"] += row["tasks"]
+        error["affected_agents"] += 1
+        error["priority_sum"] += row["priority_sum"]
+    for error in errors.values():
+        error["avg_priority"] = error.pop("priority_sum") / error["error_count"]
+    return sorted(errors.values(), key=lambda e: e["error_count"], reverse=True)
+
+# Dashboard sections: name -> (builder, rollup keys it groups by, statuses it covers)
+SECTIONS = {
+    "task_metrics": (task_metrics, ("status",), None),
+    "workload_analysis": (workload_analysis, ("agent",), ("pending", "in_progress")),
+    "completion_trends": (completion_trends, ("day",), None),
+    "error_analysis": (error_analysis, ("error_type", "agent"), ("failed",)),
+}
+
 class TaskAnalyticsTool(BaseTool):
     """
     Tool for analyzing task execution patterns, performance metrics, and agent workload.
     Provides insights into task completion rates, execution times, and resource utilization.
+    
+    Answers come from the hourly and daily task rollups that DatabaseManager
+    keeps up to date on every task write, so no operation scans the tasks table.
     """
     
     operation: str = Field(
         ...,
-        description="Operation to perform: 'task_metrics', 'agent_performance', 'workload_analysis', 'completion_trends', 'error_analysis'"
+        description="Operation to perform: 'task_metrics', 'agent_performance', 'workload_analysis', 'completion_trends', 'error_analysis', 'dashboard'"
     )
     
     agent: Optional[str] = Field(
@@ -31,206 +92,91 @@ class TaskAnalyticsTool(BaseTool):
     
     time_range: Optional[Dict] = Field(
         default=None,
-        description="Time range for analysis: {'start': ISO datetime, 'end': ISO datetime}"
+        description="Time range for analysis: {'start': ISO datetime, 'end': ISO datetime}; widened to whole hours"
     )
     
+    sections: Optional[List[str]] = Field(
+        default=None,
+        description="Sections of the 'dashboard' operation: any of 'task_metrics', 'workload_analysis', 'completion_trends', 'error_analysis'; all by default"
+    )
+    
+    def _rollups(self, group_by, **filters):
+        """Aggregate the task rollups over the requested time range."""
+        time_range = self.time_range or {}
+        return db_manager.get_task_rollups(
+            group_by, start=time_range.get("start"), end=time_range.get("end"), **filters
+        )
+    
+    def _cache_key(self):
+        """Identify the answer: operation, agent where it matters, and the range as the whole hours it covers."""
+        time_range = self.time_range or {}
+        start, end = (
+            parse_timestamp(time_range[bound]).isoformat()[:13] if time_range.get(bound) else None
+            for bound in ("start", "end")
+        )
+        agent = self.agent if self.operation == "agent_performance" else None
+        # Sections in request order, which is the order of the answer
+        sections = tuple(self.sections or SECTIONS) if self.operation == "dashboard" else None
+        return ("TaskAnalyticsTool", self.operation, agent, start, end, sections)
+    
     def run(self):
-        """Execute task analytics operations."""
+        """Execute task analytics operations; repeated calls are served from cache until the data changes."""
         try:
-            if self.operation == "task_metrics":
-                with db_manager._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Get task execution metrics
-                    query = """
-                        SELECT 
-                            status,
-                            COUNT(*) as task_count,
-                            AVG(CAST(
-                                (JULIANDAY(completion_time) - JULIANDAY(creation_time)) * 24 * 60 
-                                AS REAL
-                            )) as avg_completion_time,
-                            AVG(CASE 
-                                WHEN priority = 'high' THEN 3
-                                WHEN priority = 'normal' THEN 2
-                                ELSE 1
-                            END) as avg_priority
-                        FROM tasks
-                    """
-                    params = []
-                    
-                    if self.time_range:
-                        query += " WHERE creation_time BETWEEN ? AND ?"
-                        params.extend([self.time_range["start"], self.time_range["end"]])
-                    
-                    query += " GROUP BY status"
-                    
-                    cursor.execute(query, params)
-                    metrics = []
-                    for row in cursor.fetchall():
-                        metrics.append({
-                            "status": row[0],
-                            "task_count": row[1],
-                            "avg_completion_time_minutes": row[2],
-                            "avg_priority": row[3]
-                        })
-                    
-                    return json.dumps(metrics, indent=2)
-            
-            elif self.operation == "agent_performance":
-                if not self.agent:
-                    return "Error: Agent name required for performance analysis"
-                
-                with db_manager._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Get agent performance metrics
-                    cursor.execute("""
-                        SELECT 
-                            COUNT(*) as total_tasks,
-                            COUNT(CASE WHEN status = 'completed' THEN 1 END) as completed_tasks,
-                            COUNT(CASE WHEN status = 'failed' THEN 1 END) as failed_tasks,
-                            AVG(CASE WHEN status = 'completed' THEN
-                                CAST(
-                                    (JULIANDAY(completion_time) - JULIANDAY(start_time)) * 24 * 60 
-                                    AS REAL
-                                )
-                            END) as avg_execution_time,
-                            COUNT(DISTINCT task_type) as task_type_count
-                        FROM tasks
-                        WHERE assigned_agent = ?
-                    """, (self.agent,))
-                    
-                    row = cursor.fetchone()
-                    if row:
-                        performance = {
-                            "total_tasks": row[0],
-                            "completed_tasks": row[1],
-                            "failed_tasks": row[2],
-                            "completion_rate": (row[1] / row[0] * 100) if row[0] > 0 else 0,
-                            "avg_execution_time_minutes": row[3],
-                            "task_type_diversity": row[4]
-                        }
-                        return json.dumps(performance, indent=2)
-                    return "No tasks found for agent"
-            
-            elif self.operation == "workload_analysis":
-                with db_manager._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Get workload distribution
-                    query = """
-                        SELECT 
-                            assigned_agent,
-                            COUNT(*) as active_tasks,
-                            AVG(CASE 
-                                WHEN priority = 'high' THEN 3
-                                WHEN priority = 'normal' THEN 2
-                                ELSE 1
-                            END) as avg_priority,
-                            COUNT(DISTINCT task_type) as task_types
-                        FROM tasks
-                        WHERE status IN ('pending', 'in_progress')
-                    """
-                    params = []
-                    
-                    if self.time_range:
-                        query += " AND creation_time BETWEEN ? AND ?"
-                        params.extend([self.time_range["start"], self.time_range["end"]])
-                    
-                    query += " GROUP BY assigned_agent"
-                    
-                    cursor.execute(query, params)
-                    workload = []
-                    for row in cursor.fetchall():
-                        workload.append({
-                            "agent": row[0],
-                            "active_tasks": row[1],
-                            "avg_priority": row[2],
-                            "task_type_count": row[3]
-                        })
-                    
-                    return json.dumps(workload, indent=2)
-            
-            elif self.operation == "completion_trends":
-                with db_manager._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Get task completion trends
-                    query = """
-                        SELECT 
-                            date(completion_time) as completion_date,
-                            COUNT(*) as completed_tasks,
-                            AVG(CAST(
-                                (JULIANDAY(completion_time) - JULIANDAY(start_time)) * 24 * 60 
-                                AS REAL
-                            )) as avg_execution_time
-                        FROM tasks
-                        WHERE status = 'completed'
-                    """
-                    params = []
-                    
-                    if self.time_range:
-                        query += " AND completion_time BETWEEN ? AND ?"
-                        params.extend([self.time_range["start"], self.time_range["end"]])
-                    
-                    query += " GROUP BY date(completion_time) ORDER BY completion_date"
-                    
-                    cursor.execute(query, params)
-                    trends = []
-                    for row in cursor.fetchall():
-                        trends.append({
-                            "date": row[0],
-                            "completed_tasks": row[1],
-                            "avg_execution_time_minutes": row[2]
-                        })
-                    
-                    return json.dumps(trends, indent=2)
-            
-            elif self.operation == "error_analysis":
-                with db_manager._get_connection() as conn:
-                    cursor = conn.cursor()
-                    
-                    # Get error patterns
-                    query = """
-                        SELECT 
-                            error_type,
-                            COUNT(*) as error_count,
-                            COUNT(DISTINCT assigned_agent) as affected_agents,
-                            AVG(CASE 
-                                WHEN priority = 'high' THEN 3
-                                WHEN priority = 'normal' THEN 2
-                                ELSE 1
-                            END) as avg_priority
-                        FROM tasks
-                        WHERE status = 'failed'
-                        AND error_type IS NOT NULL
-                    """
-                    params = []
-                    
-                    if self.time_range:
-                        query += " AND creation_time BETWEEN ? AND ?"
-                        params.extend([self.time_range["start"], self.time_range["end"]])
-                    
-                    query += " GROUP BY error_type ORDER BY error_count DESC"
-                    
-                    cursor.execute(query, params)
-                    errors = []
-                    for row in cursor.fetchall():
-                        errors.append({
-                            "error_type": row[0],
-                            "error_count": row[1],
-                            "affected_agents": row[2],
-                            "avg_priority": row[3]
-                        })
-                    
-                    return json.dumps(errors, indent=2)
-            
-            else:
-                return f"Error: Unknown operation {self.operation}"
-            
+            return db_manager.cached(self._cache_key(), self._analyze)
         except Exception as e:
             return f"Error during {self.operation} operation: {str(e)}"
+    
+    def _analyze(self):
+        """Run the requested operation against the task rollups."""
+        if self.operation == "dashboard":
+            sections = self.sections or list(SECTIONS)
+            unknown = [section for section in sections if section not in SECTIONS]
+            if unknown:
+                return f"Error: Unknown dashboard sections {', '.join(unknown)}"
+            
+            # Each section grouped in SQL by its own keys, all read from one snapshot
+            dashboard = {}
+            with db_manager.read_snapshot():
+                for section in sections:
+                    build, keys, statuses = SECTIONS[section]
+                    dashboard[section] = build(self._rollups(keys, statuses=statuses))
+            return json.dumps(dashboard, separators=(",", ":"))
+        
+        elif self.operation in SECTIONS:
+            build, keys, statuses = SECTIONS[self.operation]
+            return json.dumps(build(self._rollups(keys, statuses=statuses)), indent=2)
+        
+        elif self.operation == "agent_performance":
+            if not self.agent:
+                return "Error: Agent name required for performance analysis"
+            
+            # Get agent performance metrics
+            by_status = {row["status"]: row for row in self._rollups(("status",), agent=self.agent)}
+            total = sum(row["tasks"] for row in by_status.values())
+            if not total:
+                return "No tasks found for agent"
+            completed = by_status.get("completed", {})
+            completions = completed.get("completions", 0)
+            performance = {
+                "total_tasks": total,
+                "completed_tasks": completed.get("tasks", 0),
+                "failed_tasks": by_status.get("failed", {}).get("tasks", 0),
+                "completion_rate": completed.get("tasks", 0) / total * 100,
+                "avg_execution_time_minutes": (
+                    completed["completion_minutes_sum"] / completions if completions else None
+                )
+            }
+            time_range = self.time_range or {}
+            percentiles = db_manager.get_completion_percentiles(
+                self.agent, start=time_range.get("start"), end=time_range.get("end")
+            )
+            performance["execution_time_percentiles_minutes"] = {
+                key: value for key, value in percentiles.items() if key != "completions"
+            }
+            return json.dumps(performance, indent=2)
+        
+        else:
+            return f"Error: Unknown operation {self.operation}"
 
 if __name__ == "__main__":
     # Test the analytics tool
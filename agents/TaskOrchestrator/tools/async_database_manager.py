@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+
+from .database_manager import DatabaseManager
+
+class AsyncDatabaseManager:
+    """
+    Asyncio facade over DatabaseManager for use from async code such as the FastAPI backend.
+    
+    Blocking queries run on a dedicated executor whose worker threads stay alive,
+    so each one keeps getting the same pooled connection back. ``max_in_flight``
+    caps the number of queries admitted at once; further callers wait on the
+    event loop instead of piling up in the executor queue. A manager created
+    by the facade itself is cleaned up by ``close``; one passed in is left to
+    its owner.
+    """
+    
+    def __init__(self, db_manager=None, max_workers=None, max_in_flight=None):
+        self._owns_db = db_manager is None
+        self.db = db_manager or DatabaseManager()
+        config = self.db.connection_pool.config
+        self.max_workers = max_workers or config["async_workers"]
+        self.max_in_flight = max_in_flight or config["async_max_in_flight"]
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="DatabaseQuery")
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+    
+    def _semaphore(self):
+        """Get the in-flight semaphore for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._semaphores:
+                self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+            return self._semaphores[loop]
+    
+    async def _run(self, fn, *args, **kwargs):
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+    
+    async def _write(self, operation, *args, **kwargs):
+        if self.db.writer is not None:
+            # The group-commit writer already runs off-loop; just await its future
+            async with self._semaphore():
+                return await asyncio.wrap_future(self.db.submit(operation, *args, **kwargs))
+        return await self._run(getattr(self.db, operation), *args, **kwargs)
+    
+    async def add_task(self, task_data) -> Dict:
+        """Add a new task to the database with history tracking."""
+        return await self._write("add_task", task_data)
+    
+    async def update_task(self, task_id, updates, changed_by="system") -> Optional[Dict]:
+        """Update an existing task with history tracking."""
+        return await self._write("update_task", task_id, updates, changed_by)
+    
+    async def add_message(self, message_data) -> Dict:
+        """Add a new message to the database with threading support."""
+        return await self._write("add_message", message_data)
+    
+    async def get_task_history(self, task_id) -> List[Dict]:
+        """Get the history of changes for a task."""
+        return await self._run(self.db.get_task_history, task_id)
+    
+    async def get_message_thread(self, thread_id) -> List[Dict]:
+        """Get all messages in a thread."""
+        return await self._run(self.db.get_message_thread, thread_id)
+    
+    async def get_agent_stats(self, agent) -> Optional[Dict]:
+        """Get task statistics for an agent."""
+        return await self._run(self.db.get_agent_stats, agent)
+    
+    def close(self):
+        """Wait for running queries, shut down the executor and clean up a manager the facade created."""
+        self._executor.shutdown(wait=True)
+        if self._owns_db:
+            # Flushes the group-commit writer and closes the pooled connections
+            self.db.cleanup()
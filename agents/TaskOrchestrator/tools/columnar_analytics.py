@@ -0,0 +1,257 @@
+import hashlib
+import os
+import re
+import shutil
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from agency.config import DATABASE_CONFIG
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional; partitions are written as directories of .npy files without it
+    pyarrow = None
+
+# Exported columns per table, in EXPORT_QUERIES order, and how each is stored:
+# "key" task ids as 64-bit hashes, "category" strings as int32 codes into a sorted
+# label array, "time" ISO timestamps as datetime64[s], "int" as int64.
+SCHEMAS = {
+    "tasks": {
+        "id": "key",
+        "agent": "category",
+        "status": "category",
+        "error_type": "category",
+        "priority": "int",
+        "created_at": "time",
+        "updated_at": "time",
+        "parent_task_id": "key",
+    },
+    "task_history": {
+        "task_id": "key",
+        "field_name": "category",
+        "old_value": "category",
+        "new_value": "category",
+        "changed_at": "time",
+        "changed_by": "category",
+    },
+}
+PARTITION_NAME = re.compile(r"(\d{4}-\d{2}-\d{2})(\.parquet)?")
+
+def task_key(task_id) -> int:
+    """Stable 64-bit key of a task id, shared by tasks.id and task_history.task_id; 0 for None."""
+    if task_id is None:
+        return 0
+    return int.from_bytes(hashlib.blake2b(task_id.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+class ColumnTable:
+    """
+    Columns of one exported table as NumPy arrays of equal length.
+    
+    ``columns`` maps names to arrays; category columns hold codes into
+    ``labels[name]``, a sorted array of the distinct strings ("" for NULL).
+    """
+    
+    def __init__(self, columns: Dict[str, np.ndarray], labels: Dict[str, np.ndarray]):
+        self.columns = columns
+        self.labels = labels
+    
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+    
+    def __getitem__(self, name) -> np.ndarray:
+        return self.columns[name]
+    
+    def code(self, name, label) -> int:
+        """Code of ``label`` in a category column, or -1 when it never occurs."""
+        labels = self.labels[name]
+        index = np.searchsorted(labels, label)
+        return int(index) if index < len(labels) and labels[index] == label else -1
+    
+    def decode(self, name) -> np.ndarray:
+        """The strings of a category column."""
+        return self.labels[name][self.columns[name]]
+
+def _encode(table, rows) -> ColumnTable:
+    """Turn one day's rows from DatabaseManager.iter_export_rows into a ColumnTable."""
+    columns, labels = {}, {}
+    for name, values in zip(SCHEMAS[table], zip(*rows)):
+        kind = SCHEMAS[table][name]
+        if kind == "key":
+            columns[name] = np.fromiter((task_key(value) for value in values), dtype=np.int64, count=len(values))
+        elif kind == "category":
+            labels[name], codes = np.unique(np.array([value or "" for value in values], dtype=str), return_inverse=True)
+            columns[name] = codes.astype(np.int32)
+        elif kind == "time":
+            columns[name] = np.array([value or "NaT" for value in values], dtype="datetime64[us]").astype("datetime64[s]")
+        else:
+            columns[name] = np.array([value or 0 for value in values], dtype=np.int64)
+    return ColumnTable(columns, labels)
+
+def _write_partition(path: Path, data: ColumnTable, export_format):
+    """Write a partition next to ``path`` and move it into place, replacing an earlier export of the day."""
+    if export_format == "parquet":
+        arrays = {
+            name: pyarrow.DictionaryArray.from_arrays(column, pyarrow.array(data.labels[name].tolist()))
+            if name in data.labels else pyarrow.array(column)
+            for name, column in data.columns.items()
+        }
+        target = path.with_name(path.name + ".parquet")
+        temp = target.with_name(target.name + ".tmp")
+        pyarrow.parquet.write_table(pyarrow.table(arrays), temp)
+        os.replace(temp, target)
+        return
+    
+    temp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(temp, ignore_errors=True)
+    temp.mkdir()
+    for name, column in data.columns.items():
+        np.save(temp / f"{name}.npy", column)
+        if name in data.labels:
+            np.save(temp / f"{name}.labels.npy", data.labels[name])
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp, path)
+
+def export_columnar(db, out_dir, tables=("tasks", "task_history"), since=None, export_format=None) -> Dict[str, Dict[str, int]]:
+    """
+    Export tables of a DatabaseManager as columnar snapshots partitioned by day.
+    
+    Each day becomes ``<out_dir>/<table>/<YYYY-MM-DD>.parquet`` or, without
+    pyarrow, a ``<YYYY-MM-DD>`` directory holding one ``.npy`` file per column
+    (plus ``<column>.labels.npy`` for category columns). Tasks are partitioned
+    by created_at and history by changed_at, archived months included. With
+    ``since`` only the days from its date on are rewritten, which makes
+    periodic re-exports cheap. Returns the rows written per table and day.
+    """
+    export_format = export_format or DATABASE_CONFIG["export_format"]
+    if export_format == "auto":
+        export_format = "parquet" if pyarrow is not None else "npy"
+    if export_format == "parquet" and pyarrow is None:
+        raise RuntimeError("Parquet export needs the pyarrow package; use export_format='npy'")
+    
+    written = {}
+    for table in tables:
+        table_dir = Path(out_dir) / table
+        table_dir.mkdir(parents=True, exist_ok=True)
+        day_index = list(SCHEMAS[table]).index("created_at" if table == "tasks" else "changed_at")
+        written[table] = {}
+        for day, rows in groupby(db.iter_export_rows(table, since), key=lambda row: row[day_index][:10]):
+            rows = list(rows)
+            _write_partition(table_dir / day, _encode(table, rows), export_format)
+            written[table][day] = len(rows)
+    return written
+
+def _read_partition(path: Path, names) -> ColumnTable:
+    if path.suffix == ".parquet":
+        data = pyarrow.parquet.read_table(path, columns=names)
+        columns, labels = {}, {}
+        for name in names:
+            column = data.column(name).combine_chunks()
+            if pyarrow.types.is_dictionary(column.type):
+                columns[name] = column.indices.to_numpy(zero_copy_only=False).astype(np.int32)
+                labels[name] = np.array(column.dictionary.to_pylist(), dtype=str)
+            else:
+                columns[name] = column.to_numpy(zero_copy_only=False)
+        return ColumnTable(columns, labels)
+    
+    return ColumnTable(
+        {name: np.load(path / f"{name}.npy") for name in names},
+        {name: np.load(path / f"{name}.labels.npy") for name in names if (path / f"{name}.labels.npy").exists()}
+    )
+
+def load_columnar(out_dir, table, start=None, end=None, columns: Optional[Iterable[str]] = None) -> ColumnTable:
+    """
+    Load the day partitions of an exported table into one ColumnTable.
+    
+    ``start``/``end`` (ISO dates or times) select partitions by day and
+    ``columns`` limits the columns read. Category codes are remapped onto the
+    labels of all loaded partitions, so they compare across days.
+    """
+    names = list(columns or SCHEMAS[table])
+    table_dir = Path(out_dir) / table
+    parts: List[Tuple[str, Path]] = []
+    for path in table_dir.iterdir() if table_dir.is_dir() else ():
+        match = PARTITION_NAME.fullmatch(path.name)
+        if match and (start is None or match.group(1) >= start[:10]) and (end is None or match.group(1) <= end[:10]):
+            parts.append((match.group(1), path))
+    loaded = [_read_partition(path, names) for _, path in sorted(parts)]
+    
+    merged, labels = {}, {}
+    for name in names:
+        if SCHEMAS[table][name] == "category":
+            labels[name] = np.unique(np.concatenate([part.labels[name] for part in loaded] or [np.array([], dtype=str)]))
+            merged[name] = np.concatenate([
+                np.searchsorted(labels[name], part.labels[name]).astype(np.int32)[part[name]] for part in loaded
+            ] or [np.array([], dtype=np.int32)])
+        else:
+            empty = np.array([], dtype="datetime64[s]" if SCHEMAS[table][name] == "time" else np.int64)
+            merged[name] = np.concatenate([part[name] for part in loaded] or [empty])
+    return ColumnTable(merged, labels)
+
+def _distribution(groups, values, labels, quantiles) -> Dict[str, Dict]:
+    """Count, mean and quantiles of ``values`` per group code, for the groups that have any."""
+    counts = np.bincount(groups, minlength=len(labels))
+    means = np.bincount(groups, weights=values, minlength=len(labels)) / np.maximum(counts, 1)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    # Sort by value, then stably by group; cheaper than np.lexsort on the pair
+    by_value = np.argsort(values)
+    values = values[by_value][np.argsort(groups[by_value], kind="stable")]
+    present = np.flatnonzero(counts)
+    # Lower nearest rank, as the completion-time sketches in the database use
+    ranks = {q: values[starts[present] + np.floor(q * (counts[present] - 1)).astype(np.int64)] for q in quantiles}
+    return {
+        str(labels[group]): {
+            "count": int(counts[group]),
+            "mean": float(means[group]),
+            **{f"p{q * 100:g}": float(ranks[q][i]) for q in quantiles}
+        }
+        for i, group in enumerate(present)
+    }
+
+def completion_durations(tasks: ColumnTable) -> Tuple[np.ndarray, np.ndarray]:
+    """Agent codes and completion times in minutes (created_at to updated_at) of the completed tasks."""
+    completed = tasks["status"] == tasks.code("status", "completed")
+    minutes = (tasks["updated_at"][completed] - tasks["created_at"][completed]) / np.timedelta64(1, "m")
+    return tasks["agent"][completed], minutes
+
+def throughput(tasks: ColumnTable, unit="D") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Completed tasks per hour (``unit="h"``) or day (``"D"``).
+    
+    Returns the bucket starts as datetime64 and their counts, including
+    buckets without completions between the first and the last one.
+    """
+    completed = tasks["status"] == tasks.code("status", "completed")
+    buckets = tasks["updated_at"][completed].astype(f"datetime64[{unit}]").astype(np.int64)
+    if not len(buckets):
+        return np.array([], dtype=f"datetime64[{unit}]"), np.array([], dtype=np.int64)
+    first = buckets.min()
+    counts = np.bincount(buckets - first)
+    return np.arange(first, first + len(counts)).astype(f"datetime64[{unit}]"), counts
+
+def agent_completion_distributions(tasks: ColumnTable, quantiles=(0.5, 0.9, 0.99)) -> Dict[str, Dict]:
+    """Per agent: number of completed tasks and the mean and quantiles of their completion minutes."""
+    agents, minutes = completion_durations(tasks)
+    return _distribution(agents, minutes, tasks.labels["agent"], quantiles)
+
+def status_dwell_times(history: ColumnTable, quantiles=(0.5, 0.9, 0.99)) -> Dict[str, Dict]:
+    """
+    Per status: how many minutes tasks stayed in it, from the status change
+    that entered it to the next one. Time before a task's first recorded
+    change and in its current status is not counted.
+    """
+    status = history["field_name"] == history.code("field_name", "status")
+    tasks, changed_at = history["task_id"][status], history["changed_at"][status]
+    entered = history["new_value"][status]
+    # Exports come in changed_at order, so a stable sort by task keeps each task's changes in order
+    if np.any(changed_at[1:] < changed_at[:-1]):
+        by_time = np.argsort(changed_at, kind="stable")
+        tasks, changed_at, entered = tasks[by_time], changed_at[by_time], entered[by_time]
+    order = np.argsort(tasks, kind="stable")
+    tasks, changed_at, entered = tasks[order], changed_at[order], entered[order]
+    left = tasks[1:] == tasks[:-1]
+    minutes = (changed_at[1:] - changed_at[:-1])[left] / np.timedelta64(1, "m")
+    return _distribution(entered[:-1][left], minutes, history.labels["new_value"], quantiles)
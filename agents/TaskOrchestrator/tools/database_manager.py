@@ -1,10 +1,1038 @@
 import sqlite3
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
-import shutil
+import re
+import sys
+import functools
+import logging
+import queue
+import random
 import threading
-from typing import List, Dict, Optional
+import time
+import zlib
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+from itertools import islice
+from pathlib import Path
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+
+from agency.config import DATABASE_CONFIG
+from monitoring.metrics import DB_BUSY_RETRIES, DB_LOCK_WAIT_SECONDS, DB_STATEMENT_ROWS, DB_STATEMENT_SECONDS
+from utils.backup import online_backup, prune_backups, restore_backup
+from .quantile_sketch import DDSketch
+
+try:
+    import zstandard
+except ImportError:  # optional; large values are compressed with zlib without it
+    zstandard = None
+
+slow_query_logger = logging.getLogger(__name__ + ".slow_queries")
+
+# Secondary indexes maintained by DatabaseManager: name -> (table, columns)
+INDEXES = {
+    "idx_tasks_agent_status": ("tasks", ("agent", "status")),
+    "idx_task_history_task_changed": ("task_history", ("task_id", "changed_at")),
+    "idx_messages_thread_timestamp_id": ("messages", ("thread_id", "timestamp", "id")),
+    "idx_messages_reply_to": ("messages", ("reply_to_id",)),
+    "idx_messages_thread_path": ("messages", ("thread_id", "path")),
+    "idx_task_dependencies_depends_on": ("task_dependencies", ("depends_on", "task_id")),
+    "idx_tasks_status_priority": ("tasks", ("status", "priority DESC", "created_at")),
+    # Keyset pages of iter_export_rows, which walk (day column, rowid)
+    "idx_tasks_created": ("tasks", ("created_at",)),
+    "idx_task_history_changed": ("task_history", ("changed_at",)),
+}
+
+# Indexes superseded by an entry in INDEXES, dropped on startup
+RETIRED_INDEXES = ("idx_messages_thread_timestamp",)
+
+def compress_text(value, min_bytes, codec):
+    """
+    Compress a text value of at least ``min_bytes`` UTF-8 bytes with ``codec``.
+    
+    Returns the value to store and its codec; values that are short, or that
+    would not get smaller, are stored as they are with a codec of None.
+    """
+    if value is None or not codec:
+        return value, None
+    data = value.encode("utf-8")
+    if len(data) < min_bytes:
+        return value, None
+    packed = zstandard.ZstdCompressor().compress(data) if codec == "zstd" else zlib.compress(data)
+    if len(packed) >= len(data):
+        return value, None
+    return packed, codec
+
+def inflate(value, codec):
+    """Decompress a value stored by compress_text; uncompressed values pass through."""
+    if codec is None:
+        return value
+    if codec == "zlib":
+        return zlib.decompress(value).decode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Value is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(value).decode("utf-8")
+    raise ValueError(f"Unknown codec {codec}")
+
+# Whitespace runs, words and single other characters; joined back they give the original text
+DELTA_TOKENS = re.compile(r"\s+|\w+|[^\w\s]")
+
+def encode_delta(base, value):
+    """
+    Encode ``value`` as edits against ``base``.
+    
+    The delta is a JSON list read left to right: a positive integer copies
+    that many characters of ``base``, a negative integer skips that many, and
+    a string is inserted as it is. Texts are diffed word by word.
+    """
+    old_tokens = DELTA_TOKENS.findall(base)
+    new_tokens = DELTA_TOKENS.findall(value)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_tokens, new_tokens, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(sum(len(token) for token in old_tokens[i1:i2]))
+            continue
+        if i2 > i1:
+            ops.append(-sum(len(token) for token in old_tokens[i1:i2]))
+        if j2 > j1:
+            ops.append("".join(new_tokens[j1:j2]))
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+def apply_delta(base, delta):
+    """Rebuild a value from ``base`` and a delta written by encode_delta."""
+    if base is None or delta is None:
+        return None
+    parts = []
+    position = 0
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.append(base[position:position + op])
+            position += op
+        else:
+            position -= op
+    return "".join(parts)
+
+def register_codecs(conn):
+    """Make the SQL functions inflate(value, codec) and apply_delta(base, delta) available on a connection."""
+    conn.create_function("inflate", 2, inflate, deterministic=True)
+    conn.create_function("apply_delta", 2, apply_delta, deterministic=True)
+
+def _inflated(column):
+    """SQL expression reading a column that may be compressed, marked by ``<column>_codec``, as text."""
+    return f"CASE WHEN {column}_codec IS NULL THEN {column} ELSE inflate({column}, {column}_codec) END"
+
+def _history_value(column, schema="main"):
+    """
+    SQL expression reading task_history.old_value or new_value in ``schema`` as text.
+    
+    Rows with a ``base_id`` store deltas against the new_value of that snapshot row.
+    """
+    return (
+        f"CASE WHEN task_history.base_id IS NULL THEN {_inflated(column)} "
+        f"ELSE apply_delta((SELECT {_inflated('b.new_value')} FROM {schema}.task_history b "
+        f"WHERE b.id = task_history.base_id), {_inflated(column)}) END"
+    )
+
+TASK_COLUMNS = (
+    "id, title, description, priority, agent, status, created_at, updated_at, dependencies, parent_task_id, error_type"
+)
+# Fields update_task may change -> their position in TASK_COLUMNS
+TASK_FIELD_INDEX = {
+    "title": 1, "description": 2, "priority": 3, "agent": 4, "status": 5, "dependencies": 8, "error_type": 10
+}
+TASK_INSERT = f"INSERT INTO tasks ({TASK_COLUMNS}) VALUES ({', '.join('?' for _ in TASK_COLUMNS.split(', '))})"
+# UPDATE ... FROM needs SQLite 3.33 and RETURNING 3.35
+UPDATE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Folds completions into task_stats: (agent, completed, avg, last_updated, sum, sum of squares)
+COMPLETION_STATS_UPSERT = """
+    INSERT INTO task_stats (
+        agent, tasks_completed, tasks_pending, avg_completion_time, last_updated,
+        completion_time_sum, completion_time_sumsq
+    )
+    VALUES (?, ?, 0, ?, ?, ?, ?)
+    ON CONFLICT(agent) DO UPDATE SET
+        tasks_completed = tasks_completed + excluded.tasks_completed,
+        tasks_pending = MAX(tasks_pending - excluded.tasks_completed, 0),
+        avg_completion_time = (completion_time_sum + excluded.completion_time_sum) / (tasks_completed + excluded.tasks_completed),
+        last_updated = excluded.last_updated,
+        completion_time_sum = completion_time_sum + excluded.completion_time_sum,
+        completion_time_sumsq = completion_time_sumsq + excluded.completion_time_sumsq
+"""
+MESSAGE_COLUMNS = "id, from_agent, to_agent, content, priority, type, status, timestamp, thread_id, reply_to_id, depth"
+# MESSAGE_COLUMNS with the content decompressed; only rows actually returned are decompressed
+MESSAGE_SELECT = MESSAGE_COLUMNS.replace(", content,", f", {_inflated('content')},")
+
+# Triggers keeping the FTS5 indexes in sync with their tables. They use built-in SQL only, so
+# any SQLite client can write. messages_fts is contentless: triggers index plain message
+# text, and DatabaseManager indexes and unindexes compressed content itself.
+# While bulk_load has a row, the per-row insert triggers on tasks and messages
+# stand aside: add_tasks_bulk and add_messages_bulk index and roll up each chunk,
+# the rows past the rowid the chunk started at, with one set-based statement per
+# table instead
+BULK_LOAD_SCHEMA = "CREATE TABLE IF NOT EXISTS bulk_load (started_at TEXT NOT NULL)"
+BULK_GUARDED_TRIGGERS = ("tasks_fts_insert", "tasks_rollup_insert", "messages_fts_insert")
+TASKS_FTS_BULK_LOAD = "INSERT INTO tasks_fts (rowid, title, description) SELECT rowid, title, description FROM tasks WHERE rowid > ?"
+MESSAGES_FTS_BULK_LOAD = (
+    "INSERT INTO messages_fts (rowid, content) SELECT rowid, content FROM messages WHERE rowid > ? AND content_codec IS NULL"
+)
+
+SEARCH_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+    WHEN new.content_codec IS NULL AND NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+    WHEN old.content_codec IS NULL BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, content_codec ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content)
+        SELECT 'delete', old.rowid, old.content WHERE old.content_codec IS NULL;
+        INSERT INTO messages_fts (rowid, content) SELECT new.rowid, new.content WHERE new.content_codec IS NULL;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks
+    WHEN NOT EXISTS (SELECT 1 FROM bulk_load) BEGIN
+        INSERT INTO tasks_fts (rowid, title, description) VALUES (new.rowid, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, title, description)
+        VALUES ('delete', old.rowid, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, description ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, title, description)
+        VALUES ('delete', old.rowid, old.title, old.description);
+        INSERT INTO tasks_fts (rowid, title, description) VALUES (new.rowid, new.title, new.description);
+    END
+    """,
+)
+
+# Task rollups: table -> length of the created_at/updated_at prefix that names a bucket
+ROLLUP_TABLES = {"task_rollup_hourly": 13, "task_rollup_daily": 10}
+ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        bucket TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        status TEXT NOT NULL,
+        error_type TEXT NOT NULL DEFAULT '',
+        tasks INTEGER NOT NULL DEFAULT 0,
+        priority_sum INTEGER NOT NULL DEFAULT 0,
+        completions INTEGER NOT NULL DEFAULT 0,
+        completion_minutes_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, agent, status, error_type)
+    ) WITHOUT ROWID
+"""
+
+def _rollup_count(row, sign):
+    """Trigger statements adding (sign 1) or removing (sign -1) a task row to the bucket of its creation."""
+    return "".join(f"""
+        INSERT INTO {table} (bucket, agent, status, error_type, tasks, priority_sum)
+        VALUES (
+            substr({row}.created_at, 1, {width}), {row}.agent, {row}.status, coalesce({row}.error_type, ''),
+            {sign}, {sign} * coalesce({row}.priority, 0)
+        )
+        ON CONFLICT (bucket, agent, status, error_type) DO UPDATE SET
+            tasks = tasks + excluded.tasks,
+            priority_sum = priority_sum + excluded.priority_sum;""" for table, width in ROLLUP_TABLES.items())
+
+def _rollup_completion(condition):
+    """Trigger statements counting a completion in the bucket of the task's updated_at."""
+    return "".join(f"""
+        INSERT INTO {table} (bucket, agent, status, error_type, completions, completion_minutes_sum)
+        SELECT substr(new.updated_at, 1, {width}), new.agent, 'completed', '', 1,
+            (julianday(new.updated_at) - julianday(new.created_at)) * 1440
+        WHERE new.status = 'completed' AND {condition}
+        ON CONFLICT (bucket, agent, status, error_type) DO UPDATE SET
+            completions = completions + 1,
+            completion_minutes_sum = completion_minutes_sum + excluded.completion_minutes_sum;""" for table, width in ROLLUP_TABLES.items())
+
+def _rollup_load(table, width, condition):
+    """Statements adding the tasks matching ``condition`` to a rollup, one aggregate for counts and one for completions."""
+    return [f"""
+        INSERT INTO {table} (bucket, agent, status, error_type, tasks, priority_sum)
+        SELECT substr(created_at, 1, {width}), agent, status, coalesce(error_type, ''), COUNT(*), coalesce(SUM(priority), 0)
+        FROM tasks
+        WHERE {condition}
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (bucket, agent, status, error_type) DO UPDATE SET
+            tasks = tasks + excluded.tasks,
+            priority_sum = priority_sum + excluded.priority_sum
+    """, f"""
+        INSERT INTO {table} (bucket, agent, status, error_type, completions, completion_minutes_sum)
+        SELECT substr(updated_at, 1, {width}), agent, 'completed', '', COUNT(*),
+            SUM((julianday(updated_at) - julianday(created_at)) * 1440)
+        FROM tasks
+        WHERE status = 'completed' AND {condition}
+        GROUP BY 1, 2
+        ON CONFLICT (bucket, agent, status, error_type) DO UPDATE SET
+            completions = completions + excluded.completions,
+            completion_minutes_sum = completion_minutes_sum + excluded.completion_minutes_sum
+    """]
+
+ROLLUP_BULK_LOAD = [
+    statement for table, width in ROLLUP_TABLES.items() for statement in _rollup_load(table, width, "rowid > ?")
+]
+
+# Keep the rollups in step with every write to tasks: counts follow a task's
+# current agent, status and error type, completions are counted when they happen
+ROLLUP_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_rollup_insert AFTER INSERT ON tasks
+    WHEN NOT EXISTS (SELECT 1 FROM bulk_load)
+    BEGIN{_rollup_count('new', 1)}{_rollup_completion('1')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_rollup_delete AFTER DELETE ON tasks BEGIN{_rollup_count('old', -1)}
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tasks_rollup_update
+    AFTER UPDATE OF agent, status, priority, error_type, created_at ON tasks BEGIN{_rollup_count('old', -1)}{_rollup_count('new', 1)}{_rollup_completion("old.status != 'completed'")}
+    END
+    """,
+)
+# Completion-time sketches per agent: table -> bucket prefix length, as for the rollups
+LATENCY_TABLES = {"task_latency_hourly": 13, "task_latency_daily": 10}
+LATENCY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        bucket TEXT NOT NULL,
+        agent TEXT NOT NULL,
+        sketch TEXT NOT NULL,
+        PRIMARY KEY (bucket, agent)
+    ) WITHOUT ROWID
+"""
+
+def parse_timestamp(value) -> datetime:
+    """
+    Parse an ISO-8601 timestamp the way SQLite's julianday() reads it.
+    
+    A trailing "Z" is accepted on every Python version, and a timestamp with
+    an offset is converted to UTC and made naive; naive ones are kept as
+    they are, so aware and naive values can be compared.
+    """
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def bucket_ranges(start=None, end=None) -> List[Tuple[int, str, list]]:
+    """
+    Split an ISO time range into bucket ranges of the hourly and daily tables.
+    
+    Returns ``(width, condition, params)`` triples, ``width`` being the
+    bucket prefix length of the table to read (13 hourly, 10 daily) and
+    ``condition`` a filter on its ``bucket`` column. Days the range covers
+    entirely come from the daily table, the hours at either end from the
+    hourly one, so the range is widened to whole hours.
+    """
+    start = parse_timestamp(start).isoformat() if start else None
+    end = parse_timestamp(end).isoformat() if end else None
+    if start and end and start[:10] == end[:10]:
+        return [(13, "bucket BETWEEN ? AND ?", [start[:13], end[:13]])]
+    
+    ranges, days, params = [], [], []
+    if start:
+        ranges.append((13, "bucket BETWEEN ? AND ?", [start[:13], f"{start[:10]}T23"]))
+        days.append("bucket > ?")
+        params.append(start[:10])
+    if end:
+        ranges.append((13, "bucket BETWEEN ? AND ?", [f"{end[:10]}T00", end[:13]]))
+        days.append("bucket < ?")
+        params.append(end[:10])
+    ranges.append((10, " AND ".join(days) or "1", params))
+    return ranges
+
+# Grouping keys accepted by DatabaseManager.get_task_rollups -> expression over a rollup table
+ROLLUP_KEYS = {"agent": "agent", "status": "status", "error_type": "error_type", "day": "substr(bucket, 1, 10)"}
+
+# Columns that keyset readers may project: output name -> column
+MESSAGE_FIELDS = {name: name for name in MESSAGE_COLUMNS.split(", ")}
+MESSAGE_FIELDS["content"] = _inflated("content")
+HISTORY_FIELDS = {
+    "id": "id",
+    "field": "field_name",
+    "old_value": _history_value("old_value"),
+    "new_value": _history_value("new_value"),
+    "changed_at": "changed_at",
+    "changed_by": "changed_by"
+}
+
+# Tables in the monthly archive databases written by DatabaseManager.archive_old_rows
+ARCHIVE_SCHEMA = {
+    "task_history": """
+        CREATE TABLE IF NOT EXISTS {schema}.task_history (
+            id INTEGER PRIMARY KEY,
+            task_id TEXT NOT NULL,
+            field_name TEXT NOT NULL,
+            old_value TEXT,
+            new_value TEXT,
+            changed_at TEXT NOT NULL,
+            changed_by TEXT NOT NULL,
+            old_value_codec TEXT,
+            new_value_codec TEXT,
+            base_id INTEGER
+        )
+    """,
+    "messages": """
+        CREATE TABLE IF NOT EXISTS {schema}.messages (
+            id TEXT PRIMARY KEY,
+            from_agent TEXT NOT NULL,
+            to_agent TEXT NOT NULL,
+            content TEXT NOT NULL,
+            priority TEXT NOT NULL,
+            type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            thread_id TEXT,
+            reply_to_id TEXT,
+            path TEXT,
+            depth INTEGER DEFAULT 0,
+            content_codec TEXT
+        )
+    """
+}
+ARCHIVE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_task_history_task_changed ON task_history (task_id, changed_at)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_task_history_changed ON task_history (changed_at)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_messages_thread_timestamp_id ON messages (thread_id, timestamp, id)",
+)
+HISTORY_COLUMNS = (
+    "id, task_id, field_name, old_value, new_value, changed_at, changed_by, old_value_codec, new_value_codec, base_id"
+)
+ARCHIVE_MESSAGE_COLUMNS = MESSAGE_COLUMNS.replace("reply_to_id, depth", "reply_to_id, path, depth, content_codec")
+HISTORY_INSERT = """
+    INSERT INTO task_history (
+        task_id, field_name, old_value, new_value, changed_at, changed_by, old_value_codec, new_value_codec, base_id
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# Free-text task fields whose history is stored as deltas against a periodic snapshot
+DELTA_FIELDS = ("title", "description")
+# Compression markers added to tables created before them: table -> columns
+CODEC_COLUMNS = {
+    "messages": ("content_codec",),
+    "task_history": ("old_value_codec", "new_value_codec"),
+}
+
+# Row sources of DatabaseManager.iter_export_rows: table -> (column partitioning rows by day, columns, filter)
+# Title and description history is free text that columnar analytics has no use for and is left out.
+EXPORT_QUERIES = {
+    "tasks": ("created_at", "id, agent, status, error_type, priority, created_at, updated_at, parent_task_id", None),
+    "task_history": (
+        "changed_at",
+        f"task_id, field_name, {_inflated('old_value')}, {_inflated('new_value')}, changed_at, changed_by",
+        f"field_name NOT IN ({', '.join(repr(field) for field in DELTA_FIELDS)})"
+    ),
+}
+
+FTS_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+
+def _snippet(text, match, tokens=12):
+    """
+    Up to ``tokens`` words of ``text`` from around the first word matching the
+    FTS5 query ``match``, matches in brackets, like snippet(..., '[', ']', '...', 12).
+    
+    messages_fts is contentless, so FTS5 cannot cut message snippets itself.
+    """
+    terms = [term.lower() for term in re.findall(r"\w+\*?", match) if term not in FTS_OPERATORS]
+    
+    def matches(word):
+        word = word.lower()
+        return any(word.startswith(term[:-1]) if term.endswith("*") else word == term for term in terms)
+    
+    words = list(re.finditer(r"\w+", text))
+    first = next((i for i, word in enumerate(words) if matches(word.group())), 0)
+    start = max(0, min(first - tokens // 4, len(words) - tokens))
+    window = words[start:start + tokens]
+    if not window:
+        return ""
+    
+    parts = ["..." if start else ""]
+    for i, word in enumerate(window):
+        if i:
+            parts.append(text[window[i - 1].end():word.start()])
+        parts.append(f"[{word.group()}]" if matches(word.group()) else word.group())
+    parts.append("..." if start + tokens < len(words) else text[window[-1].end():])
+    return "".join(parts)
+
+def _path_segment(message_id):
+    """Escape a message ID for use as one segment of a materialized thread path."""
+    return message_id.replace("%", "%25").replace("/", "%2F") + "/"
+
+def is_busy_error(error):
+    """Whether an OperationalError is a transient SQLITE_BUSY/SQLITE_LOCKED that is worth retrying."""
+    code = getattr(error, "sqlite_errorcode", None)  # Python 3.11+
+    if code is not None:
+        return code & 0xFF in (5, 6)  # SQLITE_BUSY, SQLITE_LOCKED
+    message = str(error)
+    return "database is locked" in message or "database table is locked" in message or "busy" in message
+
+def read_only_uri(db_path):
+    """SQLite URI opening ``db_path``, a file path or ``file:`` URI, read-only."""
+    path = str(db_path)
+    if path.startswith("file:"):
+        return f"{path}{'&' if '?' in path else '?'}mode=ro"
+    return f"{Path(path).resolve().as_uri()}?mode=ro"
+
+def _minutes_between(start, end):
+    """Minutes elapsed between two ISO-8601 timestamps, as julianday() in the rollup triggers computes them."""
+    return (parse_timestamp(end) - parse_timestamp(start)).total_seconds() / 60
+
+# Literals and placeholder lists folded away when grouping statements by template
+_STATEMENT_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+@functools.lru_cache(maxsize=1024)
+def statement_template(sql):
+    """Normalize a SQL statement to the template its metrics are recorded under."""
+    sql = " ".join(sql.split())
+    sql = _STATEMENT_LITERALS.sub("?", sql)
+    return _PLACEHOLDER_LISTS.sub("(?, ...)", sql)
+
+class QueryInstrumentation:
+    """
+    Records statement latency, row counts and lock waits in the Prometheus
+    registry, and logs statements slower than ``slow_query_ms``.
+    """
+    
+    def __init__(self, slow_query_ms):
+        self.slow_query_seconds = slow_query_ms / 1000
+    
+    def observe(self, sql, elapsed, rows):
+        template = statement_template(sql)
+        DB_STATEMENT_SECONDS.labels(template).observe(elapsed)
+        if rows:
+            DB_STATEMENT_ROWS.labels(template).inc(rows)
+        if elapsed >= self.slow_query_seconds:
+            slow_query_logger.warning("Slow query (%.1f ms, %d rows): %s", elapsed * 1000, rows, template)
+    
+    def lock_wait(self, kind, elapsed):
+        DB_LOCK_WAIT_SECONDS.labels(kind).observe(elapsed)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that times each statement from execution until its results are
+    exhausted, the cursor is re-executed or closed, or it is garbage collected.
+    """
+    
+    _statement = None
+    
+    def _run(self, method, sql, parameters):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            method(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                # Gave up after busy_timeout waiting on another connection's lock
+                self.connection.instrumentation.lock_wait("busy", time.perf_counter() - start)
+            raise
+        self._statement = sql
+        self._elapsed = time.perf_counter() - start
+        self._rows = 0
+        if self.description is None:
+            # Statements without a result set are complete once executed
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+        return self
+    
+    def _fetched(self, start, rows, exhausted):
+        if self._statement is not None:
+            self._elapsed += time.perf_counter() - start
+            self._rows += rows
+            if exhausted:
+                self._finish()
+    
+    def _finish(self):
+        if self._statement is not None:
+            statement, self._statement = self._statement, None
+            self.connection.instrumentation.observe(statement, self._elapsed, self._rows)
+    
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+    
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1, row is None)
+        return row
+    
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+    
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+    
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+    
+    def close(self):
+        self._finish()
+        super().close()
+    
+    def __del__(self):
+        self._finish()
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors report to ``instrumentation``, and which times its commits."""
+    
+    instrumentation = None
+    
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        self.instrumentation.observe("COMMIT", time.perf_counter() - start, 0)
+
+class ConnectionPool:
+    """
+    Bounded pool of SQLite connections shared by all threads of the process.
+    
+    Connections are checked out for the duration of a ``with`` block and handed
+    back afterwards, so the number of open connections never exceeds
+    ``pool_size`` no matter how many worker threads come and go.
+    
+    A ``read_only`` pool opens its connections with ``mode=ro`` and
+    ``query_only`` and runs each ``with`` block in one read transaction, so
+    every query in the block sees the same WAL snapshot and never takes a
+    lock that writers wait on.
+    """
+    
+    def __init__(self, db_path, config=None, read_only=False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.config = {**DATABASE_CONFIG, **(config or {})}
+        self.pool_size = self.config["pool_size"]
+        self.idle_timeout = self.config["idle_timeout"]
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._in_use = {}  # thread id -> (thread, connection)
+        self._opened = 0
+        self._closed = False
+        self._local = threading.local()
+        self._condition = threading.Condition(threading.Lock())
+        # Off by default: uninstrumented connections are plain sqlite3 connections
+        self.instrumentation = None
+        if self.config["instrument_queries"]:
+            self.instrumentation = QueryInstrumentation(self.config["slow_query_ms"])
+    
+    def _connect(self):
+        """Open a new connection and apply the configured pragmas."""
+        conn = sqlite3.connect(
+            read_only_uri(self.db_path) if self.read_only else self.db_path,
+            timeout=self.config["timeout"],
+            check_same_thread=False,
+            uri=True,
+            factory=InstrumentedConnection if self.instrumentation else sqlite3.Connection
+        )
+        if self.instrumentation:
+            conn.instrumentation = self.instrumentation
+        register_codecs(conn)
+        if self.read_only:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            # auto_vacuum only takes effect on a database without tables, so it must come first
+            conn.execute(f"PRAGMA auto_vacuum = {self.config['auto_vacuum']}")
+            conn.execute(f"PRAGMA journal_mode = {self.config['journal_mode']}")
+            conn.execute(f"PRAGMA synchronous = {self.config['synchronous']}")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.config['busy_timeout'])}")
+        conn.execute(f"PRAGMA cache_size = {int(self.config['cache_size'])}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.config['mmap_size'])}")
+        # Enable foreign keys
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+    
+    def _reap(self):
+        """Close idle connections past their timeout and those held by dead threads."""
+        now = time.monotonic()
+        fresh = []
+        for conn, last_used in self._idle:
+            if now - last_used > self.idle_timeout:
+                conn.close()
+                self._opened -= 1
+            else:
+                fresh.append((conn, last_used))
+        self._idle = fresh
+        
+        for thread_id, (thread, conn) in list(self._in_use.items()):
+            if not thread.is_alive():
+                del self._in_use[thread_id]
+                conn.close()
+                self._opened -= 1
+    
+    def _acquire(self):
+        with self._condition:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+            
+            started = time.monotonic()
+            deadline = started + self.config["timeout"]
+            self._reap()
+            waited = False
+            while not self._idle and self._opened >= self.pool_size:
+                waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"Timed out waiting for one of {self.pool_size} pooled connections"
+                    )
+                self._condition.wait(remaining)
+                self._reap()
+            if waited and self.instrumentation:
+                self.instrumentation.lock_wait("pool", time.monotonic() - started)
+            
+            if self._idle:
+                conn, _ = self._idle.pop(self._affine_index())
+            else:
+                self._opened += 1
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+            
+            thread = threading.current_thread()
+            self._in_use[thread.ident] = (thread, conn)
+            self._local.last_conn = conn
+            return conn
+    
+    def _affine_index(self):
+        """Index of the idle connection this thread used last, or of the most recently used one."""
+        last_conn = getattr(self._local, "last_conn", None)
+        for index, (conn, _) in enumerate(self._idle):
+            if conn is last_conn:
+                return index
+        return -1
+    
+    def _release(self, conn):
+        with self._condition:
+            self._in_use.pop(threading.get_ident(), None)
+            if self._closed:
+                conn.close()
+                self._opened -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+    
+    def _begin_immediate(self, conn):
+        """Start a write transaction, taking the write lock up front."""
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        DB_LOCK_WAIT_SECONDS.labels("write_lock").observe(time.perf_counter() - start)
+    
+    @contextmanager
+    def connection(self, write=False):
+        """
+        Check out a connection for the current thread.
+        
+        Nested calls on the same thread reuse the connection that is already
+        checked out and run inside a savepoint, so an error only undoes the
+        nested block. The outermost block commits on success and rolls back on
+        error, like using a ``sqlite3.Connection`` as a context manager.
+        
+        With ``write`` the transaction starts with BEGIN IMMEDIATE, so the
+        write lock is taken (or waited for) before anything is read. A deferred
+        transaction that reads first and writes later can otherwise fail with
+        SQLITE_BUSY when another process wrote in between.
+        """
+        if write and self.read_only:
+            raise sqlite3.ProgrammingError("Read-only pool cannot hand out write connections")
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            savepoint = f"pool_sp_{self._local.depth}"
+            if not conn.in_transaction:
+                if write:
+                    self._begin_immediate(conn)
+                else:
+                    conn.execute("BEGIN")
+            conn.execute(f"SAVEPOINT {savepoint}")
+            try:
+                yield conn
+                conn.execute(f"RELEASE {savepoint}")
+            except BaseException:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                raise
+            finally:
+                self._local.depth -= 1
+            return
+        
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            if write:
+                self._begin_immediate(conn)
+            elif self.read_only:
+                # The snapshot is taken by the first read and held until the block ends
+                conn.execute("BEGIN")
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._release(conn)
+    
+    def retry_busy(self, fn, *args, **kwargs):
+        """
+        Call ``fn``, retrying while the database is busy.
+        
+        SQLite's busy handler already waits up to ``busy_timeout`` for a lock;
+        this covers what it cannot, such as a lock held past the timeout by
+        another process or a stale WAL snapshot. Retries back off exponentially
+        with full jitter, so competing processes do not retry in lockstep. Calls
+        nested in an open transaction are not retried; the outermost one is.
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                nested = getattr(self._local, "conn", None) is not None
+                if nested or not is_busy_error(e) or attempt >= self.config["busy_retries"]:
+                    raise
+                delay = min(self.config["busy_retry_max_delay"], self.config["busy_retry_base_delay"] * 2 ** attempt)
+                attempt += 1
+                DB_BUSY_RETRIES.labels(getattr(fn, "__name__", "operation")).inc()
+                time.sleep(random.uniform(0, delay))
+    
+    def stats(self) -> Dict:
+        """Get the current pool occupancy."""
+        with self._condition:
+            return {
+                "pool_size": self.pool_size,
+                "open": self._opened,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use)
+            }
+    
+    def close(self):
+        """Close idle connections; checked-out ones are closed when released."""
+        with self._condition:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+                self._opened -= 1
+            self._idle = []
+            self._condition.notify_all()
+
+class ResultCache:
+    """
+    LRU cache of query results that empties itself whenever the database changes.
+    
+    Changes are detected with ``PRAGMA data_version`` on a read-only
+    connection of the cache's own. Its value moves whenever any other
+    connection, in this process or another, commits to the database, so a
+    lookup costs one pragma. Entries are evicted least recently used first
+    once there are more than ``max_entries`` or their results take more than
+    ``max_bytes``.
+    """
+    
+    def __init__(self, db_path, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(read_only_uri(db_path), uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (result, size), least recently used first
+        self._bytes = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+    
+    def _current_version(self):
+        """Read data_version, dropping every entry if the database changed. Call with the lock held."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+        return version
+    
+    def get_or_compute(self, key, compute):
+        """Return the cached result for ``key``, or ``compute()`` and cache it."""
+        with self._lock:
+            version = self._current_version()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+        
+        result = compute()
+        size = sys.getsizeof(result)
+        with self._lock:
+            # A write during compute() may have emptied the cache since; the result could predate it
+            if self._version == version and size <= self.max_bytes:
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)[1]
+                self._entries[key] = (result, size)
+                self._bytes += size
+                while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                    self._bytes -= self._entries.popitem(last=False)[1][1]
+        return result
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+    
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._conn.close()
+
+class GroupCommitWriter:
+    """
+    Single writer thread that coalesces queued writes into group commits.
+    
+    Each submitted operation runs in its own savepoint on the writer's
+    connection. A batch takes every write queued behind its first one, up to
+    ``max_ops`` operations or ``max_delay`` seconds of collecting, and is
+    committed once; writes that arrive during a commit form the next batch.
+    The future returned by ``submit`` resolves only after the batch commits.
+    """
+    
+    def __init__(self, pool, max_ops=None, max_delay=None):
+        self.pool = pool
+        self.max_ops = max_ops or pool.config["group_commit_max_ops"]
+        self.max_delay = pool.config["group_commit_max_delay"] if max_delay is None else max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="DatabaseWriter", daemon=True)
+        self._thread.start()
+    
+    def is_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+    
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue ``fn(*args, **kwargs)`` for the next group commit."""
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+    
+    def _run(self):
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            # Take whatever queued up behind the first write, bounded by size and time
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_ops and time.monotonic() < deadline:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            
+            self._commit_batch(batch)
+    
+    def _commit_batch(self, batch):
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        try:
+            outcomes = self.pool.retry_busy(self._apply_batch, batch)
+        except Exception as e:
+            # The commit itself failed, so none of the batch is durable
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def _apply_batch(self, batch):
+        outcomes = []
+        with self.pool.connection(write=True):
+            for fn, args, kwargs, future in batch:
+                try:
+                    with self.pool.connection():
+                        outcomes.append((future, fn(*args, **kwargs), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+        return outcomes
+    
+    def close(self):
+        """Flush queued writes and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+def replayable_arguments(args, kwargs):
+    """Read one-shot iterators, such as generators, among a write's arguments into lists so a retry sees all of them."""
+    return (
+        [list(arg) if isinstance(arg, Iterator) else arg for arg in args],
+        {key: list(value) if isinstance(value, Iterator) else value for key, value in kwargs.items()}
+    )
+
+def write_operation(method):
+    """
+    Route a DatabaseManager write through the group-commit writer when
+    write-behind is enabled, and retry it while the database is busy otherwise.
+    Either way a busy error can re-run the whole write, so its iterator
+    arguments are read into lists first.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        args, kwargs = replayable_arguments(args, kwargs)
+        writer = self.writer
+        if writer is None or writer.is_writer_thread():
+            return self.connection_pool.retry_busy(method, self, *args, **kwargs)
+        return writer.submit(method, self, *args, **kwargs).result()
+    wrapper.is_write_operation = True
+    return wrapper
 
 class DatabaseManager:
     """
@@ -14,7 +1042,7 @@ class DatabaseManager:
     _instance = None
     _lock = threading.Lock()
     
-    def __new__(cls, db_path="agency_data.db"):
+    def __new__(cls, db_path="agency_data.db", config=None):
         """Implement singleton pattern for connection pooling."""
         if cls._instance is None:
             with cls._lock:
@@ -22,26 +1050,103 @@ class DatabaseManager:
                     cls._instance = super(DatabaseManager, cls).__new__(cls)
         return cls._instance
     
-    def __init__(self, db_path="agency_data.db"):
+    def __init__(self, db_path="agency_data.db", config=None):
         """Initialize database connection and create tables if they don't exist."""
         if not hasattr(self, 'initialized'):
             self.db_path = db_path
-            self.connection_pool = {}
-            self._create_tables()
+            self.connection_pool = ConnectionPool(db_path, config)
+            compression = self.connection_pool.config["compression"]
+            if compression == "auto":
+                compression = "zstd" if zstandard is not None else "zlib"
+            self.codec = compression or None
+            self.compress_min_bytes = self.connection_pool.config["compress_min_bytes"]
+            # Several processes may open the same file at once; schema setup takes turns
+            self.connection_pool.retry_busy(self._create_tables)
+            read_pool_size = self.connection_pool.config["read_pool_size"]
+            self.read_pool = None
+            if read_pool_size and str(db_path) != ":memory:":
+                self.read_pool = ConnectionPool(
+                    db_path, {**self.connection_pool.config, "pool_size": read_pool_size}, read_only=True
+                )
+            self.result_cache = None
+            if self.connection_pool.config["result_cache_entries"] and str(db_path) != ":memory:":
+                self.result_cache = ResultCache(
+                    db_path,
+                    self.connection_pool.config["result_cache_entries"],
+                    self.connection_pool.config["result_cache_bytes"]
+                )
+            self.writer = None
+            if self.connection_pool.config["write_behind"]:
+                self.writer = GroupCommitWriter(self.connection_pool)
             self.initialized = True
     
-    def _get_connection(self):
-        """Get a thread-specific database connection."""
-        thread_id = threading.get_ident()
-        if thread_id not in self.connection_pool:
-            self.connection_pool[thread_id] = sqlite3.connect(self.db_path)
-            # Enable foreign keys
-            self.connection_pool[thread_id].execute("PRAGMA foreign_keys = ON")
-        return self.connection_pool[thread_id]
+    @classmethod
+    def open(cls, db_path, config=None):
+        """Open a manager for ``db_path`` that is separate from the process-wide instance."""
+        manager = super(DatabaseManager, cls).__new__(cls)
+        manager.__init__(db_path, config)
+        return manager
+    
+    def _get_connection(self, write=False):
+        """Check out a pooled database connection for use in a ``with`` block; see ConnectionPool.connection."""
+        return self.connection_pool.connection(write)
+    
+    def _get_read_connection(self):
+        """
+        Check out a read-only snapshot connection for analytics and reporting queries.
+        
+        Long scans on these connections neither queue for the pooled
+        connections that writers use nor see writes committed after their
+        first read. Falls back to the main pool when ``read_pool_size`` is 0.
+        """
+        return (self.read_pool or self.connection_pool).connection()
+    
+    def read_snapshot(self):
+        """
+        Read through several manager calls in a ``with`` block as of one snapshot.
+        
+        Reads on this thread inside the block reuse its read connection and
+        transaction, so they all see the database as of the block's first read.
+        """
+        return self._get_read_connection()
+    
+    def cached(self, key, compute):
+        """
+        Return ``compute()``, reusing its result for ``key`` until the database changes.
+        
+        ``key`` must identify the query and every parameter it depends on.
+        Without a result cache (``result_cache_entries`` 0) this always computes.
+        """
+        if self.result_cache is None:
+            return compute()
+        return self.result_cache.get_or_compute(key, compute)
+    
+    def submit(self, operation, *args, **kwargs) -> Future:
+        """
+        Run a write operation such as ``"add_task"`` and return a future for its result.
+        
+        With write-behind enabled the future resolves once the group commit
+        containing the write is durable; otherwise the write runs immediately.
+        """
+        method = getattr(type(self), operation, None)
+        if not getattr(method, "is_write_operation", False):
+            raise ValueError(f"{operation} is not a write operation")
+        
+        if self.writer is not None:
+            args, kwargs = replayable_arguments(args, kwargs)
+            return self.writer.submit(method.__wrapped__, self, *args, **kwargs)
+        
+        future = Future()
+        try:
+            # Through the wrapper, so busy errors are retried as for a direct call
+            future.set_result(method(self, *args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
     
     def _create_tables(self):
         """Create necessary tables if they don't exist."""
-        with self._get_connection() as conn:
+        with self._get_connection(write=True) as conn:
             cursor = conn.cursor()
             
             # Create tasks table
@@ -57,9 +1162,13 @@ class DatabaseManager:
                     updated_at TEXT NOT NULL,
                     dependencies TEXT,
                     parent_task_id TEXT,
+                    error_type TEXT,
                     FOREIGN KEY(parent_task_id) REFERENCES tasks(id)
                 )
             """)
+            cursor.execute("PRAGMA table_info(tasks)")
+            if "error_type" not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute("ALTER TABLE tasks ADD COLUMN error_type TEXT")
             
             # Create task_history table
             cursor.execute("""
@@ -71,6 +1180,9 @@ class DatabaseManager:
                     new_value TEXT,
                     changed_at TEXT NOT NULL,
                     changed_by TEXT NOT NULL,
+                    old_value_codec TEXT,
+                    new_value_codec TEXT,
+                    base_id INTEGER,
                     FOREIGN KEY(task_id) REFERENCES tasks(id)
                 )
             """)
@@ -88,215 +1200,935 @@ class DatabaseManager:
                     timestamp TEXT NOT NULL,
                     thread_id TEXT,
                     reply_to_id TEXT,
+                    path TEXT,
+                    depth INTEGER DEFAULT 0,
+                    content_codec TEXT,
                     FOREIGN KEY(reply_to_id) REFERENCES messages(id)
                 )
             """)
+            self._migrate_message_paths(cursor)
             
-            # Create task_stats table
+            # Create task_dependencies table; one edge per dependency, mirroring tasks.dependencies
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_dependencies'")
+            backfill_dependencies = cursor.fetchone() is None
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_dependencies (
+                    task_id TEXT NOT NULL,
+                    depends_on TEXT NOT NULL,
+                    PRIMARY KEY (task_id, depends_on),
+                    FOREIGN KEY(task_id) REFERENCES tasks(id)
+                ) WITHOUT ROWID
+            """)
+            if backfill_dependencies:
+                self._migrate_task_dependencies(cursor)
+            
+            # Create task_stats table; completion times are kept as running sums
+            # so that avg_completion_time and its variance update in O(1)
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS task_stats (
                     agent TEXT PRIMARY KEY,
                     tasks_completed INTEGER DEFAULT 0,
                     tasks_pending INTEGER DEFAULT 0,
                     avg_completion_time REAL DEFAULT 0,
-                    last_updated TEXT NOT NULL
+                    last_updated TEXT NOT NULL,
+                    completion_time_sum REAL DEFAULT 0,
+                    completion_time_sumsq REAL DEFAULT 0,
+                    completion_time_sketch TEXT
                 )
             """)
+            self._migrate_task_stats(cursor)
+            self._create_bulk_load_guard(cursor)
+            self._create_rollups(cursor)
+            
+            # Completion-time sketches per agent and bucket, for percentiles over any window
+            for table in LATENCY_TABLES:
+                cursor.execute(LATENCY_SCHEMA.format(table=table))
+            compress_existing = self._migrate_compression(cursor)
+            self._migrate_history_deltas(cursor)
+            
+            self._create_indexes(cursor)
+            self.fts_enabled = self._create_search_index(cursor)
+            if compress_existing:
+                self._compress_rows(cursor)
             
             conn.commit()
     
-    def backup_database(self, backup_dir="backups"):
-        """Create a backup of the database."""
+    def _migrate_task_stats(self, cursor):
+        """Add the running-sum and sketch columns to task_stats tables created before they existed."""
+        cursor.execute("PRAGMA table_info(task_stats)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "completion_time_sketch" not in columns:
+            # Earlier completions are not in the sketch; percentiles cover completions from now on
+            cursor.execute("ALTER TABLE task_stats ADD COLUMN completion_time_sketch TEXT")
+        if "completion_time_sum" in columns:
+            return
+        
+        cursor.execute("ALTER TABLE task_stats ADD COLUMN completion_time_sum REAL DEFAULT 0")
+        cursor.execute("ALTER TABLE task_stats ADD COLUMN completion_time_sumsq REAL DEFAULT 0")
+        # Seed the sums from the stored mean; the variance starts at zero
+        cursor.execute("""
+            UPDATE task_stats SET
+                completion_time_sum = avg_completion_time * tasks_completed,
+                completion_time_sumsq = avg_completion_time * avg_completion_time * tasks_completed
+        """)
+    
+    def _create_bulk_load_guard(self, cursor):
+        """Create the bulk_load table and drop insert triggers created before they checked it."""
+        cursor.execute(BULK_LOAD_SCHEMA)
+        cursor.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' for _ in BULK_GUARDED_TRIGGERS)})",
+            BULK_GUARDED_TRIGGERS
+        )
+        for name, sql in cursor.fetchall():
+            if "bulk_load" not in sql:
+                cursor.execute(f"DROP TRIGGER {name}")
+    
+    def _create_rollups(self, cursor):
+        """
+        Create the hourly and daily task rollups and the triggers that maintain them.
+        
+        Each rollup row holds, for one bucket, agent, status and error type, the
+        number of tasks created in the bucket that are now in that state (with
+        their priority sum) and the completions that happened in the bucket
+        (with the minutes each took). Rollups created for an existing database
+        are filled from the tasks; completed tasks count as completed at their
+        updated_at.
+        """
+        cursor.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'table' AND name IN ({', '.join('?' for _ in ROLLUP_TABLES)})",
+            tuple(ROLLUP_TABLES)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        for table, width in ROLLUP_TABLES.items():
+            cursor.execute(ROLLUP_SCHEMA.format(table=table))
+            if table in existing:
+                continue
+            for statement in _rollup_load(table, width, "1"):
+                cursor.execute(statement)
+        for trigger in ROLLUP_TRIGGERS:
+            cursor.execute(trigger)
+    
+    def _migrate_task_dependencies(self, cursor):
+        """Fill task_dependencies from the JSON dependency lists of existing tasks."""
+        cursor.execute("""
+            INSERT OR IGNORE INTO task_dependencies (task_id, depends_on)
+            SELECT t.id, d.value
+            FROM tasks t, json_each(t.dependencies) d
+            WHERE json_valid(t.dependencies) AND json_type(t.dependencies) = 'array'
+        """)
+    
+    def _migrate_compression(self, cursor, schema="main") -> bool:
+        """Add the compression marker columns to tables created before them; True if any were added."""
+        added = False
+        for table, columns in CODEC_COLUMNS.items():
+            cursor.execute(f"PRAGMA {schema}.table_info({table})")
+            existing = {row[1] for row in cursor.fetchall()}
+            for column in columns:
+                if column not in existing:
+                    cursor.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {column} TEXT")
+                    added = True
+        return added
+    
+    def _migrate_history_deltas(self, cursor, schema="main"):
+        """Add the delta base column to task_history tables created before it; their rows are all snapshots."""
+        cursor.execute(f"PRAGMA {schema}.table_info(task_history)")
+        if "base_id" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {schema}.task_history ADD COLUMN base_id INTEGER")
+    
+    def _compress_rows(self, cursor) -> Dict:
+        """Compress stored values over the threshold that were written uncompressed."""
+        counts = {}
+        if not self.codec:
+            return counts
+        for table, columns in (("messages", ("content",)), ("task_history", ("old_value", "new_value"))):
+            counts[table] = 0
+            for column in columns:
+                last_rowid = 0
+                while True:
+                    cursor.execute(f"""
+                        SELECT rowid, {column} FROM {table}
+                        WHERE rowid > ? AND {column}_codec IS NULL AND length(CAST({column} AS BLOB)) >= ?
+                        ORDER BY rowid
+                        LIMIT ?
+                    """, (last_rowid, self.compress_min_bytes, self.connection_pool.config["bulk_chunk_size"]))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    last_rowid = rows[-1][0]
+                    packed = [(*compress_text(value, self.compress_min_bytes, self.codec), rowid) for rowid, value in rows]
+                    packed = [row for row in packed if row[1] is not None]
+                    cursor.executemany(f"UPDATE {table} SET {column} = ?, {column}_codec = ? WHERE rowid = ?", packed)
+                    if table == "messages" and self.fts_enabled:
+                        # The update trigger unindexed the plain text and leaves compressed text to us
+                        compressed = {row[2] for row in packed}
+                        cursor.executemany(
+                            "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)",
+                            [row for row in rows if row[0] in compressed]
+                        )
+                    counts[table] += len(packed)
+        return counts
+    
+    def compress_existing_rows(self) -> Dict:
+        """
+        Compress message content and history values that were stored uncompressed.
+        
+        Runs automatically once when the compression columns are added; call it
+        again after enabling compression or lowering ``compress_min_bytes``.
+        Returns the number of values compressed per table. The file only
+        shrinks once the freed pages are vacuumed.
+        """
+        with self._get_connection(write=True) as conn:
+            counts = self._compress_rows(conn.cursor())
+        with self._get_connection() as conn:
+            conn.executescript("PRAGMA incremental_vacuum;")
+        return counts
+    
+    def _migrate_message_paths(self, cursor):
+        """Backfill materialized thread paths for messages tables created before they existed."""
+        cursor.execute("PRAGMA table_info(messages)")
+        columns = {row[1] for row in cursor.fetchall()}
+        if "path" in columns:
+            return
+        
+        cursor.execute("ALTER TABLE messages ADD COLUMN path TEXT")
+        cursor.execute("ALTER TABLE messages ADD COLUMN depth INTEGER DEFAULT 0")
+        # Walk each reply tree once from its root; replies that only carried
+        # their own ID as thread ID join the thread of their root
+        cursor.execute("""
+            WITH RECURSIVE tree(id, thread_id, path, depth) AS (
+                SELECT id, thread_id, replace(replace(id, '%', '%25'), '/', '%2F') || '/', 0
+                FROM messages
+                WHERE reply_to_id IS NULL
+                OR reply_to_id NOT IN (SELECT id FROM messages)
+                UNION ALL
+                SELECT m.id,
+                    CASE WHEN m.thread_id = m.id THEN t.thread_id ELSE m.thread_id END,
+                    t.path || replace(replace(m.id, '%', '%25'), '/', '%2F') || '/',
+                    t.depth + 1
+                FROM messages m
+                JOIN tree t ON m.reply_to_id = t.id
+            )
+            UPDATE messages
+            SET thread_id = tree.thread_id, path = tree.path, depth = tree.depth
+            FROM tree
+            WHERE messages.id = tree.id
+        """)
+    
+    def _create_indexes(self, cursor):
+        """Create the secondary indexes in INDEXES if they don't exist."""
+        for name in RETIRED_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        for name, (table, columns) in INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+    
+    def _create_search_index(self, cursor) -> bool:
+        """
+        Create FTS5 indexes over message content and task text, kept in sync by triggers.
+        
+        Returns False when the SQLite build lacks FTS5, in which case search is unavailable.
+        """
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE name IN ('messages_fts', 'tasks_fts')")
+        existing = dict(cursor.fetchall())
+        if "messages_fts" in existing and "content=''" not in existing["messages_fts"]:
+            # Indexed from messages directly, or through a view calling inflate(); re-create contentless
+            for name in ("insert", "delete", "update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS messages_fts_{name}")
+            cursor.execute("DROP TABLE messages_fts")
+            del existing["messages_fts"]
+        cursor.execute("DROP VIEW IF EXISTS messages_fts_source")
+        
+        # Contentless, so compressed text is not stored twice; snippets are cut in search_messages
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                USING fts5(content, content='')
+            """)
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts
+                USING fts5(title, description, content='tasks', content_rowid='rowid')
+            """)
+        except sqlite3.OperationalError:
+            return False
+        
+        for trigger in SEARCH_TRIGGERS:
+            cursor.execute(trigger)
+        
+        # Index rows written before the search index existed
+        if "messages_fts" not in existing:
+            cursor.execute(f"INSERT INTO messages_fts (rowid, content) SELECT rowid, {_inflated('content')} FROM messages")
+        if "tasks_fts" not in existing:
+            cursor.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+        return True
+    
+    def _archive_dir(self):
+        return self.connection_pool.config["archive_dir"] or os.path.join(
+            os.path.dirname(os.path.abspath(self.db_path)), "archive"
+        )
+    
+    def _archive_path(self, month):
+        """Path of the archive database for a ``YYYY-MM`` month."""
+        stem = os.path.splitext(os.path.basename(self.db_path))[0]
+        return os.path.join(self._archive_dir(), f"{stem}_{month.replace('-', '_')}.db")
+    
+    def _archive_months(self, since=None, until=None) -> List[str]:
+        """Months (``YYYY-MM``) that have an archive database, limited to [since, until]."""
+        archive_dir = self._archive_dir()
+        if not os.path.isdir(archive_dir):
+            return []
+        
+        stem = os.path.splitext(os.path.basename(self.db_path))[0]
+        months = []
+        for name in os.listdir(archive_dir):
+            match = re.fullmatch(re.escape(stem) + r"_(\d{4})_(\d{2})\.db", name)
+            if not match:
+                continue
+            month = f"{match.group(1)}-{match.group(2)}"
+            if (since is None or month >= since[:7]) and (until is None or month <= until[:7]):
+                months.append(month)
+        return sorted(months)
+    
+    def _query_archives(self, conn, months, query, params) -> List[tuple]:
+        """
+        Run ``query`` against each month's archive, attached read-only one at a time.
+        
+        ``query`` refers to the archive tables through a ``{schema}`` placeholder.
+        """
+        rows = []
+        for month in months:
+            schema = f"archive_{month.replace('-', '_')}"
+            conn.execute("ATTACH DATABASE ? AS " + schema, (f"file:{self._archive_path(month)}?mode=ro",))
+            try:
+                rows.extend(conn.execute(query.format(schema=schema), params).fetchall())
+            finally:
+                conn.execute(f"DETACH DATABASE {schema}")
+        return rows
+    
+    def iter_export_rows(self, table, since=None) -> Iterator[tuple]:
+        """
+        Stream every row of ``tasks`` or ``task_history`` in EXPORT_QUERIES order by day.
+        
+        Rows come oldest first by their partitioning column, from ``since``
+        (an ISO date or time, truncated to its day) on. Archived history is
+        read before the hot table, so days that straddle the archive cutoff
+        still come out in one run. Rows are read a page at a time, keyset on
+        the partitioning column and rowid, and no connection or attached
+        archive is held between pages, so the generator can be abandoned.
+        """
+        day_column, columns, condition = EXPORT_QUERIES[table]
+        clauses = [condition] if condition else []
+        params = []
+        if since:
+            clauses.append(f"{day_column} >= ?")
+            params.append(since[:10])
+        page_size = max(self.connection_pool.config["page_size"], self.connection_pool.config["bulk_chunk_size"])
+        
+        months = self._archive_months(since) if table == "task_history" else []
+        for month in months + [None]:
+            schema = f"archive_{month.replace('-', '_')}" if month else "main"
+            last_key = None
+            while True:
+                page_clauses, page_params = list(clauses), list(params)
+                if last_key is not None:
+                    page_clauses.append(f"({day_column}, rowid) > (?, ?)")
+                    page_params.extend(last_key)
+                sql = f"""
+                    SELECT {columns}, {day_column}, rowid FROM {schema}.{table}
+                    WHERE {' AND '.join(page_clauses) or '1'}
+                    ORDER BY {day_column}, rowid
+                    LIMIT ?
+                """
+                with self._get_connection() as conn:
+                    if month:
+                        conn.execute("ATTACH DATABASE ? AS " + schema, (f"file:{self._archive_path(month)}?mode=ro",))
+                    try:
+                        rows = conn.execute(sql, page_params + [page_size]).fetchall()
+                    finally:
+                        if month:
+                            conn.execute(f"DETACH DATABASE {schema}")
+                for row in rows:
+                    yield row[:-2]
+                if len(rows) < page_size:
+                    break
+                last_key = rows[-1][-2:]
+    
+    def archive_old_rows(self, older_than_days=None) -> Dict:
+        """
+        Move old task history and messages into monthly archive databases.
+        
+        History rows older than ``older_than_days`` (default: the configured
+        ``archive_after_days``) go to the archive of the month they were
+        written in. Message threads move as a whole once their latest message
+        is that old, into the archive of that latest message's month; threads
+        linked to other threads by replies stay hot. Rows are copied with
+        INSERT OR IGNORE before being deleted, so re-running after an
+        interruption is safe. Freed pages are then returned to the filesystem
+        with an incremental vacuum.
+        """
+        older_than_days = older_than_days if older_than_days is not None else self.connection_pool.config["archive_after_days"]
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+        os.makedirs(self._archive_dir(), exist_ok=True)
+        moved = {"task_history": 0, "messages": 0}
+        archives = set()
+        
+        with self._get_connection(write=True) as conn:
+            history_months = [row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(changed_at, 1, 7) FROM task_history WHERE changed_at < ?", (cutoff,)
+            )]
+            
+            # Threads whose newest message is older than the cutoff, by month of that message
+            linked = {row[0] for row in conn.execute("""
+                SELECT p.thread_id FROM messages r JOIN messages p ON p.id = r.reply_to_id
+                WHERE r.thread_id != p.thread_id
+                UNION
+                SELECT r.thread_id FROM messages r JOIN messages p ON p.id = r.reply_to_id
+                WHERE r.thread_id != p.thread_id
+            """)}
+            threads_by_month = {}
+            for thread_id, last_timestamp in conn.execute("""
+                SELECT thread_id, MAX(timestamp) FROM messages
+                GROUP BY thread_id
+                HAVING MAX(timestamp) < ?
+            """, (cutoff,)):
+                if thread_id not in linked:
+                    threads_by_month.setdefault(last_timestamp[:7], []).append(thread_id)
+            
+            for month in sorted(set(history_months) | set(threads_by_month)):
+                archive_path = self._archive_path(month)
+                conn.commit()
+                conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+                try:
+                    for table, ddl in ARCHIVE_SCHEMA.items():
+                        conn.execute(ddl.format(schema="archive"))
+                    for ddl in ARCHIVE_INDEXES:
+                        conn.execute(ddl.format(schema="archive"))
+                    self._migrate_compression(conn.cursor(), schema="archive")
+                    self._migrate_history_deltas(conn.cursor(), schema="archive")
+                    
+                    if month in history_months:
+                        self._materialize_split_deltas(conn, cutoff, month)
+                        conn.execute(f"""
+                            INSERT OR IGNORE INTO archive.task_history ({HISTORY_COLUMNS})
+                            SELECT {HISTORY_COLUMNS} FROM main.task_history
+                            WHERE changed_at < ? AND substr(changed_at, 1, 7) = ?
+                        """, (cutoff, month))
+                        moved["task_history"] += conn.execute("""
+                            DELETE FROM main.task_history
+                            WHERE changed_at < ? AND substr(changed_at, 1, 7) = ?
+                        """, (cutoff, month)).rowcount
+                    
+                    for thread_id in threads_by_month.get(month, []):
+                        conn.execute(f"""
+                            INSERT OR IGNORE INTO archive.messages ({ARCHIVE_MESSAGE_COLUMNS})
+                            SELECT {ARCHIVE_MESSAGE_COLUMNS} FROM main.messages WHERE thread_id = ?
+                        """, (thread_id,))
+                        if self.fts_enabled:
+                            # The delete trigger only unindexes plain text
+                            conn.execute(f"""
+                                INSERT INTO main.messages_fts (messages_fts, rowid, content)
+                                SELECT 'delete', rowid, {_inflated('content')} FROM main.messages
+                                WHERE thread_id = ? AND content_codec IS NOT NULL
+                            """, (thread_id,))
+                        moved["messages"] += conn.execute(
+                            "DELETE FROM main.messages WHERE thread_id = ?", (thread_id,)
+                        ).rowcount
+                    conn.commit()
+                finally:
+                    conn.execute("DETACH DATABASE archive")
+                archives.add(archive_path)
+            
+            if moved["messages"] and self.fts_enabled:
+                # Deletes are recorded as FTS tombstones; merging drops them with the rows
+                conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+                conn.commit()
+            
+            # Give the freed pages back; a file created without auto_vacuum is converted
+            # once, otherwise executescript steps the pragma to completion (execute would
+            # free one page)
+            freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not self._convert_auto_vacuum(conn):
+                conn.executescript("PRAGMA incremental_vacuum;")
+            freed = freelist - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        
+        return {
+            "cutoff": cutoff,
+            "moved": moved,
+            "archives": sorted(archives),
+            "pages_freed": freed
+        }
+    
+    def _convert_auto_vacuum(self, conn) -> bool:
+        """
+        Switch a database created with auto_vacuum NONE to the configured mode.
+        
+        The pragma alone only affects new files; an existing one needs a full
+        VACUUM, which rewrites it once and drops every free page on the way.
+        Returns True when the conversion ran.
+        """
+        mode = self.connection_pool.config["auto_vacuum"]
+        if str(mode).upper() == "NONE" or conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 0:
+            return False
+        conn.executescript(f"PRAGMA auto_vacuum = {mode}; VACUUM;")
+        return True
+    
+    def _materialize_split_deltas(self, conn, cutoff, month):
+        """
+        Store full values in history rows whose snapshot is about to end up in another database.
+        
+        Archiving moves the history of one month; a delta row that moves
+        without its snapshot, or stays behind while its snapshot moves, would
+        lose its base, so it becomes a snapshot itself first.
+        """
+        rows = conn.execute(f"""
+            SELECT h.id, {_inflated('h.old_value')}, {_inflated('h.new_value')}, {_inflated('b.new_value')}
+            FROM task_history h JOIN task_history b ON b.id = h.base_id
+            WHERE (h.changed_at < ? AND substr(h.changed_at, 1, 7) = ?)
+                != (b.changed_at < ? AND substr(b.changed_at, 1, 7) = ?)
+        """, (cutoff, month, cutoff, month)).fetchall()
+        updates = []
+        for history_id, old_delta, new_delta, base in rows:
+            old_value, old_codec = compress_text(apply_delta(base, old_delta), self.compress_min_bytes, self.codec)
+            new_value, new_codec = compress_text(apply_delta(base, new_delta), self.compress_min_bytes, self.codec)
+            updates.append((old_value, new_value, old_codec, new_codec, history_id))
+        conn.executemany("""
+            UPDATE task_history
+            SET old_value = ?, new_value = ?, old_value_codec = ?, new_value_codec = ?, base_id = NULL
+            WHERE id = ?
+        """, updates)
+    
+    def explain(self, query, params=()) -> List[str]:
+        """Return the EXPLAIN QUERY PLAN details for a query, one string per plan step."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"EXPLAIN QUERY PLAN {query}", params)
+            return [row[3] for row in cursor.fetchall()]
+    
+    def backup_database(self, backup_dir="backups", compress=False):
+        """Create an online backup of the database without blocking writers."""
         try:
             os.makedirs(backup_dir, exist_ok=True)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = os.path.join(backup_dir, f"agency_data_backup_{timestamp}.db")
+            if compress:
+                backup_path += ".gz"
             
-            # Create a new backup
-            shutil.copy2(self.db_path, backup_path)
+            # Copy page batches from a pinned snapshot of the live database
+            with self._get_connection() as conn:
+                online_backup(conn, backup_path, compress=compress)
             
-            # Keep only the last 5 backups
-            backups = sorted([f for f in os.listdir(backup_dir) if f.endswith('.db')])
-            for old_backup in backups[:-5]:
-                os.remove(os.path.join(backup_dir, old_backup))
+            # Apply the retention policy by count and age
+            prune_backups(backup_dir, "agency_data_backup_*")
             
             return f"Backup created successfully at {backup_path}"
         except Exception as e:
             return f"Backup failed: {str(e)}"
     
     def restore_database(self, backup_path):
-        """Restore the database from a backup."""
+        """
+        Restore the database from a backup in one atomic swap.
+        
+        The restored file is then brought up to the current schema, as on
+        startup, so backups taken by older versions stay usable.
+        """
         try:
             if not os.path.exists(backup_path):
                 return "Backup file not found"
             
-            # Close all connections
-            for conn in self.connection_pool.values():
-                conn.close()
-            self.connection_pool.clear()
-            
-            # Restore the backup
-            shutil.copy2(backup_path, self.db_path)
+            # Pooled connections stay open; they see the restored data once it commits
+            with self._get_connection() as conn:
+                conn.commit()
+                restore_backup(backup_path, conn)
+            self.connection_pool.retry_busy(self._create_tables)
             return "Database restored successfully"
         except Exception as e:
             return f"Restore failed: {str(e)}"
     
+    @staticmethod
+    def _task_row(task_data):
+        """Convert a task dict into the parameter tuple for an INSERT into tasks."""
+        return (
+            task_data["id"],
+            task_data["title"],
+            task_data["description"],
+            task_data["priority"],
+            task_data["agent"],
+            task_data["status"],
+            task_data["created_at"],
+            task_data["updated_at"],
+            json.dumps(task_data.get("dependencies", [])),
+            task_data.get("parent_task_id"),
+            task_data.get("error_type")
+        )
+    
+    @staticmethod
+    def _task_dict(row):
+        """Convert a row selected with TASK_COLUMNS into a task dict."""
+        return {
+            "id": row[0],
+            "title": row[1],
+            "description": row[2],
+            "priority": row[3],
+            "agent": row[4],
+            "status": row[5],
+            "created_at": row[6],
+            "updated_at": row[7],
+            "dependencies": json.loads(row[8]) if row[8] else [],
+            "parent_task_id": row[9],
+            "error_type": row[10]
+        }
+    
+    @staticmethod
+    def _write_dependencies(cursor, tasks):
+        """Record the dependency edges of newly inserted tasks."""
+        cursor.executemany(
+            "INSERT OR IGNORE INTO task_dependencies (task_id, depends_on) VALUES (?, ?)",
+            [(task_data["id"], depends_on) for task_data in tasks for depends_on in task_data.get("dependencies") or []]
+        )
+    
+    @write_operation
     def add_task(self, task_data):
         """Add a new task to the database with history tracking."""
-        with self._get_connection() as conn:
+        with self._get_connection(write=True) as conn:
             cursor = conn.cursor()
-            try:
-                # Insert task
-                cursor.execute("""
-                    INSERT INTO tasks (id, title, description, priority, agent, status, created_at, updated_at, dependencies, parent_task_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    task_data["id"],
-                    task_data["title"],
-                    task_data["description"],
-                    task_data["priority"],
-                    task_data["agent"],
-                    task_data["status"],
-                    task_data["created_at"],
-                    task_data["updated_at"],
-                    json.dumps(task_data.get("dependencies", [])),
-                    task_data.get("parent_task_id")
-                ))
-                
-                # Update task stats
-                cursor.execute("""
-                    INSERT OR REPLACE INTO task_stats (agent, tasks_pending, last_updated)
-                    VALUES (?, 
-                        COALESCE((SELECT tasks_pending + 1 FROM task_stats WHERE agent = ?), 1),
-                        ?)
-                """, (task_data["agent"], task_data["agent"], datetime.now().isoformat()))
-                
-                conn.commit()
-                return task_data
-            except Exception as e:
-                conn.rollback()
-                raise e
+            # Insert task
+            cursor.execute(TASK_INSERT, self._task_row(task_data))
+            self._write_dependencies(cursor, [task_data])
+            
+            # Update task stats; a task inserted completed is then moved on to completed
+            current_time = datetime.now().isoformat()
+            cursor.execute("""
+                INSERT INTO task_stats (agent, tasks_pending, last_updated)
+                VALUES (?, 1, ?)
+                ON CONFLICT(agent) DO UPDATE SET
+                    tasks_pending = tasks_pending + 1,
+                    last_updated = excluded.last_updated
+            """, (task_data["agent"], current_time))
+            self._record_completions(cursor, self._inserted_completions([task_data]), current_time)
+            return task_data
+    
+    @write_operation
+    def add_tasks_bulk(self, tasks: Iterable[Dict], chunk_size: Optional[int] = None) -> int:
+        """
+        Add many tasks in a single transaction.
+        
+        ``tasks`` may be any iterable; a generator is read into a list first,
+        so that a write retried after a busy error inserts every task, and
+        the rows are inserted in chunks of ``chunk_size``. Each chunk is
+        added to the search index and, by one GROUP BY per rollup, to the
+        rollups in place of the per-row insert triggers; the task_stats
+        deltas are aggregated per agent and written once at the end. Returns
+        the number of tasks inserted.
+        """
+        chunk_size = chunk_size or self.connection_pool.config["bulk_chunk_size"]
+        pending_by_agent = Counter()
+        completions = []
+        inserted = 0
+        
+        with self._get_connection(write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO bulk_load (started_at) VALUES (?)", (datetime.now().isoformat(),))
+            iterator = iter(tasks)
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                cursor.execute("SELECT coalesce(max(rowid), 0) FROM tasks")
+                last_rowid = cursor.fetchone()[0]
+                cursor.executemany(TASK_INSERT, [self._task_row(task_data) for task_data in chunk])
+                for statement in ROLLUP_BULK_LOAD:
+                    cursor.execute(statement, (last_rowid,))
+                if self.fts_enabled:
+                    cursor.execute(TASKS_FTS_BULK_LOAD, (last_rowid,))
+                self._write_dependencies(cursor, chunk)
+                pending_by_agent.update(task_data["agent"] for task_data in chunk)
+                completions.extend(self._inserted_completions(chunk))
+                inserted += len(chunk)
+            cursor.execute("DELETE FROM bulk_load")
+            
+            # Apply the aggregated task stats
+            current_time = datetime.now().isoformat()
+            cursor.executemany("""
+                INSERT INTO task_stats (agent, tasks_pending, last_updated)
+                VALUES (?, ?, ?)
+                ON CONFLICT(agent) DO UPDATE SET
+                    tasks_pending = tasks_pending + excluded.tasks_pending,
+                    last_updated = excluded.last_updated
+            """, [(agent, count, current_time) for agent, count in pending_by_agent.items()])
+            self._record_completions(cursor, completions, current_time)
+            return inserted
+    
+    @staticmethod
+    def _inserted_completions(tasks):
+        """Completions of tasks inserted already completed, timed from created_at to updated_at as in the rollups."""
+        return [
+            (task_data["agent"], task_data["updated_at"], _minutes_between(task_data["created_at"], task_data["updated_at"]))
+            for task_data in tasks if task_data["status"] == "completed"
+        ]
     
+    def _history_row(self, cursor, task_id, field_name, old_value, new_value, changed_at, changed_by):
+        """Parameters for HISTORY_INSERT, with free text delta-encoded and large values compressed."""
+        base_id = None
+        if field_name in DELTA_FIELDS:
+            base_id, old_value, new_value = self._delta_encode(cursor, task_id, field_name, old_value, new_value)
+        old_value, old_codec = compress_text(old_value, self.compress_min_bytes, self.codec)
+        new_value, new_codec = compress_text(new_value, self.compress_min_bytes, self.codec)
+        return (task_id, field_name, old_value, new_value, changed_at, changed_by, old_codec, new_codec, base_id)
+    
+    def _delta_encode(self, cursor, task_id, field_name, old_value, new_value):
+        """
+        Encode a change as deltas against the latest snapshot of the field.
+        
+        Returns ``(base_id, old_value, new_value)``. The change is written as a
+        new snapshot, with ``base_id`` None and both values in full, when the
+        field has no snapshot yet, when ``history_snapshot_interval`` changes
+        have been stored since the last one, or when the deltas would not be
+        smaller than the values themselves.
+        """
+        cursor.execute(f"""
+            SELECT s.id, {_inflated('s.new_value')}, (
+                SELECT COUNT(*) FROM task_history d
+                WHERE d.task_id = s.task_id AND d.field_name = s.field_name AND d.id > s.id
+            )
+            FROM task_history s
+            WHERE s.task_id = ? AND s.field_name = ? AND s.base_id IS NULL
+            ORDER BY s.id DESC
+            LIMIT 1
+        """, (task_id, field_name))
+        snapshot = cursor.fetchone()
+        if snapshot is None or snapshot[2] + 1 >= self.connection_pool.config["history_snapshot_interval"]:
+            return None, old_value, new_value
+        base_id, base, _ = snapshot
+        old_delta = encode_delta(base, old_value)
+        new_delta = encode_delta(base, new_value)
+        if len(old_delta) + len(new_delta) >= len(old_value) + len(new_value):
+            return None, old_value, new_value
+        return base_id, old_delta, new_delta
+    
+    def _new_sketch(self):
+        return DDSketch(self.connection_pool.config["latency_sketch_accuracy"])
+    
+    def _record_completions(self, cursor, completions, current_time):
+        """
+        Add completions, as ``(agent, completed_at, minutes)``, to task_stats and the agents' sketches.
+        
+        The running sums in task_stats move each completion from pending to
+        completed. Each agent has an all-time sketch in task_stats and one per
+        hourly and daily bucket of completed_at, the buckets the rollups count
+        the same completions in.
+        """
+        by_agent = {}
+        by_bucket = {}
+        for agent, completed_at, minutes in completions:
+            by_agent.setdefault(agent, []).append(minutes)
+            for table, width in LATENCY_TABLES.items():
+                by_bucket.setdefault((table, completed_at[:width], agent), []).append(minutes)
+        
+        cursor.executemany(COMPLETION_STATS_UPSERT, [
+            (agent, len(values), sum(values) / len(values), current_time, sum(values), sum(value * value for value in values))
+            for agent, values in by_agent.items()
+        ])
+        for (table, bucket, agent), values in by_bucket.items():
+            cursor.execute(f"SELECT sketch FROM {table} WHERE bucket = ? AND agent = ?", (bucket, agent))
+            row = cursor.fetchone()
+            sketch = DDSketch.from_json(row[0]) if row else self._new_sketch()
+            sketch.update(values)
+            cursor.execute(f"""
+                INSERT INTO {table} (bucket, agent, sketch) VALUES (?, ?, ?)
+                ON CONFLICT (bucket, agent) DO UPDATE SET sketch = excluded.sketch
+            """, (bucket, agent, sketch.to_json()))
+        
+        for agent, values in by_agent.items():
+            cursor.execute("SELECT completion_time_sketch FROM task_stats WHERE agent = ?", (agent,))
+            row = cursor.fetchone()
+            sketch = DDSketch.from_json(row[0]) if row and row[0] else self._new_sketch()
+            sketch.update(values)
+            cursor.execute("UPDATE task_stats SET completion_time_sketch = ? WHERE agent = ?", (sketch.to_json(), agent))
+    
+    @write_operation
     def update_task(self, task_id, updates, changed_by="system"):
         """Update an existing task with history tracking."""
-        with self._get_connection() as conn:
+        with self._get_connection(write=True) as conn:
             cursor = conn.cursor()
-            try:
-                # Get current task data
-                cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-                task = cursor.fetchone()
-                if not task:
-                    return None
-                
-                # Track changes in history
-                current_time = datetime.now().isoformat()
-                for key, new_value in updates.items():
-                    if key in ["title", "description", "priority", "agent", "status", "dependencies"]:
-                        old_value = task[{
-                            "title": 1,
-                            "description": 2,
-                            "priority": 3,
-                            "agent": 4,
-                            "status": 5,
-                            "dependencies": 8
-                        }[key]]
-                        
-                        if key == "dependencies":
-                            old_value = old_value if old_value else "[]"
-                            new_value = json.dumps(new_value)
-                        
-                        if str(old_value) != str(new_value):
-                            cursor.execute("""
-                                INSERT INTO task_history (task_id, field_name, old_value, new_value, changed_at, changed_by)
-                                VALUES (?, ?, ?, ?, ?, ?)
-                            """, (task_id, key, str(old_value), str(new_value), current_time, changed_by))
-                
-                # Prepare update query
-                update_fields = []
-                update_values = []
-                for key, value in updates.items():
-                    if key in ["title", "description", "priority", "agent", "status", "dependencies"]:
-                        update_fields.append(f"{key} = ?")
-                        update_values.append(value if key != "dependencies" else json.dumps(value))
-                
-                # Add updated_at timestamp
-                update_fields.append("updated_at = ?")
-                update_values.append(current_time)
-                
-                # Add task_id for WHERE clause
-                update_values.append(task_id)
-                
-                # Execute update
-                query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = ?"
-                cursor.execute(query, update_values)
-                
-                # Update task stats if status changed
-                if "status" in updates and updates["status"] == "completed":
-                    # Get the agent for this task
-                    agent = task[4]  # agent is at index 4 in the tasks table
+            # Get current task data
+            cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
+            task = cursor.fetchone()
+            if not task:
+                return None
+            
+            # Track changes in history
+            current_time = datetime.now().isoformat()
+            for key, new_value in updates.items():
+                if key in TASK_FIELD_INDEX:
+                    old_value = task[TASK_FIELD_INDEX[key]]
                     
-                    # Update task stats
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO task_stats 
-                        (agent, tasks_completed, tasks_pending, avg_completion_time, last_updated)
-                        VALUES (
-                            ?,
-                            COALESCE((SELECT tasks_completed + 1 FROM task_stats WHERE agent = ?), 1),
-                            COALESCE((SELECT tasks_pending - 1 FROM task_stats WHERE agent = ?), 0),
-                            COALESCE(
-                                (
-                                    SELECT AVG(
-                                        CAST(
-                                            (JULIANDAY(th.changed_at) - JULIANDAY(t.created_at)) * 24 * 60 
-                                            AS REAL
-                                        )
-                                    )
-                                    FROM tasks t
-                                    JOIN task_history th ON t.id = th.task_id
-                                    WHERE t.agent = ?
-                                    AND th.field_name = 'status'
-                                    AND th.new_value = 'completed'
-                                ),
-                                0
-                            ),
-                            ?
-                        )
-                    """, (agent, agent, agent, agent, current_time))
-                
-                conn.commit()
-                
-                # Return updated task
-                cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-                updated = cursor.fetchone()
-                return {
-                    "id": updated[0],
-                    "title": updated[1],
-                    "description": updated[2],
-                    "priority": updated[3],
-                    "agent": updated[4],
-                    "status": updated[5],
-                    "created_at": updated[6],
-                    "updated_at": updated[7],
-                    "dependencies": json.loads(updated[8]),
-                    "parent_task_id": updated[9]
-                }
-            except Exception as e:
-                conn.rollback()
-                raise e
+                    if key == "dependencies":
+                        old_value = old_value if old_value else "[]"
+                        new_value = json.dumps(new_value)
+                    
+                    if str(old_value) != str(new_value):
+                        cursor.execute(HISTORY_INSERT, self._history_row(
+                            cursor, task_id, key, str(old_value), str(new_value), current_time, changed_by
+                        ))
+            
+            # Prepare update query
+            update_fields = []
+            update_values = []
+            for key, value in updates.items():
+                if key in TASK_FIELD_INDEX:
+                    update_fields.append(f"{key} = ?")
+                    update_values.append(value if key != "dependencies" else json.dumps(value))
+            
+            # Add updated_at timestamp
+            update_fields.append("updated_at = ?")
+            update_values.append(current_time)
+            
+            # Add task_id for WHERE clause
+            update_values.append(task_id)
+            
+            # Execute update
+            query = f"UPDATE tasks SET {', '.join(update_fields)} WHERE id = ?"
+            cursor.execute(query, update_values)
+            
+            # Keep the dependency edges in step with the JSON list
+            if "dependencies" in updates:
+                cursor.execute("DELETE FROM task_dependencies WHERE task_id = ?", (task_id,))
+                self._write_dependencies(cursor, [{"id": task_id, "dependencies": updates["dependencies"]}])
+            
+            # Update task stats if the task just became completed
+            if updates.get("status") == "completed" and task[5] != "completed":
+                # Get the agent for this task
+                agent = task[4]  # agent is at index 4 in the tasks table
+                duration = _minutes_between(task[6], current_time)
+                self._record_completions(cursor, [(agent, current_time, duration)], current_time)
+            
+            # Return updated task
+            cursor.execute(f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = ?", (task_id,))
+            return self._task_dict(cursor.fetchone())
+    
+    @write_operation
+    def update_tasks_bulk(self, updates: Iterable[Tuple[str, Dict]], changed_by="system") -> List[Dict]:
+        """
+        Apply many task updates in a single transaction.
+        
+        ``updates`` holds ``(task_id, updates)`` pairs taking the same fields as
+        update_task; several pairs for one task apply in order. History rows are
+        written with one executemany, tasks that change the same set of fields
+        are updated by one UPDATE ... RETURNING, and the task_stats changes are
+        aggregated per agent. Returns the updated tasks in input order; unknown
+        task IDs are skipped.
+        """
+        steps = [
+            (task_id, {key: value for key, value in task_updates.items() if key in TASK_FIELD_INDEX})
+            for task_id, task_updates in updates
+        ]
+        if not steps:
+            return []
+        task_ids = list(dict.fromkeys(task_id for task_id, _ in steps))
+        current_time = datetime.now().isoformat()
+        
+        with self._get_connection(write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT {TASK_COLUMNS} FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(task_ids),)
+            )
+            rows = {row[0]: list(row) for row in cursor.fetchall()}
+            
+            # Replay the steps against each task, as successive update_task calls would
+            history = []
+            changed = {}
+            completion_times = []
+            for task_id, fields in steps:
+                row = rows.get(task_id)
+                if row is None:
+                    continue
+                changed.setdefault(task_id, set()).update(fields)
+                for key, new_value in fields.items():
+                    index = TASK_FIELD_INDEX[key]
+                    old_value = row[index]
+                    if key == "dependencies":
+                        old_value = old_value if old_value else "[]"
+                        new_value = json.dumps(new_value)
+                    if str(old_value) != str(new_value):
+                        history.append(self._history_row(
+                            cursor, task_id, key, str(old_value), str(new_value), current_time, changed_by
+                        ))
+                    if key == "status" and new_value == "completed" and row[5] != "completed":
+                        completion_times.append((row[4], current_time, _minutes_between(row[6], current_time)))
+                    row[index] = new_value
+            
+            cursor.executemany(HISTORY_INSERT, history)
+            
+            # One statement per distinct set of changed fields
+            groups = {}
+            for task_id, fields in changed.items():
+                groups.setdefault(tuple(sorted(fields)), []).append(task_id)
+            updated = {}
+            for fields, group in groups.items():
+                if UPDATE_RETURNING:
+                    # The new values travel as one JSON array joined against tasks
+                    payload = json.dumps([
+                        {"id": task_id, **{key: rows[task_id][TASK_FIELD_INDEX[key]] for key in fields}}
+                        for task_id in group
+                    ])
+                    assignments = ", ".join([f"{key} = json_extract(u.value, '$.{key}')" for key in fields] + ["updated_at = ?"])
+                    cursor.execute(f"""
+                        UPDATE tasks SET {assignments}
+                        FROM json_each(?) u
+                        WHERE tasks.id = json_extract(u.value, '$.id')
+                        RETURNING {TASK_COLUMNS}
+                    """, (current_time, payload))
+                else:
+                    assignments = ", ".join([f"{key} = ?" for key in fields] + ["updated_at = ?"])
+                    cursor.executemany(f"UPDATE tasks SET {assignments} WHERE id = ?", [
+                        [rows[task_id][TASK_FIELD_INDEX[key]] for key in fields] + [current_time, task_id]
+                        for task_id in group
+                    ])
+                    cursor.execute(
+                        f"SELECT {TASK_COLUMNS} FROM tasks WHERE id IN (SELECT value FROM json_each(?))",
+                        (json.dumps(group),)
+                    )
+                updated.update((row[0], self._task_dict(row)) for row in cursor.fetchall())
+            
+            # Keep the dependency edges in step with the JSON lists
+            rewired = [task_id for task_id, fields in changed.items() if "dependencies" in fields]
+            cursor.executemany("DELETE FROM task_dependencies WHERE task_id = ?", [(task_id,) for task_id in rewired])
+            self._write_dependencies(cursor, [updated[task_id] for task_id in rewired])
+            
+            self._record_completions(cursor, completion_times, current_time)
+            return [updated[task_id] for task_id in task_ids if task_id in updated]
     
-    def get_task_history(self, task_id) -> List[Dict]:
-        """Get the history of changes for a task."""
+    def get_task_history(self, task_id, since=None, until=None) -> List[Dict]:
+        """
+        Get the history of changes for a task, newest first.
+        
+        ``since``/``until`` limit the entries to an ISO time range. Archived
+        history is only read when ``since`` reaches back into an archived month.
+        """
+        query = f"""
+            SELECT field_name, {_history_value('old_value', '{schema}')}, {_history_value('new_value', '{schema}')},
+                changed_at, changed_by
+            FROM {{schema}}.task_history
+            WHERE task_id = ?
+        """
+        params = [task_id]
+        if since:
+            query += " AND changed_at >= ?"
+            params.append(since)
+        if until:
+            query += " AND changed_at <= ?"
+            params.append(until)
+        query += " ORDER BY changed_at DESC"
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT field_name, old_value, new_value, changed_at, changed_by
-                FROM task_history
-                WHERE task_id = ?
-                ORDER BY changed_at DESC
-            """, (task_id,))
+            cursor.execute(query.format(schema="main"), params)
+            rows = cursor.fetchall()
+            if since:
+                rows += self._query_archives(conn, self._archive_months(since, until), query, params)
+                rows.sort(key=lambda row: row[3], reverse=True)
             
             history = []
-            for row in cursor.fetchall():
+            for row in rows:
                 history.append({
                     "field": row[0],
                     "old_value": row[1],
@@ -307,92 +2139,567 @@ class DatabaseManager:
             
             return history
     
+    def iter_task_history(self, task_id, limit=None, before=None, after=None,
+                          columns=None, order="desc", page_size=None) -> Iterator[Dict]:
+        """
+        Stream the history of a task page by page, newest first by default.
+        
+        Pagination is keyset based on ``(changed_at, id)``: pass the values of
+        the last entry seen as ``before`` (or ``after``) to continue from it.
+        ``columns`` restricts the keys of each entry to a subset of
+        HISTORY_FIELDS.
+        """
+        return self._iter_keyset(
+            "task_history", HISTORY_FIELDS, "task_id = ?", (task_id,), ("changed_at", "id"),
+            limit, before, after, columns, order, page_size
+        )
+    
+    def get_task_rollups(self, group_by=("status",), start=None, end=None, agent=None, statuses=None) -> List[Dict]:
+        """
+        Aggregate the task rollups over an ISO time range.
+        
+        ``group_by`` takes keys of ROLLUP_KEYS. Each group reports ``tasks`` and
+        ``priority_sum`` for the tasks created in the range, by their current
+        state, and ``completions`` and ``completion_minutes_sum`` for the
+        completions that happened in it. The range is widened to whole hours;
+        days it covers entirely are read from the daily rollup, the hours at
+        either end from the hourly one. Groups with nothing to report are left
+        out.
+        """
+        unknown = [key for key in group_by if key not in ROLLUP_KEYS]
+        if unknown:
+            raise ValueError(f"Unknown rollup keys: {', '.join(unknown)}")
+        tables = {width: table for table, width in ROLLUP_TABLES.items()}
+        parts = [(tables[width], condition, params) for width, condition, params in bucket_ranges(start, end)]
+        
+        filters, filter_params = [], []
+        if agent is not None:
+            filters.append("agent = ?")
+            filter_params.append(agent)
+        if statuses:
+            filters.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            filter_params.extend(statuses)
+        
+        keys = [f"{ROLLUP_KEYS[key]} AS {key}" for key in group_by]
+        totals = ("tasks", "priority_sum", "completions", "completion_minutes_sum")
+        selects, params = [], []
+        for table, condition, part_params in parts:
+            selects.append(f"""
+                SELECT {', '.join(keys + list(totals))}
+                FROM {table}
+                WHERE {' AND '.join([condition] + filters)}
+            """)
+            params.extend(part_params + filter_params)
+        query = f"""
+            SELECT {', '.join(list(group_by) + [f'coalesce(SUM({total}), 0)' for total in totals])}
+            FROM ({' UNION ALL '.join(selects)})
+        """
+        if group_by:
+            query += f"""
+                GROUP BY {', '.join(group_by)}
+                HAVING SUM(tasks) != 0 OR SUM(completions) != 0
+                ORDER BY {', '.join(group_by)}
+            """
+        
+        with self._get_read_connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(zip(list(group_by) + list(totals), row)) for row in rows]
+    
+    def get_completion_percentiles(self, agent=None, start=None, end=None, quantiles=(0.5, 0.9, 0.99)) -> Dict:
+        """
+        Estimate completion-time percentiles, in minutes, over an ISO time range.
+        
+        Merges the per-bucket sketches of ``agent`` (every agent by default)
+        for the completions in the range, widened to whole hours as in
+        bucket_ranges. Returns the number of completions and one ``pNN`` entry
+        per quantile, each within ``latency_sketch_accuracy`` of the exact
+        value; the percentiles are None when there were no completions.
+        """
+        tables = {width: table for table, width in LATENCY_TABLES.items()}
+        merged = None  # at the accuracy of the stored sketches, whatever the configured one is now
+        with self._get_read_connection() as conn:
+            for width, condition, params in bucket_ranges(start, end):
+                query = f"SELECT sketch FROM {tables[width]} WHERE {condition}"
+                if agent is not None:
+                    query += " AND agent = ?"
+                    params = params + [agent]
+                for (sketch,) in conn.execute(query, params):
+                    sketch = DDSketch.from_json(sketch)
+                    if merged is None:
+                        merged = sketch
+                    else:
+                        merged.merge(sketch)
+        merged = merged or self._new_sketch()
+        return {"completions": merged.count, **self._percentiles(merged, quantiles)}
+    
+    @staticmethod
+    def _percentiles(sketch, quantiles=(0.5, 0.9, 0.99)) -> Dict:
+        return {f"p{q * 100:g}": sketch.quantile(q) for q in quantiles}
+    
     def get_agent_stats(self, agent) -> Optional[Dict]:
         """Get task statistics for an agent."""
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT tasks_completed, tasks_pending, avg_completion_time, last_updated
+                SELECT tasks_completed, tasks_pending, avg_completion_time, last_updated,
+                    completion_time_sum, completion_time_sumsq, completion_time_sketch
                 FROM task_stats
                 WHERE agent = ?
             """, (agent,))
             
             row = cursor.fetchone()
             if row:
+                completed, total, total_sq = row[0], row[4], row[5]
+                variance = max(total_sq / completed - (total / completed) ** 2, 0.0) if completed else 0.0
                 return {
                     "tasks_completed": row[0],
                     "tasks_pending": row[1],
                     "avg_completion_time": row[2],  # in minutes
+                    "completion_time_variance": variance,  # in minutes squared
+                    # p50/p90/p99 in minutes over every completion since sketches were kept
+                    "completion_time_percentiles": self._percentiles(
+                        DDSketch.from_json(row[6]) if row[6] else self._new_sketch()
+                    ),
                     "last_updated": row[3]
                 }
             return None
     
+    def get_dependents(self, task_id, transitive=False) -> List[str]:
+        """
+        Get the IDs of the tasks that depend on a task.
+        
+        With ``transitive`` the dependents of those tasks are followed too,
+        down to every task that cannot start before ``task_id`` completes.
+        Dependency cycles are tolerated; each task is reported once.
+        """
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            if transitive:
+                cursor.execute("""
+                    WITH RECURSIVE dependents(id) AS (
+                        SELECT task_id FROM task_dependencies WHERE depends_on = ?
+                        UNION
+                        SELECT d.task_id
+                        FROM task_dependencies d
+                        JOIN dependents ON d.depends_on = dependents.id
+                    )
+                    SELECT id FROM dependents WHERE id != ? ORDER BY id
+                """, (task_id, task_id))
+            else:
+                cursor.execute(
+                    "SELECT task_id FROM task_dependencies WHERE depends_on = ? ORDER BY task_id", (task_id,)
+                )
+            return [row[0] for row in cursor.fetchall()]
+    
+    def get_ready_tasks(self, agent=None, unblocked_by=None, limit=None) -> List[Dict]:
+        """
+        Get pending tasks whose dependencies are all completed, highest priority first.
+        
+        ``unblocked_by`` restricts the result to direct dependents of that task,
+        i.e. the tasks its completion just made ready. A dependency on a task
+        that does not exist keeps a task blocked.
+        """
+        columns = ", ".join(f"t.{column}" for column in TASK_COLUMNS.split(", "))
+        if unblocked_by is not None:
+            query = f"""
+                SELECT {columns}
+                FROM task_dependencies u
+                JOIN tasks t ON t.id = u.task_id
+                WHERE u.depends_on = ? AND t.status = 'pending'
+            """
+            params = [unblocked_by]
+        else:
+            query = f"SELECT {columns} FROM tasks t WHERE t.status = 'pending'"
+            params = []
+        
+        if agent:
+            query += " AND t.agent = ?"
+            params.append(agent)
+        
+        query += """
+            AND NOT EXISTS (
+                SELECT 1
+                FROM task_dependencies d
+                LEFT JOIN tasks p ON p.id = d.depends_on
+                WHERE d.task_id = t.id AND p.status IS NOT 'completed'
+            )
+            ORDER BY t.priority DESC, t.created_at ASC
+            LIMIT ?
+        """
+        params.append(-1 if limit is None else limit)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return [self._task_dict(row) for row in cursor.fetchall()]
+    
+    def _message_row(self, cursor, message_data, placed=None):
+        """
+        Convert a message dict into the parameter tuple for an INSERT into messages.
+        
+        Replies get their parent's thread ID (unless one is given) and a
+        materialized path one segment below the parent's. ``placed`` caches
+        thread/path/depth for messages inserted earlier in the same batch.
+        """
+        message_id = message_data["id"]
+        reply_to_id = message_data.get("reply_to_id")
+        parent = None
+        if reply_to_id is not None:
+            parent = placed.get(reply_to_id) if placed is not None else None
+            if parent is None:
+                cursor.execute("SELECT thread_id, path, depth FROM messages WHERE id = ?", (reply_to_id,))
+                parent = cursor.fetchone()
+        
+        if parent:
+            thread_id = message_data.get("thread_id", parent[0])
+            path = parent[1] + _path_segment(message_id)
+            depth = parent[2] + 1
+        else:
+            thread_id = message_data.get("thread_id", message_id)  # Use message ID as thread ID if not provided
+            path = _path_segment(message_id)
+            depth = 0
+        
+        if placed is not None:
+            placed[message_id] = (thread_id, path, depth)
+        content, codec = compress_text(message_data["content"], self.compress_min_bytes, self.codec)
+        return (
+            message_id,
+            message_data["from_agent"],
+            message_data["to_agent"],
+            content,
+            message_data["priority"],
+            message_data["type"],
+            message_data["status"],
+            message_data["timestamp"],
+            thread_id,
+            reply_to_id,
+            path,
+            depth,
+            codec
+        )
+    
+    def _index_compressed_messages(self, cursor, messages):
+        """Add just-inserted messages whose content was stored compressed to the search index."""
+        if not self.fts_enabled or not self.codec:
+            return
+        cursor.executemany(
+            "INSERT INTO messages_fts (rowid, content) SELECT rowid, ? FROM messages WHERE id = ? AND content_codec IS NOT NULL",
+            [
+                (message_data["content"], message_data["id"]) for message_data in messages
+                if len(message_data["content"].encode("utf-8")) >= self.compress_min_bytes
+            ]
+        )
+    
+    @staticmethod
+    def _message_dict(row):
+        """Convert a row selected with MESSAGE_SELECT into a message dict."""
+        return {
+            "id": row[0],
+            "from_agent": row[1],
+            "to_agent": row[2],
+            "content": row[3],
+            "priority": row[4],
+            "type": row[5],
+            "status": row[6],
+            "timestamp": row[7],
+            "thread_id": row[8],
+            "reply_to_id": row[9],
+            "depth": row[10]
+        }
+    
+    @write_operation
     def add_message(self, message_data):
         """Add a new message to the database with threading support."""
-        with self._get_connection() as conn:
+        with self._get_connection(write=True) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO messages (
                     id, from_agent, to_agent, content, priority, type, status, timestamp,
-                    thread_id, reply_to_id
+                    thread_id, reply_to_id, path, depth, content_codec
                 )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                message_data["id"],
-                message_data["from_agent"],
-                message_data["to_agent"],
-                message_data["content"],
-                message_data["priority"],
-                message_data["type"],
-                message_data["status"],
-                message_data["timestamp"],
-                message_data.get("thread_id", message_data["id"]),  # Use message ID as thread ID if not provided
-                message_data.get("reply_to_id")
-            ))
-            conn.commit()
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, self._message_row(cursor, message_data))
+            self._index_compressed_messages(cursor, [message_data])
         return message_data
     
-    def get_message_thread(self, thread_id) -> List[Dict]:
-        """Get all messages in a thread."""
+    @write_operation
+    def add_messages_bulk(self, messages: Iterable[Dict], chunk_size: Optional[int] = None) -> int:
+        """
+        Add many messages in a single transaction.
+        
+        ``messages`` may be any iterable; a generator is read into a list first,
+        as in add_tasks_bulk, and the rows are inserted in chunks of
+        ``chunk_size``. Replies must come after the message
+        they reply to. Each chunk is added to the search index in one statement
+        in place of the per-row insert trigger. Returns the number of messages
+        inserted.
+        """
+        chunk_size = chunk_size or self.connection_pool.config["bulk_chunk_size"]
+        inserted = 0
+        
+        with self._get_connection(write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO bulk_load (started_at) VALUES (?)", (datetime.now().isoformat(),))
+            iterator = iter(messages)
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    break
+                cursor.execute("SELECT coalesce(max(rowid), 0) FROM messages")
+                last_rowid = cursor.fetchone()[0]
+                placed = {}
+                cursor.executemany("""
+                    INSERT INTO messages (
+                        id, from_agent, to_agent, content, priority, type, status, timestamp,
+                        thread_id, reply_to_id, path, depth, content_codec
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [self._message_row(cursor, message_data, placed) for message_data in chunk])
+                if self.fts_enabled:
+                    cursor.execute(MESSAGES_FTS_BULK_LOAD, (last_rowid,))
+                self._index_compressed_messages(cursor, chunk)
+                inserted += len(chunk)
+            cursor.execute("DELETE FROM bulk_load")
+            return inserted
+    
+    def get_message_thread(self, thread_id, since=None) -> List[Dict]:
+        """
+        Get all messages in a thread, oldest first, with their reply depth.
+        
+        Archived threads are only read when ``since`` reaches back into an
+        archived month; messages older than ``since`` are then left out.
+        """
+        query = f"""
+            SELECT {MESSAGE_SELECT}
+            FROM {{schema}}.messages
+            WHERE thread_id = ?
+        """
+        params = [thread_id]
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        query += " ORDER BY timestamp ASC, id ASC"
+        
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                WITH RECURSIVE thread_messages AS (
-                    SELECT id, from_agent, to_agent, content, priority, type, status, timestamp, thread_id, reply_to_id, 0 as depth
-                    FROM messages
-                    WHERE thread_id = ?
-                    UNION ALL
-                    SELECT m.id, m.from_agent, m.to_agent, m.content, m.priority, m.type, m.status, m.timestamp, m.thread_id, m.reply_to_id, tm.depth + 1
-                    FROM messages m
-                    JOIN thread_messages tm ON m.reply_to_id = tm.id
-                )
-                SELECT * FROM thread_messages
-                ORDER BY timestamp ASC
-            """, (thread_id,))
-            
-            messages = []
-            for row in cursor.fetchall():
-                messages.append({
-                    "id": row[0],
-                    "from_agent": row[1],
-                    "to_agent": row[2],
-                    "content": row[3],
-                    "priority": row[4],
-                    "type": row[5],
-                    "status": row[6],
-                    "timestamp": row[7],
-                    "thread_id": row[8],
-                    "reply_to_id": row[9],
-                    "depth": row[10]
-                })
+            cursor.execute(query.format(schema="main"), params)
+            rows = cursor.fetchall()
+            if since:
+                # Threads are archived under the month of their last message
+                rows += self._query_archives(conn, self._archive_months(since), query, params)
+                rows.sort(key=lambda row: (row[7], row[0]))
+            return [self._message_dict(row) for row in rows]
+    
+    def iter_message_thread(self, thread_id, limit=None, before=None, after=None,
+                            columns=None, order="asc", page_size=None) -> Iterator[Dict]:
+        """
+        Stream the messages of a thread page by page, oldest first by default.
+        
+        Pagination is keyset based on ``(timestamp, id)``: pass the values of
+        the last message seen as ``after`` (or ``before``) to continue from it.
+        Use ``order="desc"`` with a ``limit`` to read the most recent page.
+        ``columns`` restricts the keys of each message to a subset of
+        MESSAGE_FIELDS.
+        """
+        return self._iter_keyset(
+            "messages", MESSAGE_FIELDS, "thread_id = ?", (thread_id,), ("timestamp", "id"),
+            limit, before, after, columns, order, page_size
+        )
+    
+    def _iter_keyset(self, table, fields, where, params, key, limit, before, after, columns, order, page_size):
+        """
+        Yield rows of ``table`` matching ``where`` in ``key`` order, one page per query.
+        
+        No connection is held between pages, so an abandoned generator does
+        not pin a pooled connection and memory stays bounded by ``page_size``.
+        """
+        columns = list(columns or fields)
+        unknown = [name for name in columns if name not in fields]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        if order not in ("asc", "desc"):
+            raise ValueError(f"Unknown order {order}")
+        page_size = page_size or self.connection_pool.config["page_size"]
+        
+        key_sql = f"({', '.join(key)})"
+        placeholders = f"({', '.join('?' for _ in key)})"
+        clauses = [where]
+        values = list(params)
+        if after is not None:
+            clauses.append(f"{key_sql} > {placeholders}")
+            values.extend(after)
+        if before is not None:
+            clauses.append(f"{key_sql} < {placeholders}")
+            values.extend(before)
+        
+        direction = "ASC" if order == "asc" else "DESC"
+        query = f"""
+            SELECT {', '.join(fields[name] for name in columns)}, {', '.join(key)}
+            FROM {table}
+            WHERE {' AND '.join(clauses)}{{continuation}}
+            ORDER BY {', '.join(f'{column} {direction}' for column in key)}
+            LIMIT ?
+        """
+        continuation = f" AND {key_sql} {'>' if order == 'asc' else '<'} {placeholders}"
+        
+        def pages():
+            remaining = limit
+            last_key = None
+            while remaining is None or remaining > 0:
+                size = page_size if remaining is None else min(page_size, remaining)
+                if last_key is None:
+                    sql, page_values = query.format(continuation=""), values + [size]
+                else:
+                    sql, page_values = query.format(continuation=continuation), values + list(last_key) + [size]
+                
+                with self._get_connection() as conn:
+                    rows = conn.execute(sql, page_values).fetchall()
+                for row in rows:
+                    yield dict(zip(columns, row))
+                
+                if len(rows) < size:
+                    return
+                last_key = rows[-1][-len(key):]
+                if remaining is not None:
+                    remaining -= len(rows)
+        
+        return pages()
+    
+    def get_message_subtree(self, message_id) -> List[Dict]:
+        """Get a message and every reply below it, oldest first."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT thread_id, path FROM messages WHERE id = ?", (message_id,))
+            root = cursor.fetchone()
+            if not root:
+                return []
             
-            return messages
+            # Every descendant's path starts with the root's path, which ends in "/";
+            # bumping that last character gives the exclusive upper bound of the range
+            thread_id, path = root
+            cursor.execute(f"""
+                SELECT {MESSAGE_SELECT}
+                FROM messages
+                WHERE thread_id = ?
+                AND path >= ? AND path < ?
+                ORDER BY timestamp ASC, id ASC
+            """, (thread_id, path, path[:-1] + "0"))
+            return [self._message_dict(row) for row in cursor.fetchall()]
+    
+    def get_latest_replies(self, thread_id, limit=10) -> List[Dict]:
+        """Get the newest ``limit`` messages of a thread, returned oldest first."""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT {MESSAGE_SELECT}
+                FROM messages
+                WHERE thread_id = ?
+                ORDER BY timestamp DESC, id DESC
+                LIMIT ?
+            """, (thread_id, limit))
+            return [self._message_dict(row) for row in reversed(cursor.fetchall())]
+    
+    @staticmethod
+    def _match_expression(query, raw):
+        """Turn plain text into an FTS5 query matching all of its words, unless ``raw``."""
+        if raw:
+            return query
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        return " ".join(terms)
+    
+    def search_messages(self, query, agent=None, thread_id=None, limit=20, raw=False) -> List[Dict]:
+        """
+        Full-text search over message content, best BM25 match first.
+        
+        Plain ``query`` text matches messages containing every word; pass
+        ``raw=True`` to use FTS5 query syntax (OR, NEAR, prefix* ...).
+        ``agent`` matches either the sender or the recipient.
+        """
+        if not self.fts_enabled:
+            raise RuntimeError("Full-text search requires SQLite with FTS5")
+        match = self._match_expression(query, raw)
+        if not match:
+            return []
+        
+        sql = f"""
+            SELECT m.id, m.from_agent, m.to_agent, m.thread_id, m.timestamp,
+                {_inflated('m.content')}, bm25(messages_fts)
+            FROM messages_fts
+            JOIN messages m ON m.rowid = messages_fts.rowid
+            WHERE messages_fts MATCH ?
+        """
+        params = [match]
+        if agent:
+            sql += " AND (m.from_agent = ? OR m.to_agent = ?)"
+            params.extend([agent, agent])
+        if thread_id:
+            sql += " AND m.thread_id = ?"
+            params.append(thread_id)
+        sql += " ORDER BY bm25(messages_fts) LIMIT ?"
+        params.append(limit)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return [{
+                "id": row[0],
+                "from_agent": row[1],
+                "to_agent": row[2],
+                "thread_id": row[3],
+                "timestamp": row[4],
+                "snippet": _snippet(row[5], match),
+                "score": row[6]  # BM25, lower is a better match
+            } for row in cursor.fetchall()]
+    
+    def search_tasks(self, query, agent=None, status=None, limit=20, raw=False) -> List[Dict]:
+        """Full-text search over task titles and descriptions, best BM25 match first."""
+        if not self.fts_enabled:
+            raise RuntimeError("Full-text search requires SQLite with FTS5")
+        match = self._match_expression(query, raw)
+        if not match:
+            return []
+        
+        # Title hits weigh twice as much as description hits
+        sql = """
+            SELECT t.id, t.title, t.agent, t.status, t.updated_at,
+                snippet(tasks_fts, 1, '[', ']', '...', 12), bm25(tasks_fts, 2.0, 1.0)
+            FROM tasks_fts
+            JOIN tasks t ON t.rowid = tasks_fts.rowid
+            WHERE tasks_fts MATCH ?
+        """
+        params = [match]
+        if agent:
+            sql += " AND t.agent = ?"
+            params.append(agent)
+        if status:
+            sql += " AND t.status = ?"
+            params.append(status)
+        sql += " ORDER BY bm25(tasks_fts, 2.0, 1.0) LIMIT ?"
+        params.append(limit)
+        
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return [{
+                "id": row[0],
+                "title": row[1],
+                "agent": row[2],
+                "status": row[3],
+                "updated_at": row[4],
+                "snippet": row[5],
+                "score": row[6]  # BM25, lower is a better match
+            } for row in cursor.fetchall()]
     
     def cleanup(self):
         """Clean up database connections."""
-        for conn in self.connection_pool.values():
-            conn.close()
-        self.connection_pool.clear()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.read_pool is not None:
+            self.read_pool.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        self.connection_pool.close()
 
 if __name__ == "__main__":
     # Test the enhanced database manager
@@ -0,0 +1,107 @@
+import json
+import math
+from typing import Dict, Iterable, Optional
+
+class DDSketch:
+    """
+    Mergeable quantile sketch with relative-error guarantees (DDSketch).
+    
+    Positive values are counted in logarithmically sized bins, so any
+    quantile is answered within ``relative_accuracy`` of the true value no
+    matter how skewed the distribution is. Two sketches with the same accuracy
+    merge by adding their bin counts, which is what lets per-bucket sketches
+    be combined into any time window. Values of zero or less share one bin.
+    Once there are more than ``max_bins`` bins the lowest ones are folded
+    together, trading accuracy on the smallest values for bounded size.
+    """
+    
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+    
+    def add(self, value, count=1):
+        """Count ``value`` ``count`` times."""
+        if value > 0:
+            self._bin(value, count)
+        else:
+            self.zero_count += count
+        self.count += count
+        self.sum += value * count
+    
+    def _bin(self, value, count):
+        """Add ``count`` to the bin of a positive value, without touching the totals."""
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+    
+    def update(self, values: Iterable[float]):
+        for value in values:
+            self.add(value)
+    
+    def merge(self, other: "DDSketch"):
+        """
+        Add the counts of another sketch to this one.
+        
+        Sketches of the same accuracy merge exactly. The bins of a sketch with
+        another accuracy are re-binned at their midpoints, which adds that
+        sketch's error on top of this one's.
+        """
+        if other.gamma == self.gamma:
+            for index, count in other.bins.items():
+                self.bins[index] = self.bins.get(index, 0) + count
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        else:
+            for index, count in other.bins.items():
+                self._bin(2 * other.gamma ** index / (other.gamma + 1), count)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+    
+    def _collapse(self):
+        """Fold the lowest bins into one so at most ``max_bins`` remain."""
+        indexes = sorted(self.bins)
+        folded = indexes[:len(indexes) - self.max_bins + 1]
+        self.bins[folded[-1]] = sum(self.bins.pop(index) for index in folded)
+    
+    def quantile(self, q) -> Optional[float]:
+        """Estimate the ``q`` quantile (0 <= q <= 1); None for an empty sketch."""
+        if not 0 <= q <= 1:
+            raise ValueError("Quantile must be between 0 and 1")
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # Midpoint of the bin (gamma^(i-1), gamma^i] in relative terms
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+    
+    def to_json(self) -> str:
+        return json.dumps({
+            "accuracy": self.relative_accuracy,
+            "zero": self.zero_count,
+            "sum": self.sum,
+            "bins": sorted(self.bins.items())
+        }, separators=(",", ":"))
+    
+    @classmethod
+    def from_json(cls, data, max_bins=2048) -> "DDSketch":
+        state = json.loads(data)
+        sketch = cls(state["accuracy"], max_bins)
+        sketch.bins = {index: count for index, count in state["bins"]}
+        sketch.zero_count = state["zero"]
+        sketch.count = sketch.zero_count + sum(sketch.bins.values())
+        sketch.sum = state["sum"]
+        return sketch
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import quote, unquote
+
+from agency.config import DATABASE_CONFIG
+from .database_manager import DatabaseManager, register_codecs
+
+class ShardRouter:
+    """
+    Routes each tenant or agency key to its own database file.
+    
+    Every shard is a separate DatabaseManager with its own connection pool
+    and write lock, so tenants never contend with each other for writes. At
+    most ``max_open_shards`` shards stay open; the least recently used idle
+    shard is closed when another one is needed and reopened transparently on
+    its next use. Shards that are in use are never closed.
+    """
+    
+    def __init__(self, shard_dir=None, max_open_shards=None, config=None):
+        self.config = {**DATABASE_CONFIG, **(config or {})}
+        self.shard_dir = Path(shard_dir or self.config["shard_dir"])
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.max_open_shards = max_open_shards or self.config["max_open_shards"]
+        self.shard_config = {**(config or {}), "pool_size": self.config["shard_pool_size"]}
+        self._shards = OrderedDict()  # key -> DatabaseManager, least recently used first
+        self._pins = {}  # key -> number of callers using the shard
+        self._lock = threading.Lock()
+    
+    def shard_path(self, key) -> Path:
+        """Database file of a shard; the key is percent-encoded into the file name."""
+        if not key:
+            raise ValueError("Shard key must be a non-empty string")
+        return self.shard_dir / f"{quote(key, safe='')}.db"
+    
+    def shard_keys(self) -> List[str]:
+        """Keys of every shard that has a database file, open or not."""
+        return sorted(unquote(path.name[:-len(".db")]) for path in self.shard_dir.glob("*.db"))
+    
+    @contextmanager
+    def shard(self, key):
+        """
+        Use the DatabaseManager of a shard for the duration of a ``with`` block.
+        
+        The shard is opened (and its tables created) on first use and cannot be
+        evicted while the block runs.
+        """
+        with self._lock:
+            db = self._shards.get(key)
+            if db is None:
+                db = DatabaseManager.open(str(self.shard_path(key)), self.shard_config)
+                self._shards[key] = db
+            self._shards.move_to_end(key)
+            self._pins[key] = self._pins.get(key, 0) + 1
+            self._evict()
+        try:
+            yield db
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                self._evict()
+    
+    def run(self, key, operation, *args, **kwargs):
+        """Call a DatabaseManager method such as ``"add_task"`` on a shard."""
+        with self.shard(key) as db:
+            return getattr(db, operation)(*args, **kwargs)
+    
+    def _evict(self):
+        """Close least recently used idle shards beyond the cap. Call with the lock held."""
+        excess = len(self._shards) - self.max_open_shards
+        for key in list(self._shards):
+            if excess <= 0:
+                break
+            if key not in self._pins:
+                self._shards.pop(key).cleanup()
+                excess -= 1
+    
+    def open_shards(self) -> List[str]:
+        """Keys of the currently open shards, least recently used first."""
+        with self._lock:
+            return list(self._shards)
+    
+    def fan_out(self, query, params=(), keys=None, max_workers=None) -> Dict[str, List[tuple]]:
+        """
+        Run a read-only query against many shards in parallel and return the rows per shard.
+        
+        ``keys`` defaults to every shard on disk. Each shard is read through its
+        own read-only connection, so fan-out neither opens shards in the router
+        nor counts against ``max_open_shards``, and a query that tries to write
+        fails instead of modifying a tenant's data.
+        """
+        keys = self.shard_keys() if keys is None else list(keys)
+        workers = max_workers or self.config["shard_fan_out_workers"]
+        
+        def read(key):
+            conn = sqlite3.connect(
+                f"{self.shard_path(key).resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=self.config["timeout"]
+            )
+            try:
+                conn.execute("PRAGMA query_only = ON")
+                register_codecs(conn)
+                return conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ShardFanOut") as executor:
+            return dict(zip(keys, executor.map(read, keys)))
+    
+    def close(self):
+        """Close every open shard."""
+        with self._lock:
+            while self._shards:
+                _, db = self._shards.popitem(last=False)
+                db.cleanup()
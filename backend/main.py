@@ -1,10 +1,21 @@
-from fastapi import FastAPI, WebSocket
+import sys
+from pathlib import Path
+from fastapi import FastAPI, WebSocket, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict
 import json
 
+# Add project root to Python path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from agents.TaskOrchestrator.tools.async_database_manager import AsyncDatabaseManager
+
 app = FastAPI()
 
+# Non-blocking access to the agency database
+db = AsyncDatabaseManager()
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +55,25 @@ async def read_root():
 async def get_agents():
     return agents
 
+@app.get("/agents/{agent}/stats")
+async def get_agent_stats(agent: str):
+    stats = await db.get_agent_stats(agent)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No stats for agent")
+    return stats
+
+@app.get("/tasks/{task_id}/history")
+async def get_task_history(task_id: str):
+    return await db.get_task_history(task_id)
+
+@app.get("/threads/{thread_id}")
+async def get_message_thread(thread_id: str):
+    return await db.get_message_thread(thread_id)
+
+@app.on_event("shutdown")
+async def shutdown_database():
+    db.close()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
@@ -1,9 +1,33 @@
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 
 # Define metrics
 API_REQUESTS = Counter('api_requests_total', 'Total API requests', ['endpoint'])
 AGENT_HEALTH = Gauge('agent_health', 'Agent health status', ['agent_name'])
 
+# Database metrics, recorded when DatabaseManager query instrumentation is enabled
+DB_STATEMENT_SECONDS = Histogram(
+    'db_statement_duration_seconds',
+    'SQLite statement latency, executing and fetching, by statement template',
+    ['statement'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+DB_STATEMENT_ROWS = Counter(
+    'db_statement_rows_total',
+    'Rows returned or changed by SQLite statements, by statement template',
+    ['statement']
+)
+DB_LOCK_WAIT_SECONDS = Histogram(
+    'db_lock_wait_seconds',
+    'Time spent waiting for a pooled connection or a database lock',
+    ['kind'],
+    buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0)
+)
+DB_BUSY_RETRIES = Counter(
+    'db_busy_retries_total',
+    'Database operations retried after SQLITE_BUSY or SQLITE_LOCKED',
+    ['operation']
+)
+
 def initialize_monitoring():
     """Initialize monitoring system"""
     # Reset health metrics
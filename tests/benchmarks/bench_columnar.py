@@ -0,0 +1,140 @@
+"""
+Benchmark the vectorized analytics over columnar task exports.
+
+Writes synthetic tasks and status history straight into the day-partitioned
+.npy layout of columnar_analytics.export_columnar (going through SQLite
+would make setup dominate at these sizes), then times loading them back and
+each analysis. The export itself is timed separately, from a temporary
+database filled like bench_database_manager's. Nothing touches the network
+or the real agency database.
+
+Usage:
+    python tests/benchmarks/bench_columnar.py --rows 10000000 --export-rows 1000000 --output columnar.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from bench_database_manager import AGENTS, STATUSES, DatabaseManager, git_revision, populate
+from agents.TaskOrchestrator.tools.columnar_analytics import (
+    ColumnTable, _write_partition, agent_completion_distributions, export_columnar, load_columnar, status_dwell_times,
+    throughput
+)
+
+def write_synthetic(out_dir, rows, days, seed):
+    """Write ``rows`` tasks and as many status changes spread evenly over ``days`` day partitions."""
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2024-01-01T00:00:00")
+    agents, statuses = np.array(sorted(AGENTS)), np.array(sorted(STATUSES))
+    for table in ("tasks", "task_history"):
+        (Path(out_dir) / table).mkdir(parents=True)
+    for day, size in enumerate(np.diff(np.linspace(0, rows, days + 1).astype(np.int64))):
+        base = start + np.timedelta64(day, "D")
+        created = np.sort(base + rng.integers(0, 86400, size).astype("timedelta64[s]"))
+        tasks = ColumnTable({
+            "agent": rng.integers(0, len(agents), size).astype(np.int32),
+            "status": rng.integers(0, len(statuses), size).astype(np.int32),
+            "created_at": created,
+            "updated_at": created + rng.lognormal(6, 1.5, size).astype(np.int64).astype("timedelta64[s]"),
+        }, {"agent": agents, "status": statuses})
+        history = ColumnTable({
+            "task_id": rng.integers(0, rows // 3, size),
+            "field_name": np.zeros(size, dtype=np.int32),
+            "new_value": rng.integers(0, len(statuses), size).astype(np.int32),
+            "changed_at": created,
+        }, {"field_name": np.array(["status"]), "new_value": statuses})
+        name = str(base.astype("datetime64[D]"))
+        _write_partition(Path(out_dir) / "tasks" / name, tasks, "npy")
+        _write_partition(Path(out_dir) / "task_history" / name, history, "npy")
+
+def timed(name, function):
+    started = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - started
+    print(f"  {name:<32} {seconds:8.3f} s", file=sys.stderr)
+    return result, seconds
+
+def run(rows, days, seed):
+    temp_dir = tempfile.mkdtemp(prefix="bench_columnar_")
+    try:
+        write_synthetic(temp_dir, rows, days, seed)
+        columns = ["agent", "status", "created_at", "updated_at"]
+        tasks, load_tasks = timed("load tasks", lambda: load_columnar(temp_dir, "tasks", columns=columns))
+        history, load_history = timed(
+            "load task_history",
+            lambda: load_columnar(temp_dir, "task_history", columns=["task_id", "field_name", "new_value", "changed_at"])
+        )
+        seconds = {"load_tasks": load_tasks, "load_task_history": load_history}
+        for name, function in [
+            ("throughput_hourly", lambda: throughput(tasks, "h")),
+            ("agent_completion_distributions", lambda: agent_completion_distributions(tasks)),
+            ("status_dwell_times", lambda: status_dwell_times(history)),
+        ]:
+            seconds[name] = timed(name, function)[1]
+        return {"rows": rows, "days": days, "seconds": seconds}
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def run_export(rows, seed):
+    """Time export_columnar over a temporary database holding ``rows`` tasks and their history."""
+    temp_dir = tempfile.mkdtemp(prefix="bench_columnar_export_")
+    DatabaseManager._instance = None
+    db = DatabaseManager(os.path.join(temp_dir, "bench.db"))
+    try:
+        counts = populate(db, random.Random(seed), rows)
+        written, seconds = timed(
+            "export_columnar", lambda: export_columnar(db, Path(temp_dir) / "export", export_format="npy")
+        )
+        return {
+            "rows": {table: counts[table] for table in written},
+            "partitions": {table: len(days) for table, days in written.items()},
+            "seconds": seconds
+        }
+    finally:
+        db.cleanup()
+        DatabaseManager._instance = None
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10_000_000, help="rows per table")
+    parser.add_argument("--days", type=int, default=180, help="day partitions the rows are spread over")
+    parser.add_argument("--export-rows", type=int, default=200_000, help="tasks in the exported database; 0 skips the export")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed
+        },
+        "result": run(args.rows, args.days, args.seed),
+        "export": run_export(args.export_rows, args.seed) if args.export_rows else None
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Benchmark on-disk size and read latency of message content compression.
+
+Builds one temporary database of synthetic multi-kilobyte page extracts (the
+kind of content research agents pass around) with compression disabled,
+measures its size and the thread and search read latency, then compresses the
+existing rows, vacuums, and measures again. Nothing touches the network or
+the real agency database.
+
+Usage:
+    python tests/benchmarks/bench_compression.py --messages 20000 --output compression.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_database_manager import DatabaseManager, git_revision, measure
+
+WORDS = (
+    "agent task research quantum error correction surface code camera calibration lens "
+    "distortion market analysis revenue forecast customer support ticket escalation "
+    "deployment pipeline container latency throughput benchmark summary citation source"
+).split()
+THREAD_LENGTH = 20
+SEARCH_TERMS = ["quantum", "calibration", "revenue forecast", "deployment pipeline", "citation"]
+
+def page_extract(rng, size):
+    """A paragraph-structured text of roughly ``size`` bytes drawn from a small vocabulary."""
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + "."
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+def generate_messages(rng, count, min_bytes, max_bytes):
+    timestamp = datetime.now() - timedelta(days=30)
+    for i in range(count):
+        thread = i // THREAD_LENGTH
+        position = i % THREAD_LENGTH
+        yield {
+            "id": f"msg_{i}",
+            "from_agent": "Researcher",
+            "to_agent": "Orchestrator",
+            "content": page_extract(rng, rng.randint(min_bytes, max_bytes)),
+            "priority": "normal",
+            "type": "research",
+            "status": "sent",
+            "timestamp": (timestamp + timedelta(seconds=i)).isoformat(),
+            "thread_id": f"thread_{thread}",
+            "reply_to_id": f"msg_{i - 1}" if position else None
+        }
+
+def file_bytes(db):
+    """Size of the database file with the WAL folded in."""
+    with db._get_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(db.db_path)
+
+def measure_reads(db, threads, repeat):
+    results = {
+        "get_message_thread": measure(lambda i: db.get_message_thread(f"thread_{i % threads}"), repeat)[0],
+        "search_messages": measure(lambda i: db.search_messages(SEARCH_TERMS[i % len(SEARCH_TERMS)]), repeat)[0],
+    }
+    for name, stats in results.items():
+        print(f"  {name:<24} {stats['mean_ms']:10.3f} ms mean {stats['p95_ms']:10.3f} ms p95", file=sys.stderr)
+    return results
+
+def run(messages, min_bytes, max_bytes, repeat, seed, codec):
+    rng = random.Random(seed)
+    temp_dir = tempfile.mkdtemp(prefix="bench_compression_")
+    db_path = os.path.join(temp_dir, "bench.db")
+    threads = max(1, messages // THREAD_LENGTH)
+    DatabaseManager._instance = None
+    db = DatabaseManager.open(db_path, {"compression": None})
+    try:
+        db.add_messages_bulk(generate_messages(rng, messages, min_bytes, max_bytes))
+        with db._get_connection() as conn:
+            content_bytes = conn.execute("SELECT SUM(length(CAST(content AS BLOB))) FROM messages").fetchone()[0]
+        print("Uncompressed:", file=sys.stderr)
+        before = {"db_bytes": file_bytes(db), "operations": measure_reads(db, threads, repeat)}
+        db.cleanup()
+        
+        db = DatabaseManager.open(db_path, {"compression": codec})
+        compressed = db.compress_existing_rows()
+        with db._get_connection() as conn:
+            conn.execute("VACUUM")
+        print(f"Compressed ({db.codec}):", file=sys.stderr)
+        after = {"db_bytes": file_bytes(db), "operations": measure_reads(db, threads, repeat)}
+        
+        return {
+            "messages": messages,
+            "content_bytes": content_bytes,
+            "codec": db.codec,
+            "rows_compressed": compressed,
+            "uncompressed": before,
+            "compressed": after,
+            "size_ratio": after["db_bytes"] / before["db_bytes"]
+        }
+    finally:
+        db.cleanup()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--min-bytes", type=int, default=2_000, help="smallest synthetic page extract")
+    parser.add_argument("--max-bytes", type=int, default=20_000, help="largest synthetic page extract")
+    parser.add_argument("--codec", default="auto", help="'zstd', 'zlib' or 'auto'")
+    parser.add_argument("--repeat", type=int, default=100, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed
+        },
+        "result": run(args.messages, args.min_bytes, args.max_bytes, args.repeat, args.seed, args.codec)
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
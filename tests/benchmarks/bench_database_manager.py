@@ -0,0 +1,294 @@
+"""
+Benchmarks for the DatabaseManager hot paths at several data scales.
+
+Each scale gets a fresh temporary database filled with synthetic tasks,
+task history and message threads (one deep reply chain, one wide thread and
+many short ones), after which the write paths, the thread and history reads
+and every TaskAnalyticsTool operation are timed. Nothing touches the network
+or the real agency database.
+
+Usage:
+    python tests/benchmarks/bench_database_manager.py --scales 10000 100000 --output bench.json
+    python tests/benchmarks/bench_database_manager.py --compare baseline.json --output bench.json
+
+``--compare`` prints the change in mean latency per operation against an
+earlier results file and exits non-zero when any operation slowed down by
+more than ``--threshold``.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+# The tools import the database manager as ``tools.database_manager``; share that module with them
+project_root = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(project_root))
+sys.path.insert(0, str(project_root / "agents" / "TaskOrchestrator"))
+
+from tools.database_manager import DatabaseManager
+
+AGENTS = [f"Agent{i}" for i in range(20)]
+STATUSES = ["pending", "in_progress", "completed", "failed"]
+ANALYTICS_OPERATIONS = [
+    "task_metrics", "agent_performance", "workload_analysis", "completion_trends", "error_analysis", "dashboard"
+]
+HISTORY_PER_TASK = 3
+SHORT_THREAD_LENGTH = 10
+
+def generate_tasks(rng, count, start, span):
+    for i in range(count):
+        created_at = (start + span * i / count).isoformat()
+        yield {
+            "id": f"task_{i}",
+            "title": f"Synthetic task {i}",
+            "description": f"Benchmark task {i} for {rng.choice(AGENTS)}",
+            "priority": rng.randint(1, 3),
+            "agent": rng.choice(AGENTS),
+            "status": rng.choice(STATUSES),
+            "created_at": created_at,
+            "updated_at": created_at,
+            "dependencies": []
+        }
+
+def generate_history(rng, count, start, span):
+    for i in range(count):
+        changed_at = start + span * i / count
+        for step in range(HISTORY_PER_TASK):
+            yield (
+                f"task_{i}", "status", STATUSES[step], STATUSES[step + 1],
+                (changed_at + timedelta(minutes=step + 1)).isoformat(), rng.choice(AGENTS)
+            )
+
+def make_message(message_id, timestamp, reply_to_id=None):
+    return {
+        "id": message_id,
+        "from_agent": "AgentA",
+        "to_agent": "AgentB",
+        "content": f"Synthetic message {message_id}",
+        "priority": "normal",
+        "type": "task",
+        "status": "sent",
+        "timestamp": timestamp.isoformat(),
+        "reply_to_id": reply_to_id
+    }
+
+def generate_messages(rng, count, start, deep_length, wide_length):
+    """Yield a deep reply chain, a wide thread, then short threads until ``count`` messages."""
+    timestamp = start
+    step = timedelta(seconds=1)
+    
+    yield make_message("deep_0", timestamp)
+    for i in range(1, deep_length):
+        timestamp += step
+        yield make_message(f"deep_{i}", timestamp, reply_to_id=f"deep_{i - 1}")
+    
+    yield make_message("wide_0", timestamp)
+    for i in range(1, wide_length):
+        timestamp += step
+        yield make_message(f"wide_{i}", timestamp, reply_to_id="wide_0")
+    
+    produced = deep_length + wide_length
+    thread = 0
+    while produced < count:
+        root = f"short_{thread}_0"
+        yield make_message(root, timestamp)
+        replies = [root]
+        for i in range(1, min(SHORT_THREAD_LENGTH, count - produced)):
+            timestamp += step
+            message_id = f"short_{thread}_{i}"
+            yield make_message(message_id, timestamp, reply_to_id=rng.choice(replies))
+            replies.append(message_id)
+        produced += len(replies)
+        thread += 1
+
+def populate(db, rng, scale):
+    """Fill an empty database with ``scale`` tasks and the matching history and messages."""
+    span = timedelta(days=60)
+    start = datetime.now() - span
+    deep_length = max(2, min(1000, scale // 100))
+    wide_length = max(2, min(10000, scale // 10))
+    
+    db.add_tasks_bulk(generate_tasks(rng, scale, start, span))
+    with db._get_connection() as conn:
+        history = generate_history(rng, scale, start, span)
+        while True:
+            chunk = list(islice(history, db.connection_pool.config["bulk_chunk_size"]))
+            if not chunk:
+                break
+            conn.executemany("""
+                INSERT INTO task_history (task_id, field_name, old_value, new_value, changed_at, changed_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, chunk)
+    db.add_messages_bulk(generate_messages(rng, max(scale, deep_length + wide_length), start, deep_length, wide_length))
+    
+    with db._get_connection() as conn:
+        conn.execute("ANALYZE")
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("tasks", "task_history", "messages")
+        }
+
+def measure(operation, repeat):
+    """Call ``operation(i)`` ``repeat`` times and summarize the latencies in milliseconds."""
+    timings = []
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = operation(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    stats = {
+        "runs": repeat,
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "max_ms": timings[-1],
+        "ops_per_sec": repeat / (sum(timings) / 1000) if sum(timings) else None
+    }
+    return stats, result
+
+def run_scale(scale, repeat, seed):
+    """Benchmark one scale against a fresh temporary database."""
+    rng = random.Random(seed)
+    temp_dir = tempfile.mkdtemp(prefix="bench_db_")
+    DatabaseManager._instance = None
+    # Without the result cache, so repeated analytics calls time the queries rather than cache hits
+    db = DatabaseManager(os.path.join(temp_dir, "bench.db"), config={"result_cache_entries": 0})
+    
+    # Imported here so its module-level DatabaseManager() picks up the temporary database
+    import tools.TaskAnalyticsTool as analytics
+    analytics.db_manager = db
+    
+    try:
+        started = time.perf_counter()
+        rows = populate(db, rng, scale)
+        setup_seconds = time.perf_counter() - started
+        
+        # Distinct unfinished tasks, so every timed completion updates the agent stats
+        with db._get_connection() as conn:
+            pending = [row[0] for row in conn.execute(
+                "SELECT id FROM tasks WHERE status != 'completed' LIMIT ?", (repeat,)
+            )]
+        task_ids = [f"task_{rng.randrange(scale)}" for _ in range(repeat)]
+        now = datetime.now().isoformat()
+        
+        operations = {
+            "add_task": lambda i: db.add_task({
+                "id": f"bench_task_{i}", "title": "Benchmark", "description": "Inserted while timing",
+                "priority": 1, "agent": AGENTS[i % len(AGENTS)], "status": "pending",
+                "created_at": now, "updated_at": now, "dependencies": []
+            }),
+            "update_task_completed": lambda i: db.update_task(pending[i % len(pending)], {"status": "completed"}),
+            "update_task_title": lambda i: db.update_task(task_ids[i], {"title": f"Renamed {i}"}),
+            "get_task_history": lambda i: db.get_task_history(task_ids[i]),
+            "get_message_thread_deep": lambda i: db.get_message_thread("deep_0"),
+            "get_message_thread_wide": lambda i: db.get_message_thread("wide_0"),
+            "get_message_thread_short": lambda i: db.get_message_thread(f"short_{i}_0"),
+            "get_agent_stats": lambda i: db.get_agent_stats(AGENTS[i % len(AGENTS)]),
+        }
+        for name in ANALYTICS_OPERATIONS:
+            operations[f"analytics_{name}"] = (
+                lambda i, name=name: analytics.TaskAnalyticsTool(operation=name, agent=AGENTS[i % len(AGENTS)]).run()
+            )
+        
+        results = {}
+        for name, operation in operations.items():
+            stats, result = measure(operation, repeat)
+            if isinstance(result, str) and result.startswith("Error"):
+                # Still timed, but flagged so a broken query is not mistaken for a fast one
+                stats["error"] = result
+            results[name] = stats
+            print(f"  {name:<32} {stats['mean_ms']:10.3f} ms mean {stats['p95_ms']:10.3f} ms p95", file=sys.stderr)
+        
+        # Move the WAL into the main file first, or most of the data is not counted
+        with db._get_connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {
+            "rows": rows,
+            "setup_seconds": setup_seconds,
+            "db_bytes": os.path.getsize(db.db_path),
+            "operations": results
+        }
+    finally:
+        db.cleanup()
+        DatabaseManager._instance = None
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, current, threshold):
+    """Print the mean latency change per operation; return the regressions beyond ``threshold``."""
+    regressions = []
+    for scale, result in current["results"].items():
+        previous = baseline["results"].get(scale)
+        if previous is None:
+            continue
+        for name, stats in result["operations"].items():
+            before = previous["operations"].get(name)
+            if before is None or not before["mean_ms"]:
+                continue
+            change = stats["mean_ms"] / before["mean_ms"] - 1
+            flag = " REGRESSION" if change > threshold else ""
+            print(f"{scale:>10} {name:<32} {before['mean_ms']:10.3f} -> {stats['mean_ms']:10.3f} ms {change:+7.1%}{flag}")
+            if flag:
+                regressions.append((scale, name, change))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000],
+                        help="numbers of tasks to benchmark at, e.g. 10000 100000 1000000 10000000")
+    parser.add_argument("--repeat", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before failing, as a fraction")
+    args = parser.parse_args(argv)
+    
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed
+        },
+        "results": {}
+    }
+    for scale in args.scales:
+        print(f"Scale {scale}:", file=sys.stderr)
+        report["results"][str(scale)] = run_scale(scale, args.repeat, args.seed)
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), report, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1799 @@
+import unittest
+from unittest.mock import patch
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from prometheus_client import REGISTRY
+
+from agents.TaskOrchestrator.tools.database_manager import (
+    DatabaseManager, INDEXES, apply_delta, encode_delta, statement_template
+)
+from agents.TaskOrchestrator.tools.async_database_manager import AsyncDatabaseManager
+from agents.TaskOrchestrator.tools.columnar_analytics import (
+    agent_completion_distributions, export_columnar, load_columnar, status_dwell_times, task_key, throughput
+)
+from agents.TaskOrchestrator.tools.quantile_sketch import DDSketch
+from agents.TaskOrchestrator.tools.shard_router import ShardRouter
+from utils.backup import prune_backups
+
+def make_task(task_id, agent="TestAgent", status="pending", **overrides):
+    now = datetime.now().isoformat()
+    task = {
+        "id": task_id,
+        "title": f"Task {task_id}",
+        "description": f"Description for {task_id}",
+        "priority": 1,
+        "agent": agent,
+        "status": status,
+        "created_at": now,
+        "updated_at": now,
+        "dependencies": []
+    }
+    task.update(overrides)
+    return task
+
+def make_message(message_id, **overrides):
+    message = {
+        "id": message_id,
+        "from_agent": "AgentA",
+        "to_agent": "AgentB",
+        "content": f"Content of {message_id}",
+        "priority": "high",
+        "type": "task",
+        "status": "sent",
+        "timestamp": datetime.now().isoformat()
+    }
+    message.update(overrides)
+    return message
+
+class DatabaseManagerTestCase(unittest.TestCase):
+    """Base class giving every test its own database file and manager instance."""
+    
+    config = {"pool_size": 4}
+    
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "agency_test.db")
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config=self.config)
+    
+    def tearDown(self):
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+class TestConnectionPool(DatabaseManagerTestCase):
+    def test_pragmas_applied(self):
+        """Test that pooled connections use WAL and the configured pragmas"""
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+            self.assertEqual(conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+            self.assertGreater(conn.execute("PRAGMA busy_timeout").fetchone()[0], 0)
+    
+    def test_nested_checkout_reuses_connection(self):
+        """Test that nested blocks on one thread share a single connection"""
+        with self.db._get_connection() as outer:
+            with self.db._get_connection() as inner:
+                self.assertIs(outer, inner)
+        self.assertEqual(self.db.connection_pool.stats()["in_use"], 0)
+    
+    def test_pool_is_bounded_across_threads(self):
+        """Test that many short-lived threads never open more than pool_size connections"""
+        errors = []
+        
+        def worker(index):
+            try:
+                self.db.add_task(make_task(f"task_{index}"))
+                self.db.get_task_history(f"task_{index}")
+            except Exception as e:
+                errors.append(e)
+        
+        for batch in range(5):
+            threads = [threading.Thread(target=worker, args=(batch * 10 + i,)) for i in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        self.assertEqual(errors, [])
+        stats = self.db.connection_pool.stats()
+        self.assertLessEqual(stats["open"], self.config["pool_size"])
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 50)
+    
+    def test_idle_connections_reaped(self):
+        """Test that connections idle past the timeout are closed"""
+        self.db.connection_pool.idle_timeout = 0
+        self.db.get_task_history("missing")
+        with self.db._get_connection():
+            self.assertEqual(self.db.connection_pool.stats()["open"], 1)
+
+class TestBulkInserts(DatabaseManagerTestCase):
+    def test_add_tasks_bulk_from_generator(self):
+        """Test bulk task insert from a generator across several chunks"""
+        tasks = (make_task(f"task_{i}", agent=f"Agent{i % 3}") for i in range(25))
+        inserted = self.db.add_tasks_bulk(tasks, chunk_size=4)
+        
+        self.assertEqual(inserted, 25)
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 25)
+        self.assertEqual(self.db.get_agent_stats("Agent0")["tasks_pending"], 9)
+        self.assertEqual(self.db.get_agent_stats("Agent1")["tasks_pending"], 8)
+    
+    def test_add_tasks_bulk_adds_to_existing_stats(self):
+        """Test that bulk stats deltas are added to the counters already stored"""
+        self.db.add_task(make_task("existing"))
+        self.db.add_tasks_bulk([make_task("bulk_1"), make_task("bulk_2")])
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 3)
+    
+    def test_add_tasks_bulk_is_atomic(self):
+        """Test that a failing row rolls back the whole bulk insert"""
+        tasks = [make_task("dup"), make_task("other"), make_task("dup")]
+        with self.assertRaises(Exception):
+            self.db.add_tasks_bulk(tasks, chunk_size=2)
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 0)
+        self.assertIsNone(self.db.get_agent_stats("TestAgent"))
+    
+    def test_add_messages_bulk(self):
+        """Test bulk message insert with replies in the same batch"""
+        messages = [make_message("msg_0")]
+        messages += [
+            make_message(f"msg_{i}", thread_id="msg_0", reply_to_id=f"msg_{i - 1}")
+            for i in range(1, 10)
+        ]
+        self.assertEqual(self.db.add_messages_bulk(iter(messages), chunk_size=3), 10)
+        with self.db._get_connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM messages WHERE thread_id = 'msg_0'").fetchone()[0]
+        self.assertEqual(count, 10)
+
+class TestIndexes(DatabaseManagerTestCase):
+    def assertNoTableScan(self, plan, tables):
+        """Assert that no step of a query plan scans one of the given tables or aliases"""
+        scans = [step for step in plan if step.split()[:1] == ["SCAN"] and step.split()[1] in tables]
+        self.assertEqual(scans, [], f"Full table scan in plan: {plan}")
+    
+    def test_indexes_created_idempotently(self):
+        """Test that every managed index exists and re-creating them is a no-op"""
+        with self.db._get_connection() as conn:
+            self.db._create_indexes(conn.cursor())
+            names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        for name in INDEXES:
+            self.assertIn(name, names)
+    
+    def test_get_message_thread_uses_indexes(self):
+        """Test that thread and subtree lookups are single index range scans"""
+        plan = self.db.explain("""
+            SELECT id FROM messages WHERE thread_id = ? ORDER BY timestamp ASC
+        """, ("msg_1",))
+        self.assertNoTableScan(plan, {"messages"})
+        self.assertTrue(any("idx_messages_thread_timestamp_id" in step for step in plan))
+        
+        plan = self.db.explain("""
+            SELECT id FROM messages WHERE thread_id = ? AND path >= ? AND path < ?
+        """, ("msg_1", "msg_1/", "msg_10"))
+        self.assertNoTableScan(plan, {"messages"})
+        self.assertTrue(any("idx_messages_thread_path" in step for step in plan))
+    
+    def test_get_task_history_uses_index(self):
+        """Test that task history is read in index order without a sort"""
+        plan = self.db.explain("""
+            SELECT field_name, old_value, new_value, changed_at, changed_by
+            FROM task_history
+            WHERE task_id = ?
+            ORDER BY changed_at DESC
+        """, ("task_1",))
+        self.assertNoTableScan(plan, {"task_history"})
+        self.assertFalse(any("TEMP B-TREE" in step for step in plan))
+    
+    def test_export_pages_use_indexes(self):
+        """Test that each keyset page of iter_export_rows is an index range scan without a sort"""
+        for table, day_column in (("tasks", "created_at"), ("task_history", "changed_at")):
+            plan = self.db.explain(f"""
+                SELECT rowid FROM {table}
+                WHERE {day_column} >= ? AND ({day_column}, rowid) > (?, ?)
+                ORDER BY {day_column}, rowid
+                LIMIT ?
+            """, ("2024-01-01", "2024-01-02", 1, 100))
+            self.assertNoTableScan(plan, {table})
+            self.assertFalse(any("TEMP B-TREE" in step for step in plan))
+    
+    def test_agent_completion_join_uses_indexes(self):
+        """Test that the per-agent tasks/history join is index driven"""
+        plan = self.db.explain("""
+            SELECT COUNT(*)
+            FROM tasks t
+            JOIN task_history th ON t.id = th.task_id
+            WHERE t.agent = ?
+            AND th.field_name = 'status'
+            AND th.new_value = 'completed'
+        """, ("TestAgent",))
+        self.assertNoTableScan(plan, {"tasks", "task_history", "t", "th"})
+
+class TestIncrementalTaskStats(DatabaseManagerTestCase):
+    def test_completion_updates_running_stats(self):
+        """Test that completions update count, mean and variance incrementally"""
+        base = datetime.now()
+        for i, minutes in enumerate([10, 20, 30]):
+            created = (base - timedelta(minutes=minutes)).isoformat()
+            self.db.add_task(make_task(f"task_{i}", created_at=created))
+            self.db.update_task(f"task_{i}", {"status": "completed"})
+        
+        stats = self.db.get_agent_stats("TestAgent")
+        self.assertEqual(stats["tasks_completed"], 3)
+        self.assertEqual(stats["tasks_pending"], 0)
+        self.assertAlmostEqual(stats["avg_completion_time"], 20, delta=0.1)
+        self.assertAlmostEqual(stats["completion_time_variance"], 200 / 3, delta=0.5)
+    
+    def test_timezone_aware_timestamps(self):
+        """Test that "Z" and offset timestamps are timed in UTC, as julianday() in the rollups times them"""
+        base = datetime.now()
+        self.db.add_task(make_task("utc", created_at=(base - timedelta(minutes=10)).isoformat() + "Z"))
+        self.db.add_task(make_task("offset", created_at=(base + timedelta(minutes=10)).isoformat() + "+01:00"))
+        self.db.update_tasks_bulk([("utc", {"status": "completed"})])
+        self.db.update_task("offset", {"status": "completed"})
+        self.db.add_task(make_task(
+            "inserted", status="completed", created_at="2024-03-10T09:00:00+02:00", updated_at="2024-03-10T07:30:00Z"
+        ))
+        
+        stats = self.db.get_agent_stats("TestAgent")
+        self.assertEqual(stats["tasks_completed"], 3)
+        self.assertAlmostEqual(stats["avg_completion_time"], 30, delta=0.1)  # 10, 50 and 30 minutes
+        rollup = self.db.get_task_rollups((), start="2024-03-10T00:00:00Z")[0]
+        self.assertAlmostEqual(rollup["completion_minutes_sum"], 90, delta=0.1)
+        self.assertEqual(
+            self.db.get_task_rollups((), start="2024-03-10T07:00:00Z", end="2024-03-10T07:59:00+00:00")[0]["completions"], 1
+        )
+    
+    def test_add_task_keeps_completed_counters(self):
+        """Test that adding a task no longer resets completion stats"""
+        self.db.add_task(make_task("task_1"))
+        self.db.update_task("task_1", {"status": "completed"})
+        self.db.add_task(make_task("task_2"))
+        
+        stats = self.db.get_agent_stats("TestAgent")
+        self.assertEqual(stats["tasks_completed"], 1)
+        self.assertEqual(stats["tasks_pending"], 1)
+    
+    def test_repeated_completion_counted_once(self):
+        """Test that re-saving a completed task does not count it twice"""
+        self.db.add_task(make_task("task_1"))
+        self.db.update_task("task_1", {"status": "completed"})
+        self.db.update_task("task_1", {"status": "completed", "priority": 2})
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_completed"], 1)
+    
+    def test_legacy_task_stats_migrated(self):
+        """Test that a task_stats table without running sums is upgraded in place"""
+        legacy_path = os.path.join(self.temp_dir, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("""
+            CREATE TABLE task_stats (
+                agent TEXT PRIMARY KEY,
+                tasks_completed INTEGER DEFAULT 0,
+                tasks_pending INTEGER DEFAULT 0,
+                avg_completion_time REAL DEFAULT 0,
+                last_updated TEXT NOT NULL
+            )
+        """)
+        conn.execute("INSERT INTO task_stats VALUES ('TestAgent', 4, 1, 15.0, '2024-01-01T00:00:00')")
+        conn.commit()
+        conn.close()
+        
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(legacy_path, config=self.config)
+        
+        self.db.add_task(make_task("task_1", created_at=(datetime.now() - timedelta(minutes=40)).isoformat()))
+        self.db.update_task("task_1", {"status": "completed"})
+        stats = self.db.get_agent_stats("TestAgent")
+        self.assertEqual(stats["tasks_completed"], 5)
+        self.assertAlmostEqual(stats["avg_completion_time"], 20, delta=0.1)
+
+class TestTaskRollups(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.day = datetime(2024, 3, 10)
+        self.db.add_tasks_bulk([
+            make_task("task_1", agent="Alpha", priority=3, created_at=self.at(days=0, hours=9)),
+            make_task("task_2", agent="Alpha", priority=1, created_at=self.at(days=1, hours=14)),
+            make_task("task_3", agent="Beta", priority=2, created_at=self.at(days=2, hours=8)),
+            make_task("task_4", agent="Beta", status="failed", error_type="timeout", created_at=self.at(days=3, hours=1))
+        ])
+    
+    def at(self, days=0, hours=0, minutes=0):
+        return (self.day + timedelta(days=days, hours=hours, minutes=minutes)).isoformat()
+    
+    def rollup(self, group_by, **kwargs):
+        return {
+            tuple(row[key] for key in group_by): (row["tasks"], row["priority_sum"], row["completions"])
+            for row in self.db.get_task_rollups(group_by, **kwargs)
+        }
+    
+    def test_counts_follow_status_changes(self):
+        """Test that the rollups move tasks between states as they change"""
+        self.assertEqual(self.rollup(("status",)), {("pending",): (3, 6, 0), ("failed",): (1, 1, 0)})
+        
+        self.db.update_task("task_1", {"status": "completed"})
+        self.db.update_tasks_bulk([
+            ("task_2", {"status": "failed", "error_type": "timeout"}),
+            ("task_3", {"agent": "Alpha", "priority": 1})
+        ])
+        self.assertEqual(
+            self.rollup(("status",)), {("pending",): (1, 1, 0), ("completed",): (1, 3, 1), ("failed",): (2, 2, 0)}
+        )
+        self.assertEqual(self.rollup(("agent",), statuses=("pending",)), {("Alpha",): (1, 1, 0)})
+        self.assertEqual(self.rollup(("error_type", "agent"), statuses=("failed",)), {
+            ("timeout", "Alpha"): (1, 1, 0), ("timeout", "Beta"): (1, 1, 0)
+        })
+    
+    def test_completions_counted_when_they_happen(self):
+        """Test that completions land in the bucket of their completion with their duration"""
+        self.db.update_task("task_1", {"status": "completed"})
+        self.db.update_task("task_1", {"status": "completed", "priority": 2})
+        today = datetime.now().date().isoformat()
+        trends = self.db.get_task_rollups(("day",), start=today + "T00:00:00")
+        self.assertEqual([(row["day"], row["completions"]) for row in trends], [(today, 1)])
+        minutes = (datetime.now() - self.day - timedelta(hours=9)).total_seconds() / 60
+        self.assertAlmostEqual(trends[0]["completion_minutes_sum"], minutes, delta=1)
+    
+    def test_ranges_combine_daily_and_hourly_buckets(self):
+        """Test that ranges read whole days from the daily rollup and whole hours at the ends"""
+        def count(start, end):
+            return self.db.get_task_rollups((), start=start, end=end)[0]["tasks"]
+        
+        self.assertEqual(count(self.at(0, 9, 30), self.at(3, 1)), 4)
+        self.assertEqual(count(self.at(0, 10), self.at(3, 0, 59)), 2)
+        self.assertEqual(count(self.at(1), self.at(1, 23, 59)), 1)
+        self.assertEqual(count(self.at(1, 14, 45), self.at(1, 14, 50)), 1)  # widened to the whole hour
+        self.assertEqual(count(None, self.at(1, 13)), 1)
+        self.assertEqual(count(self.at(2, 8), None), 2)
+        self.assertEqual(count(self.at(5), self.at(6)), 0)
+        with self.assertRaises(ValueError):
+            self.db.get_task_rollups(("week",))
+    
+    def test_bulk_inserts_match_the_triggers(self):
+        """Test that chunked bulk inserts change the rollups and search index as per-row inserts do"""
+        tasks = [
+            make_task(f"bulk_{i}", agent=("Alpha", "Beta")[i % 2], status=("pending", "completed", "failed")[i % 3],
+                      priority=i % 4, error_type="timeout" if i % 3 == 2 else None,
+                      created_at=self.at(days=i % 3, hours=i % 5), updated_at=self.at(days=4, hours=i % 7))
+            for i in range(25)
+        ]
+        
+        def totals():
+            keys = ("day", "agent", "status", "error_type")
+            return {
+                (tuple(row[key] for key in keys), total): row[total]
+                for row in self.db.get_task_rollups(keys)
+                for total in ("tasks", "priority_sum", "completions", "completion_minutes_sum")
+            }
+        
+        def added(before, after):
+            return {cell: round(value - before.get(cell, 0), 6) for cell, value in after.items() if value != before.get(cell, 0)}
+        
+        start = totals()
+        self.db.add_tasks_bulk(tasks, chunk_size=4)
+        after_bulk = totals()
+        self.assertEqual(self.rollup(("status",))[("completed",)], (8, 12, 8))
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM bulk_load").fetchone()[0], 0)
+        self.assertEqual([task["id"] for task in self.db.search_tasks("bulk_7")], ["bulk_7"])
+        
+        for task in tasks:
+            self.db.add_task({**task, "id": f"single_{task['id']}"})
+        self.assertEqual(added(after_bulk, totals()), added(start, after_bulk))
+    
+    def test_failed_bulk_insert_keeps_triggers_on(self):
+        """Test that a bulk insert rolled back midway leaves the per-row triggers active"""
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.add_tasks_bulk([make_task("task_5", agent="Gamma"), make_task("task_1")], chunk_size=1)
+        self.db.add_task(make_task("task_6", agent="Gamma", created_at=self.at(days=4)))
+        self.assertEqual(self.rollup(("agent",)), {("Alpha",): (2, 4, 0), ("Beta",): (2, 3, 0), ("Gamma",): (1, 1, 0)})
+    
+    def test_triggers_without_bulk_guard_replaced(self):
+        """Test that insert triggers created before bulk inserts bypassed them are re-created with the guard"""
+        with self.db._get_connection() as conn:
+            conn.execute("DROP TRIGGER tasks_rollup_insert")
+            conn.execute("""
+                CREATE TRIGGER tasks_rollup_insert AFTER INSERT ON tasks BEGIN
+                    UPDATE task_rollup_daily SET tasks = tasks + 1000;
+                END
+            """)
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config=self.config)
+        
+        self.db.add_tasks_bulk([make_task("task_5", agent="Gamma", created_at=self.at(days=4))])
+        self.assertEqual(self.rollup(("agent",))[("Gamma",)], (1, 1, 0))
+        self.db.add_task(make_task("task_6", agent="Gamma", created_at=self.at(days=4)))
+        self.assertEqual(self.rollup(("agent",))[("Gamma",)], (2, 2, 0))
+    
+    def test_rollups_backfilled_for_existing_tasks(self):
+        """Test that rollups created for an existing database start from its tasks"""
+        with self.db._get_connection() as conn:
+            for table in ("task_rollup_hourly", "task_rollup_daily"):
+                conn.execute(f"DROP TABLE {table}")
+            for name in ("insert", "delete", "update"):
+                conn.execute(f"DROP TRIGGER tasks_rollup_{name}")
+        self.db.update_task("task_3", {"status": "completed"})
+        
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config=self.config)
+        self.assertEqual(
+            self.rollup(("status",)), {("pending",): (2, 4, 0), ("completed",): (1, 2, 1), ("failed",): (1, 1, 0)}
+        )
+
+class TestDashboard(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        # The tool imports the manager as ``tools.database_manager``; point its module-level instance at ours
+        tools_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "agents", "TaskOrchestrator"))
+        if tools_root not in sys.path:
+            sys.path.insert(0, tools_root)
+        from tools import database_manager
+        self.tool_manager_class = database_manager.DatabaseManager
+        self.tool_manager_class._instance = self.db
+        import tools.TaskAnalyticsTool as analytics
+        self.analytics = analytics
+        self.analytics.db_manager = self.db
+        
+        day = datetime(2024, 3, 10)
+        self.db.add_tasks_bulk([
+            make_task("task_1", agent="Alpha", priority=3, created_at=(day + timedelta(hours=9)).isoformat()),
+            make_task("task_2", agent="Alpha", status="in_progress", created_at=(day + timedelta(days=1)).isoformat()),
+            make_task("task_3", agent="Beta", priority=2, created_at=(day + timedelta(days=2)).isoformat()),
+            make_task("task_4", agent="Beta", status="failed", error_type="timeout", created_at=(day + timedelta(days=3)).isoformat()),
+            make_task("task_5", agent="Alpha", status="failed", error_type="crash", created_at=(day + timedelta(days=3)).isoformat())
+        ])
+        self.db.update_task("task_1", {"status": "completed"})
+        self.time_range = {"start": (day + timedelta(days=1)).isoformat(), "end": datetime.now().isoformat()}
+    
+    def tearDown(self):
+        self.tool_manager_class._instance = None
+        super().tearDown()
+    
+    def run_tool(self, operation, **fields):
+        return self.analytics.TaskAnalyticsTool(operation=operation, time_range=self.time_range, **fields).run()
+    
+    def test_sections_match_standalone_operations(self):
+        """Test that every dashboard section equals its own operation over the same range"""
+        dashboard = json.loads(self.run_tool("dashboard"))
+        self.assertEqual(list(dashboard), list(self.analytics.SECTIONS))
+        for section in self.analytics.SECTIONS:
+            self.assertEqual(dashboard[section], json.loads(self.run_tool(section)), section)
+        self.assertEqual(dashboard["workload_analysis"], [{"agent": "Alpha", "active_tasks": 1, "avg_priority": 1.0},
+                                                          {"agent": "Beta", "active_tasks": 1, "avg_priority": 2.0}])
+        self.assertEqual([error["error_type"] for error in dashboard["error_analysis"]], ["crash", "timeout"])
+    
+    def test_trimmed_sections(self):
+        """Test that only the requested sections are returned, in the requested order"""
+        dashboard = json.loads(self.run_tool("dashboard", sections=["error_analysis", "task_metrics"]))
+        self.assertEqual(list(dashboard), ["error_analysis", "task_metrics"])
+        self.assertEqual(dashboard["task_metrics"], json.loads(self.run_tool("task_metrics")))
+    
+    def test_unknown_section(self):
+        """Test that unknown sections are reported instead of silently dropped"""
+        self.assertEqual(
+            self.run_tool("dashboard", sections=["task_metrics", "velocity"]), "Error: Unknown dashboard sections velocity"
+        )
+    
+    def test_sections_cached_separately(self):
+        """Test that dashboards with different sections do not share a cached result"""
+        full = self.run_tool("dashboard")
+        self.assertEqual(list(json.loads(self.run_tool("dashboard", sections=["completion_trends"]))), ["completion_trends"])
+        self.assertEqual(list(json.loads(self.run_tool("dashboard", sections=["error_analysis"]))), ["error_analysis"])
+        self.assertEqual(self.run_tool("dashboard"), full)
+        self.assertEqual(self.db.result_cache.stats()["hits"], 1)
+        reordered = list(reversed(self.analytics.SECTIONS))
+        self.assertEqual(list(json.loads(self.run_tool("dashboard", sections=reordered))), reordered)
+
+class TestCompletionPercentiles(DatabaseManagerTestCase):
+    def exact(self, values, q):
+        values = sorted(values)
+        return values[int(q * (len(values) - 1))]
+    
+    def test_sketch_within_relative_accuracy(self):
+        """Test that sketch quantiles, merged or not, stay within the relative accuracy"""
+        rng = random.Random(7)
+        values = [rng.lognormvariate(3, 1.5) for _ in range(5000)]
+        whole, first, second = DDSketch(0.01), DDSketch(0.01), DDSketch(0.01)
+        whole.update(values)
+        first.update(values[:2000])
+        second.update(values[2000:])
+        first.merge(DDSketch.from_json(second.to_json()))
+        for q in (0.5, 0.9, 0.99):
+            self.assertAlmostEqual(whole.quantile(q), self.exact(values, q), delta=self.exact(values, q) * 0.01)
+            self.assertEqual(first.quantile(q), whole.quantile(q))
+        self.assertIsNone(DDSketch().quantile(0.5))
+        
+        # Another accuracy is re-binned, within both sketches' errors together
+        coarse = DDSketch(0.05)
+        coarse.update(values[2000:])
+        mixed = DDSketch(0.01)
+        mixed.update(values[:2000])
+        mixed.merge(coarse)
+        self.assertEqual((mixed.count, round(mixed.sum, 6)), (whole.count, round(whole.sum, 6)))
+        self.assertAlmostEqual(mixed.quantile(0.9), self.exact(values, 0.9), delta=self.exact(values, 0.9) * 0.06)
+    
+    def test_percentiles_follow_completions(self):
+        """Test that completions feed per-agent percentiles for windows and for all time"""
+        now = datetime.now()
+        minutes = {"Alpha": [10, 20, 30, 40, 1000], "Beta": [5]}
+        self.db.add_tasks_bulk([
+            make_task(f"{agent}_{i}", agent=agent, created_at=(now - timedelta(minutes=value)).isoformat())
+            for agent, values in minutes.items() for i, value in enumerate(values)
+        ])
+        self.db.update_task("Alpha_0", {"status": "completed"})
+        self.db.update_tasks_bulk([
+            (f"{agent}_{i}", {"status": "completed"})
+            for agent, values in minutes.items() for i in range(len(values)) if (agent, i) != ("Alpha", 0)
+        ])
+        
+        alpha = self.db.get_completion_percentiles("Alpha", start=(now - timedelta(hours=1)).isoformat())
+        self.assertEqual(alpha["completions"], 5)
+        self.assertAlmostEqual(alpha["p50"], 30, delta=0.5)
+        self.assertAlmostEqual(alpha["p99"], self.exact(minutes["Alpha"], 0.99), delta=0.5)
+        self.assertEqual(self.db.get_completion_percentiles()["completions"], 6)
+        self.assertEqual(self.db.get_completion_percentiles(end=(now - timedelta(days=2)).isoformat()), {
+            "completions": 0, "p50": None, "p90": None, "p99": None
+        })
+        stats = self.db.get_agent_stats("Alpha")
+        self.assertAlmostEqual(stats["completion_time_percentiles"]["p50"], 30, delta=0.5)
+        self.assertAlmostEqual(self.db.get_agent_stats("Beta")["completion_time_percentiles"]["p90"], 5, delta=0.1)
+    
+    def test_inserted_completions_counted_like_rollups(self):
+        """Test that tasks inserted already completed are in the sketches as they are in the rollups"""
+        created = datetime(2024, 3, 10, 9)
+        self.db.add_task(make_task(
+            "done", status="completed", created_at=created.isoformat(), updated_at=(created + timedelta(minutes=20)).isoformat()
+        ))
+        self.db.add_tasks_bulk([make_task(
+            "also_done", status="completed", created_at=created.isoformat(), updated_at=(created + timedelta(minutes=40)).isoformat()
+        )])
+        
+        percentiles = self.db.get_completion_percentiles("TestAgent", start="2024-03-10", end="2024-03-10T23:59:59")
+        rollup = self.db.get_task_rollups((), start="2024-03-10", end="2024-03-10T23:59:59", agent="TestAgent")[0]
+        self.assertEqual(percentiles["completions"], rollup["completions"])
+        self.assertEqual(percentiles["completions"], 2)
+        self.assertAlmostEqual(percentiles["p99"], 20, delta=0.2)
+        
+        # The running stats in the same response agree with the sketch
+        stats = self.db.get_agent_stats("TestAgent")
+        self.assertEqual((stats["tasks_completed"], stats["tasks_pending"]), (2, 0))
+        self.assertAlmostEqual(stats["avg_completion_time"], 30)
+        self.assertAlmostEqual(stats["completion_time_percentiles"]["p50"], 20, delta=0.2)
+    
+    def test_accuracy_change_keeps_percentiles_readable(self):
+        """Test that sketches stored at an earlier accuracy still merge after the setting changes"""
+        now = datetime.now()
+        yesterday = now - timedelta(days=1)
+        self.db.add_task(make_task(
+            "old", status="completed",
+            created_at=(yesterday - timedelta(minutes=30)).isoformat(), updated_at=yesterday.isoformat()
+        ))
+        
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config={**self.config, "latency_sketch_accuracy": 0.02})
+        self.db.add_task(make_task("new", created_at=(now - timedelta(minutes=60)).isoformat()))
+        self.db.update_task("new", {"status": "completed"})
+        
+        percentiles = self.db.get_completion_percentiles(start=(now - timedelta(days=2)).isoformat())
+        self.assertEqual(percentiles["completions"], 2)
+        self.assertAlmostEqual(percentiles["p50"], 30, delta=1)
+        self.assertAlmostEqual(self.db.get_agent_stats("TestAgent")["completion_time_percentiles"]["p99"], 30, delta=1)
+
+class TestResultCache(DatabaseManagerTestCase):
+    config = {"pool_size": 2, "result_cache_entries": 3, "result_cache_bytes": 4096}
+    
+    def setUp(self):
+        super().setUp()
+        self.calls = 0
+    
+    def count_tasks(self):
+        self.calls += 1
+        with self.db._get_read_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+    
+    def test_repeated_calls_hit_until_a_write(self):
+        """Test that results are reused until any connection commits a change"""
+        self.assertEqual(self.db.cached("count", self.count_tasks), 0)
+        self.assertEqual(self.db.cached("count", self.count_tasks), 0)
+        self.assertEqual(self.calls, 1)
+        
+        self.db.add_task(make_task("task_1"))
+        self.assertEqual(self.db.cached("count", self.count_tasks), 1)
+        self.assertEqual(self.calls, 2)
+        
+        # Writes from outside the manager, e.g. another process, invalidate too
+        other = sqlite3.connect(self.db_path)
+        other.execute("DELETE FROM task_stats")
+        other.commit()
+        other.close()
+        self.db.cached("count", self.count_tasks)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.db.result_cache.stats()["hits"], 1)
+    
+    def test_lru_eviction_by_count_and_size(self):
+        """Test that the least recently used results go first when a cap is exceeded"""
+        for key in ("a", "b", "c"):
+            self.db.cached(key, lambda: key)
+        self.db.cached("a", lambda: self.fail("a should be cached"))
+        self.db.cached("d", lambda: "d")
+        self.assertEqual(list(self.db.result_cache._entries), ["c", "a", "d"])
+        
+        self.db.cached("big", lambda: "x" * 3000)
+        self.assertEqual(list(self.db.result_cache._entries), ["a", "d", "big"])
+        self.db.cached("bigger", lambda: "y" * 3000)
+        self.assertEqual(list(self.db.result_cache._entries), ["bigger"])
+        self.db.cached("huge", lambda: "x" * 5000)  # larger than the cap; returned but not kept
+        self.assertNotIn("huge", self.db.result_cache._entries)
+        self.assertLessEqual(self.db.result_cache.stats()["bytes"], 4096)
+    
+    def test_disabled(self):
+        """Test that result_cache_entries 0 always computes"""
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config={"pool_size": 1, "result_cache_entries": 0})
+        self.db.cached("count", self.count_tasks)
+        self.db.cached("count", self.count_tasks)
+        self.assertEqual(self.calls, 2)
+
+class TestBackupRestore(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backup_dir = os.path.join(self.temp_dir, "backups")
+    
+    def _backups(self):
+        return sorted(os.listdir(self.backup_dir))
+    
+    def test_backup_during_writes_is_consistent(self):
+        """Test that an online backup taken under write load is a valid snapshot"""
+        self.db.add_tasks_bulk(make_task(f"task_{i}") for i in range(2000))
+        stop = threading.Event()
+        
+        def writer():
+            index = 0
+            while not stop.is_set():
+                self.db.add_message(make_message(f"live_{index}"))
+                index += 1
+        
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            result = self.db.backup_database(self.backup_dir)
+        finally:
+            stop.set()
+            thread.join()
+        
+        self.assertIn("Backup created successfully", result)
+        backup_path = os.path.join(self.backup_dir, self._backups()[0])
+        conn = sqlite3.connect(backup_path)
+        try:
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 2000)
+        finally:
+            conn.close()
+    
+    def test_compressed_backup_restores_atomically(self):
+        """Test restoring a gzipped backup while pooled connections stay open"""
+        self.db.add_task(make_task("kept"))
+        self.db.backup_database(self.backup_dir, compress=True)
+        backup_path = os.path.join(self.backup_dir, self._backups()[0])
+        self.assertTrue(backup_path.endswith(".db.gz"))
+        
+        self.db.add_task(make_task("discarded"))
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 2)
+        
+        self.assertEqual(self.db.restore_database(backup_path), "Database restored successfully")
+        with self.db._get_connection() as conn:
+            ids = [row[0] for row in conn.execute("SELECT id FROM tasks")]
+        self.assertEqual(ids, ["kept"])
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 1)
+    
+    def test_restore_upgrades_old_schema(self):
+        """Test that a backup from before later schema changes is usable after restoring it"""
+        backup_path = os.path.join(self.temp_dir, "baseline_backup.db")
+        conn = sqlite3.connect(backup_path)
+        conn.executescript("""
+            CREATE TABLE tasks (
+                id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT, priority INTEGER NOT NULL,
+                agent TEXT NOT NULL, status TEXT NOT NULL, created_at TEXT NOT NULL, updated_at TEXT NOT NULL,
+                dependencies TEXT, parent_task_id TEXT
+            );
+            CREATE TABLE task_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, task_id TEXT NOT NULL, field_name TEXT NOT NULL,
+                old_value TEXT, new_value TEXT, changed_at TEXT NOT NULL, changed_by TEXT NOT NULL
+            );
+            CREATE TABLE messages (
+                id TEXT PRIMARY KEY, from_agent TEXT NOT NULL, to_agent TEXT NOT NULL, content TEXT NOT NULL,
+                priority TEXT NOT NULL, type TEXT NOT NULL, status TEXT NOT NULL, timestamp TEXT NOT NULL,
+                thread_id TEXT, reply_to_id TEXT
+            );
+            CREATE TABLE task_stats (
+                agent TEXT PRIMARY KEY, tasks_completed INTEGER DEFAULT 0, tasks_pending INTEGER DEFAULT 0,
+                avg_completion_time REAL DEFAULT 0, last_updated TEXT NOT NULL
+            );
+            INSERT INTO tasks VALUES (
+                'restored', 'Restored task', 'From an old backup', 1, 'TestAgent', 'pending',
+                '2024-01-01T00:00:00', '2024-01-01T00:00:00', '[]', NULL
+            );
+        """)
+        conn.close()
+        
+        self.assertEqual(self.db.restore_database(backup_path), "Database restored successfully")
+        self.db.update_task("restored", {"status": "completed", "description": "Done"})
+        self.db.add_message(make_message("after_restore", content="restored message"))
+        history = {entry["field"]: entry["new_value"] for entry in self.db.get_task_history("restored")}
+        self.assertEqual(history, {"status": "completed", "description": "Done"})
+        self.assertEqual([r["id"] for r in self.db.search_messages("restored")], ["after_restore"])
+    
+    def test_retention_by_count_and_age(self):
+        """Test that old and surplus backups are pruned"""
+        os.makedirs(self.backup_dir)
+        now = time.time()
+        for index in range(4):
+            path = os.path.join(self.backup_dir, f"agency_data_backup_2024010{index}_000000.db")
+            open(path, "w").close()
+            os.utime(path, (now - index * 3600, now - index * 3600))
+        stale = os.path.join(self.backup_dir, "agency_data_backup_20230101_000000.db")
+        open(stale, "w").close()
+        os.utime(stale, (now - 90 * 86400, now - 90 * 86400))
+        
+        removed = prune_backups(self.backup_dir, "agency_data_backup_*", keep=3, max_age_days=30)
+        
+        self.assertEqual(len(removed), 2)
+        self.assertEqual(len(self._backups()), 3)
+        self.assertFalse(os.path.exists(stale))
+
+class TestReadOnlyPool(DatabaseManagerTestCase):
+    config = {"pool_size": 2, "read_pool_size": 2}
+    
+    def test_read_connections_refuse_writes(self):
+        """Test that snapshot connections are read-only"""
+        with self.db._get_read_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA query_only").fetchone()[0], 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM tasks")
+        with self.assertRaises(sqlite3.ProgrammingError):
+            with self.db.read_pool.connection(write=True):
+                pass
+    
+    def test_reads_see_one_snapshot(self):
+        """Test that a read block keeps its snapshot while writers commit"""
+        self.db.add_task(make_task("task_1"))
+        with self.db._get_read_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 1)
+            # Writers go through their own pool and are not blocked by the open read
+            self.db.add_task(make_task("task_2"))
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 1)
+        with self.db._get_read_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 2)
+        self.assertEqual(self.db.connection_pool.stats()["open"], 1)
+        self.assertEqual(self.db.read_pool.stats()["open"], 1)
+    
+    def test_disabled_falls_back_to_main_pool(self):
+        """Test that read_pool_size 0 routes reads through the main pool"""
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config={"pool_size": 1, "read_pool_size": 0})
+        self.assertIsNone(self.db.read_pool)
+        with self.db._get_read_connection() as conn:
+            conn.execute("SELECT COUNT(*) FROM tasks")
+        self.assertEqual(self.db.connection_pool.stats()["open"], 1)
+
+class TestGroupCommit(DatabaseManagerTestCase):
+    config = {"pool_size": 4, "write_behind": True, "group_commit_max_delay": 0.005}
+    
+    def test_concurrent_writes_are_all_committed(self):
+        """Test that writes from many threads land through the single writer"""
+        def worker(prefix):
+            for index in range(50):
+                self.db.add_message(make_message(f"{prefix}_{index}"))
+        
+        threads = [threading.Thread(target=worker, args=(f"t{i}",)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 400)
+    
+    def test_submit_returns_future(self):
+        """Test that submit hands back a future resolved after the commit"""
+        futures = [self.db.submit("add_task", make_task(f"task_{i}")) for i in range(20)]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual([task["id"] for task in results], [f"task_{i}" for i in range(20)])
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 20)
+    
+    def test_failed_write_does_not_abort_batch(self):
+        """Test that one failing write only rolls back its own savepoint"""
+        futures = [
+            self.db.submit("add_task", make_task("dup")),
+            self.db.submit("add_task", make_task("dup")),
+            self.db.submit("add_task", make_task("other"))
+        ]
+        self.assertEqual(futures[0].result(timeout=5)["id"], "dup")
+        with self.assertRaises(sqlite3.IntegrityError):
+            futures[1].result(timeout=5)
+        self.assertEqual(futures[2].result(timeout=5)["id"], "other")
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 2)
+    
+    def test_submit_rejects_reads(self):
+        """Test that only write operations can be submitted"""
+        with self.assertRaises(ValueError):
+            self.db.submit("get_task_history", "task_1")
+
+class TestAsyncDatabaseManager(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.async_db = AsyncDatabaseManager(self.db, max_workers=2, max_in_flight=3)
+    
+    def tearDown(self):
+        self.async_db.close()
+        super().tearDown()
+    
+    def test_async_methods_mirror_manager(self):
+        """Test the async facade end to end"""
+        async def scenario():
+            await self.async_db.add_task(make_task("task_1"))
+            await self.async_db.update_task("task_1", {"status": "completed"}, "tester")
+            await self.async_db.add_message(make_message("msg_1"))
+            return await asyncio.gather(
+                self.async_db.get_task_history("task_1"),
+                self.async_db.get_agent_stats("TestAgent"),
+                self.async_db.get_message_thread("msg_1")
+            )
+        
+        history, stats, thread = asyncio.run(scenario())
+        self.assertEqual(history[0]["new_value"], "completed")
+        self.assertEqual(stats["tasks_completed"], 1)
+        self.assertEqual([message["id"] for message in thread], ["msg_1"])
+    
+    def test_in_flight_queries_capped_without_blocking_loop(self):
+        """Test that slow queries are capped and the event loop keeps running"""
+        active = []
+        peak = []
+        original = self.db.get_agent_stats
+        
+        def slow_stats(agent):
+            active.append(agent)
+            peak.append(len(active))
+            time.sleep(0.05)
+            active.remove(agent)
+            return original(agent)
+        
+        async def scenario():
+            ticks = 0
+            
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.005)
+            
+            ticking = asyncio.ensure_future(ticker())
+            await asyncio.gather(*(self.async_db.get_agent_stats(f"Agent{i}") for i in range(6)))
+            ticking.cancel()
+            return ticks
+        
+        with patch.object(self.db, "get_agent_stats", slow_stats):
+            ticks = asyncio.run(scenario())
+        
+        self.assertLessEqual(max(peak), 2)
+        self.assertGreater(ticks, 5)
+    
+    def test_close_cleans_up_own_manager_only(self):
+        """Test that close cleans up the manager the facade created but not one it was given"""
+        with patch.object(self.db, "cleanup", wraps=self.db.cleanup) as cleanup:
+            self.async_db.close()
+            cleanup.assert_not_called()
+            
+            owner = AsyncDatabaseManager(max_workers=1)  # the shared DatabaseManager() instance
+            self.assertIs(owner.db, self.db)
+            asyncio.run(owner.add_task(make_task("task_1")))
+            owner.close()
+            cleanup.assert_called_once()
+        self.assertTrue(self.db.connection_pool._closed)
+        other = sqlite3.connect(self.db_path)
+        self.assertEqual(other.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 1)
+        other.close()
+
+class TestMessageThreads(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        base = datetime(2024, 1, 1)
+        self.stamp = lambda minute: (base + timedelta(minutes=minute)).isoformat()
+    
+    def _add_chain(self, length):
+        self.db.add_message(make_message("root", timestamp=self.stamp(0)))
+        for index in range(1, length):
+            self.db.add_message(make_message(
+                f"reply_{index}",
+                timestamp=self.stamp(index),
+                thread_id="root",
+                reply_to_id="root" if index == 1 else f"reply_{index - 1}"
+            ))
+    
+    def test_deep_thread_has_no_duplicates(self):
+        """Test that each message of a deep thread is returned once with its depth"""
+        self._add_chain(50)
+        thread = self.db.get_message_thread("root")
+        self.assertEqual(len(thread), 50)
+        self.assertEqual([message["depth"] for message in thread], list(range(50)))
+    
+    def test_reply_inherits_thread(self):
+        """Test that a reply without a thread ID joins its parent's thread"""
+        self.db.add_message(make_message("root", timestamp=self.stamp(0)))
+        self.db.add_message(make_message("reply", timestamp=self.stamp(1), reply_to_id="root"))
+        thread = self.db.get_message_thread("root")
+        self.assertEqual([(m["id"], m["thread_id"], m["depth"]) for m in thread], [
+            ("root", "root", 0),
+            ("reply", "root", 1)
+        ])
+    
+    def test_subtree_and_latest_replies(self):
+        """Test subtree range lookups and the latest-N window"""
+        self.db.add_messages_bulk([
+            make_message("root", timestamp=self.stamp(0)),
+            make_message("a", timestamp=self.stamp(1), reply_to_id="root"),
+            make_message("b", timestamp=self.stamp(2), reply_to_id="root"),
+            make_message("a/1", timestamp=self.stamp(3), reply_to_id="a"),
+            make_message("b1", timestamp=self.stamp(4), reply_to_id="b"),
+            make_message("a/1/x", timestamp=self.stamp(5), reply_to_id="a/1")
+        ], chunk_size=4)
+        
+        self.assertEqual([m["id"] for m in self.db.get_message_subtree("a")], ["a", "a/1", "a/1/x"])
+        self.assertEqual([m["id"] for m in self.db.get_message_subtree("b")], ["b", "b1"])
+        self.assertEqual(self.db.get_message_subtree("missing"), [])
+        self.assertEqual([m["id"] for m in self.db.get_latest_replies("root", limit=2)], ["b1", "a/1/x"])
+    
+    def test_legacy_messages_backfilled(self):
+        """Test that a messages table without paths is migrated in place"""
+        legacy_path = os.path.join(self.temp_dir, "legacy_messages.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("""
+            CREATE TABLE messages (
+                id TEXT PRIMARY KEY, from_agent TEXT NOT NULL, to_agent TEXT NOT NULL,
+                content TEXT NOT NULL, priority TEXT NOT NULL, type TEXT NOT NULL,
+                status TEXT NOT NULL, timestamp TEXT NOT NULL, thread_id TEXT, reply_to_id TEXT
+            )
+        """)
+        rows = [
+            ("m1", "m1", None, self.stamp(0)),
+            ("m2", "m1", "m1", self.stamp(1)),
+            ("m3", "m3", "m2", self.stamp(2))  # defaulted thread ID on a reply
+        ]
+        for message_id, thread_id, reply_to_id, timestamp in rows:
+            conn.execute(
+                "INSERT INTO messages VALUES (?, 'A', 'B', 'text', 'high', 'task', 'sent', ?, ?, ?)",
+                (message_id, timestamp, thread_id, reply_to_id)
+            )
+        conn.commit()
+        conn.close()
+        
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(legacy_path, config=self.config)
+        
+        thread = self.db.get_message_thread("m1")
+        self.assertEqual([(m["id"], m["depth"]) for m in thread], [("m1", 0), ("m2", 1), ("m3", 2)])
+        self.assertEqual([m["id"] for m in self.db.get_message_subtree("m2")], ["m2", "m3"])
+
+class TestKeysetReaders(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        base = datetime(2024, 1, 1)
+        # Pairs of messages share a timestamp so the id tiebreaker matters
+        self.db.add_messages_bulk(
+            make_message(f"m{i:04d}", thread_id="t", timestamp=(base + timedelta(seconds=i // 2)).isoformat())
+            for i in range(250)
+        )
+    
+    def test_streams_whole_thread_in_pages(self):
+        """Test that the generator walks every page in (timestamp, id) order"""
+        ids = [m["id"] for m in self.db.iter_message_thread("t", page_size=32, columns=["id"])]
+        self.assertEqual(ids, [f"m{i:04d}" for i in range(250)])
+    
+    def test_cursor_continuation_and_last_page(self):
+        """Test after/before cursors and reading the newest page"""
+        first = list(self.db.iter_message_thread("t", limit=5, page_size=2))
+        cursor = (first[-1]["timestamp"], first[-1]["id"])
+        following = list(self.db.iter_message_thread("t", limit=3, after=cursor, columns=["id"]))
+        self.assertEqual([m["id"] for m in following], ["m0005", "m0006", "m0007"])
+        
+        newest = list(self.db.iter_message_thread("t", limit=3, order="desc", columns=["id"]))
+        self.assertEqual([m["id"] for m in newest], ["m0249", "m0248", "m0247"])
+        
+        older = list(self.db.iter_message_thread(
+            "t", limit=2, order="desc", before=(first[1]["timestamp"], first[1]["id"]), columns=["id"]
+        ))
+        self.assertEqual([m["id"] for m in older], ["m0000"])
+    
+    def test_projection_and_validation(self):
+        """Test that only requested columns are returned and unknown ones rejected"""
+        message = next(self.db.iter_message_thread("t", columns=["id", "depth"]))
+        self.assertEqual(message, {"id": "m0000", "depth": 0})
+        with self.assertRaises(ValueError):
+            self.db.iter_message_thread("t", columns=["id; DROP TABLE messages"])
+    
+    def test_iter_task_history_newest_first(self):
+        """Test streaming task history with the same fields as get_task_history"""
+        self.db.add_task(make_task("task_1"))
+        for priority in range(2, 8):
+            self.db.update_task("task_1", {"priority": priority})
+        
+        entries = list(self.db.iter_task_history("task_1", page_size=4))
+        self.assertEqual([entry["new_value"] for entry in entries], [str(p) for p in range(7, 1, -1)])
+        expected = self.db.get_task_history("task_1")[0]
+        self.assertEqual({key: entries[0][key] for key in expected}, expected)
+
+class TestFullTextSearch(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.add_messages_bulk([
+            make_message("m1", content="Tavily research on quantum error correction papers", thread_id="t1"),
+            make_message("m2", content="Summary of quantum computing startups", from_agent="Research", thread_id="t2"),
+            make_message("m3", content="Camera calibration finished", thread_id="t1")
+        ])
+        self.db.add_tasks_bulk([
+            make_task("task_1", title="Research quantum error correction", description="Collect recent papers"),
+            make_task("task_2", title="Calibrate camera", description="Needs quantum efficiency numbers", agent="Vision")
+        ])
+    
+    def test_search_messages_ranked_with_snippets(self):
+        """Test BM25-ranked message search with highlighted snippets"""
+        results = self.db.search_messages("quantum error")
+        self.assertEqual([r["id"] for r in results], ["m1"])
+        self.assertIn("[quantum]", results[0]["snippet"])
+        
+        results = self.db.search_messages("quantum")
+        self.assertEqual({r["id"] for r in results}, {"m1", "m2"})
+        self.assertEqual(self.db.search_messages("quantum", agent="Research")[0]["id"], "m2")
+        self.assertEqual(self.db.search_messages("quantum", thread_id="t1")[0]["id"], "m1")
+    
+    def test_plain_queries_are_escaped(self):
+        """Test that natural-language text is not parsed as FTS5 syntax"""
+        self.assertEqual(self.db.search_messages('have we researched "quantum"?'), [])
+        self.assertEqual(len(self.db.search_messages("quantum OR camera", raw=True)), 3)
+    
+    def test_bulk_inserted_messages_indexed_once(self):
+        """Test that chunked bulk inserts index each message once and leave the insert trigger on afterwards"""
+        self.db.add_messages_bulk(
+            (make_message(f"bulk_{i}", content=f"Bulk loaded telemetry {i}", thread_id="t3") for i in range(7)), chunk_size=3
+        )
+        self.db.add_message(make_message("single", content="Single telemetry", thread_id="t3"))
+        with self.db._get_connection() as conn:
+            indexed = [row[0] for row in conn.execute("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'telemetry'")]
+            expected = [row[0] for row in conn.execute("SELECT rowid FROM messages WHERE thread_id = 't3'")]
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM bulk_load").fetchone()[0], 0)
+        self.assertEqual(sorted(indexed), sorted(expected))
+        self.assertEqual(len(indexed), 8)
+        self.assertEqual([r["id"] for r in self.db.search_messages("loaded 5")], ["bulk_5"])
+    
+    def test_index_follows_updates(self):
+        """Test that triggers keep the task index in sync with edits"""
+        self.db.update_task("task_2", {"description": "Lens distortion only"})
+        results = self.db.search_tasks("quantum")
+        self.assertEqual([r["id"] for r in results], ["task_1"])
+        self.assertEqual(self.db.search_tasks("distortion")[0]["id"], "task_2")
+        self.assertEqual(self.db.search_tasks("research", status="completed"), [])
+
+class TestArchival(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = datetime.now() - timedelta(days=200)
+        self.db.add_task(make_task("task_1", created_at=self.old.isoformat()))
+        with self.db._get_connection() as conn:
+            conn.executemany("""
+                INSERT INTO task_history (task_id, field_name, old_value, new_value, changed_at, changed_by)
+                VALUES ('task_1', 'priority', ?, ?, ?, 'tester')
+            """, [(str(i), str(i + 1), (self.old + timedelta(days=i * 20)).isoformat()) for i in range(10)])
+        self.db.add_messages_bulk([
+            make_message("old_root", content="archived conversation " + "x" * 20000, timestamp=self.old.isoformat()),
+            make_message("old_reply", reply_to_id="old_root", timestamp=(self.old + timedelta(days=1)).isoformat()),
+            make_message("new_root", timestamp=datetime.now().isoformat())
+        ])
+    
+    def test_archive_moves_old_rows_into_monthly_files(self):
+        """Test that old history and finished threads leave the hot database"""
+        result = self.db.archive_old_rows(older_than_days=90)
+        
+        self.assertEqual(result["moved"]["messages"], 2)
+        self.assertGreater(result["pages_freed"], 0)
+        self.assertGreater(result["moved"]["task_history"], 0)
+        for path in result["archives"]:
+            self.assertTrue(os.path.exists(path))
+        
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)  # INCREMENTAL
+            remaining = [row[0] for row in conn.execute("SELECT changed_at FROM task_history")]
+            self.assertTrue(all(changed_at >= result["cutoff"] for changed_at in remaining))
+            self.assertEqual([row[0] for row in conn.execute("SELECT id FROM messages")], ["new_root"])
+        self.assertEqual(self.db.search_messages("archived"), [])
+        
+        # Re-running finds nothing left to move
+        self.assertEqual(self.db.archive_old_rows(older_than_days=90)["moved"], {"task_history": 0, "messages": 0})
+    
+    def test_archive_converts_database_without_auto_vacuum(self):
+        """Test that a file created before auto_vacuum was configured is converted and shrinks"""
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        legacy_path = os.path.join(self.temp_dir, "no_auto_vacuum.db")
+        self.db = DatabaseManager(legacy_path, config={**self.config, "auto_vacuum": "NONE"})
+        self.db.add_messages_bulk(
+            make_message(f"old_{i}", content="archived " + "x" * 4000, thread_id="old", timestamp=self.old.isoformat())
+            for i in range(200)
+        )
+        self.db.cleanup()
+        
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(legacy_path, config=self.config)
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 0)  # NONE
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size = os.path.getsize(legacy_path)
+        
+        result = self.db.archive_old_rows(older_than_days=90)
+        self.assertEqual(result["moved"]["messages"], 200)
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("PRAGMA auto_vacuum").fetchone()[0], 2)  # INCREMENTAL
+            self.assertEqual(conn.execute("PRAGMA freelist_count").fetchone()[0], 0)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.assertLess(os.path.getsize(legacy_path), size)
+    
+    def test_reads_attach_archives_for_old_ranges(self):
+        """Test that ranged reads merge archived rows and plain reads stay hot"""
+        before = self.db.get_task_history("task_1", since=self.old.isoformat())
+        self.db.archive_old_rows(older_than_days=90)
+        
+        self.assertLess(len(self.db.get_task_history("task_1")), len(before))
+        self.assertEqual(self.db.get_task_history("task_1", since=self.old.isoformat()), before)
+        
+        recent = (datetime.now() - timedelta(days=60)).isoformat()
+        self.assertTrue(all(e["changed_at"] >= recent for e in self.db.get_task_history("task_1", since=recent)))
+        
+        self.assertEqual(self.db.get_message_thread("old_root"), [])
+        thread = self.db.get_message_thread("old_root", since=self.old.isoformat())
+        self.assertEqual([(m["id"], m["depth"]) for m in thread], [("old_root", 0), ("old_reply", 1)])
+
+class TestColumnarExport(DatabaseManagerTestCase):
+    # One pooled connection and two-row pages, so exports page through and reuse the same connection
+    config = {"pool_size": 1, "page_size": 2, "bulk_chunk_size": 2}
+    
+    def setUp(self):
+        super().setUp()
+        self.out_dir = os.path.join(self.temp_dir, "columnar")
+        self.day = datetime(2024, 3, 10, 9)
+        self.db.add_tasks_bulk([
+            make_task(f"task_{i}", agent=("Alpha", "Beta")[i % 2], created_at=self.at(i, 0).isoformat())
+            for i in range(9)
+        ])
+        with self.db._get_connection() as conn:
+            # Completed after 10 * (i + 1) minutes; task_0 to task_3 went through in_progress on the way
+            conn.executemany(
+                "UPDATE tasks SET status = 'completed', updated_at = ? WHERE id = ?",
+                [(self.at(i, 10 * (i + 1)).isoformat(), f"task_{i}") for i in range(6)]
+            )
+            conn.executemany("""
+                INSERT INTO task_history (task_id, field_name, old_value, new_value, changed_at, changed_by)
+                VALUES (?, 'status', ?, ?, ?, 'tester')
+            """, [
+                row for i in range(4) for row in (
+                    (f"task_{i}", "pending", "in_progress", self.at(i, 5).isoformat()),
+                    (f"task_{i}", "in_progress", "completed", self.at(i, 10 * (i + 1)).isoformat())
+                )
+            ])
+        self.db.update_task("task_8", {"title": "Renamed"})
+    
+    def at(self, i, minutes):
+        """Task ``i`` is created on day ``i % 3``; ``minutes`` after its creation."""
+        return self.day + timedelta(days=i % 3, minutes=minutes)
+    
+    def test_export_partitions_by_day(self):
+        """Test that tables are written as one npy partition per day and read back as arrays"""
+        written = export_columnar(self.db, self.out_dir, export_format="npy")
+        days = ["2024-03-10", "2024-03-11", "2024-03-12"]
+        self.assertEqual(written["tasks"], dict(zip(days, (3, 3, 3))))
+        self.assertEqual(sum(written["task_history"].values()), 8)  # the title change is not exported
+        self.assertEqual(sorted(os.listdir(os.path.join(self.out_dir, "tasks"))), days)
+        
+        tasks = load_columnar(self.out_dir, "tasks", start="2024-03-11", columns=["id", "agent", "status", "updated_at"])
+        self.assertEqual(len(tasks), 6)
+        self.assertEqual(sorted(tasks.decode("agent")), ["Alpha"] * 3 + ["Beta"] * 3)
+        self.assertIn(task_key("task_4"), tasks["id"])
+        self.assertEqual(tasks["updated_at"].dtype, "datetime64[s]")
+    
+    def test_vectorized_analytics(self):
+        """Test durations, throughput and distributions computed from the exported arrays"""
+        export_columnar(self.db, self.out_dir, export_format="npy")
+        tasks = load_columnar(self.out_dir, "tasks")
+        
+        buckets, counts = throughput(tasks)
+        self.assertEqual([str(bucket) for bucket in buckets], ["2024-03-10", "2024-03-11", "2024-03-12"])
+        self.assertEqual(counts.tolist(), [2, 2, 2])
+        distributions = agent_completion_distributions(tasks)
+        self.assertEqual(distributions["Alpha"]["count"], 3)  # task_0, task_2, task_4
+        self.assertEqual((distributions["Alpha"]["mean"], distributions["Alpha"]["p50"]), (30.0, 30.0))
+        self.assertEqual(distributions["Beta"]["p99"], 40.0)
+        
+        dwell = status_dwell_times(load_columnar(self.out_dir, "task_history"))
+        self.assertEqual(dwell["in_progress"]["count"], 4)
+        self.assertEqual(dwell["in_progress"]["p90"], 25.0)  # minutes 5, 15, 25, 35 spent in progress
+    
+    def test_reexport_since_and_archived_history(self):
+        """Test that re-exports rewrite only recent days and still include archived history"""
+        export_columnar(self.db, self.out_dir, export_format="npy")
+        self.db.archive_old_rows(older_than_days=0)
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM task_history WHERE field_name = 'status'").fetchone()[0], 0)
+        
+        written = export_columnar(self.db, self.out_dir, since="2024-03-11T12:00:00", export_format="npy")
+        self.assertEqual(list(written["tasks"]), ["2024-03-11", "2024-03-12"])
+        self.assertEqual(sum(written["task_history"].values()), 4)
+        self.assertEqual(len(load_columnar(self.out_dir, "task_history")), 8)
+    
+    def test_abandoned_export_releases_archives(self):
+        """Test that an export stopped midway leaves no archive attached to the pooled connection"""
+        self.db.archive_old_rows(older_than_days=0)
+        rows = self.db.iter_export_rows("task_history")
+        next(rows)
+        rows.close()
+        
+        self.assertEqual(sum(export_columnar(self.db, self.out_dir, export_format="npy")["task_history"].values()), 8)
+        self.assertEqual(len(self.db.get_task_history("task_0", since="2024-01-01")), 2)
+
+class TestCompression(DatabaseManagerTestCase):
+    # Every history row a snapshot, so history values are stored in full
+    config = {"pool_size": 4, "compression": "zlib", "compress_min_bytes": 256, "history_snapshot_interval": 1}
+    
+    def setUp(self):
+        super().setUp()
+        self.page = "Extracted page about quantum error correction and surface codes. " * 100
+        self.db.add_messages_bulk([
+            make_message("root", content=self.page, thread_id="t1"),
+            make_message("reply", content="short reply", reply_to_id="root", thread_id="t1")
+        ])
+    
+    def stored(self, query, params=()):
+        with self.db._get_connection() as conn:
+            return conn.execute(query, params).fetchone()
+    
+    def test_large_content_stored_compressed(self):
+        """Test that large message content is stored compressed and read back as text"""
+        content, codec = self.stored("SELECT content, content_codec FROM messages WHERE id = 'root'")
+        self.assertEqual(codec, "zlib")
+        self.assertIsInstance(content, bytes)
+        self.assertLess(len(content), len(self.page))
+        self.assertEqual(self.stored("SELECT content, content_codec FROM messages WHERE id = 'reply'"), ("short reply", None))
+        
+        self.assertEqual([m["content"] for m in self.db.get_message_thread("t1")], [self.page, "short reply"])
+        self.assertEqual(next(iter(self.db.iter_message_thread("t1")))["content"], self.page)
+        self.assertEqual(self.db.get_message_subtree("root")[0]["content"], self.page)
+    
+    def test_search_reads_through_compression(self):
+        """Test that compressed messages are indexed and snippeted as text"""
+        results = self.db.search_messages("surface codes")
+        self.assertEqual([r["id"] for r in results], ["root"])
+        self.assertIn("[surface]", results[0]["snippet"])
+    
+    def test_schema_usable_without_codecs(self):
+        """Test that clients without the inflate() function can write messages and query the index"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            INSERT INTO messages (id, from_agent, to_agent, content, priority, type, status, timestamp, thread_id)
+            VALUES ('external', 'Cli', 'Orchestrator', 'surface codes from the command line', 'normal', 'note', 'sent', ?, 't2')
+        """, (datetime.now().isoformat(),))
+        self.assertIsNotNone(conn.execute("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'command'").fetchone())
+        conn.execute("DELETE FROM messages WHERE id = 'root'")
+        conn.commit()
+        conn.close()
+        
+        results = self.db.search_messages("surface codes")
+        self.assertEqual([r["id"] for r in results], ["external"])
+        self.assertEqual(results[0]["snippet"], "[surface] [codes] from the command line")
+    
+    def test_history_values_compressed(self):
+        """Test that large history values round-trip through compression"""
+        self.db.add_task(make_task("task_1"))
+        self.db.update_task("task_1", {"description": self.page})
+        self.db.update_tasks_bulk([("task_1", {"description": "trimmed"})])
+        
+        self.assertEqual(
+            self.stored("SELECT COUNT(*) FROM task_history WHERE old_value_codec = 'zlib' OR new_value_codec = 'zlib'")[0], 2
+        )
+        history = [e for e in self.db.get_task_history("task_1") if e["field"] == "description"]
+        self.assertEqual({e["new_value"] for e in history}, {self.page, "trimmed"})
+        self.assertIn(self.page, {e["old_value"] for e in history})
+    
+    def test_compression_disabled(self):
+        """Test that compression=None stores every value as plain text"""
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config={"pool_size": 1, "compression": None})
+        self.db.add_message(make_message("plain", content=self.page))
+        self.assertEqual(self.stored("SELECT content, content_codec FROM messages WHERE id = 'plain'"), (self.page, None))
+    
+    def test_archived_messages_stay_readable(self):
+        """Test that compressed content survives the move into an archive"""
+        old = datetime.now() - timedelta(days=200)
+        self.db.add_message(make_message("old", content=self.page, timestamp=old.isoformat()))
+        self.db.archive_old_rows(older_than_days=90)
+        self.assertEqual(self.db.get_message_thread("old", since=old.isoformat())[0]["content"], self.page)
+    
+    def test_legacy_rows_compressed_on_startup(self):
+        """Test that an uncompressed database is migrated, compressed and still searchable"""
+        legacy_path = os.path.join(self.temp_dir, "legacy_compression.db")
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(legacy_path, config={"pool_size": 1, "compression": None})
+        self.db.add_message(make_message("legacy", content=self.page))
+        self.db.cleanup()
+        
+        # Roll the file back to the layout from before compression existed
+        conn = sqlite3.connect(legacy_path)
+        conn.executescript("""
+            DROP TRIGGER messages_fts_insert;
+            DROP TRIGGER messages_fts_delete;
+            DROP TRIGGER messages_fts_update;
+            DROP TABLE messages_fts;
+            ALTER TABLE messages DROP COLUMN content_codec;
+            ALTER TABLE task_history DROP COLUMN old_value_codec;
+            ALTER TABLE task_history DROP COLUMN new_value_codec;
+            CREATE VIRTUAL TABLE messages_fts USING fts5(content, content='messages', content_rowid='rowid');
+            INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+        """)
+        conn.close()
+        
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(legacy_path, config=self.config)
+        self.assertEqual(self.stored("SELECT content_codec FROM messages WHERE id = 'legacy'")[0], "zlib")
+        self.assertEqual(self.db.get_message_thread("legacy")[0]["content"], self.page)
+        self.assertEqual([r["id"] for r in self.db.search_messages("surface codes")], ["legacy"])
+
+class TestHistoryDeltas(DatabaseManagerTestCase):
+    config = {"pool_size": 4, "history_snapshot_interval": 4}
+    
+    def setUp(self):
+        super().setUp()
+        self.db.add_task(make_task("task_1", description="Draft"))
+        paragraph = "Collect recent papers on quantum error correction and summarize the findings. "
+        self.versions = ["Draft"] + [paragraph * 20 + f"Revision {i}: ünïcode notes." for i in range(10)]
+        for version in self.versions[1:]:
+            self.db.update_task("task_1", {"description": version})
+    
+    def expected(self):
+        """Description history as full values, newest first."""
+        return [(old, new) for old, new in zip(self.versions, self.versions[1:])][::-1]
+    
+    def test_delta_round_trip(self):
+        """Test that deltas rebuild the edited text exactly"""
+        base = "The quick brown fox jumps over the lazy dog.\n\nSecond  paragraph."
+        for value in ["", base, "The quick red fox leaps over the lazy dog!\n\nSecond paragraph ✓.", "Completely new"]:
+            self.assertEqual(apply_delta(base, encode_delta(base, value)), value)
+    
+    def test_history_stored_as_deltas_with_snapshots(self):
+        """Test that edits are stored as deltas with a full snapshot every interval"""
+        with self.db._get_connection() as conn:
+            rows = conn.execute(
+                "SELECT base_id, length(new_value) FROM task_history WHERE field_name = 'description' ORDER BY id"
+            ).fetchall()
+        self.assertEqual([base_id is None for base_id, _ in rows], [True, False, False, False] * 2 + [True, False])
+        self.assertTrue(all(length < 100 for base_id, length in rows if base_id is not None))
+        
+        history = self.db.get_task_history("task_1")
+        self.assertEqual([(e["old_value"], e["new_value"]) for e in history], self.expected())
+        streamed = self.db.iter_task_history("task_1", columns=["old_value", "new_value"])
+        self.assertEqual([(e["old_value"], e["new_value"]) for e in streamed], self.expected())
+    
+    def test_bulk_updates_delta_encoded(self):
+        """Test that update_tasks_bulk writes deltas the same way"""
+        self.versions.append(self.versions[-1] + " Final.")
+        self.db.update_tasks_bulk([("task_1", {"description": self.versions[-1]})])
+        with self.db._get_connection() as conn:
+            self.assertIsNotNone(conn.execute("SELECT base_id FROM task_history ORDER BY id DESC LIMIT 1").fetchone()[0])
+        self.assertEqual([(e["old_value"], e["new_value"]) for e in self.db.get_task_history("task_1")], self.expected())
+    
+    def test_archiving_keeps_deltas_resolvable(self):
+        """Test that history split across the archive and the hot database still rebuilds"""
+        old = datetime.now() - timedelta(days=200)
+        with self.db._get_connection() as conn:
+            # The first snapshot and two of its deltas become old enough to archive
+            conn.execute("""
+                UPDATE task_history SET changed_at = ?
+                WHERE id IN (SELECT id FROM task_history ORDER BY id LIMIT 3)
+            """, (old.isoformat(),))
+        self.db.archive_old_rows(older_than_days=90)
+        
+        self.assertEqual(
+            [(e["old_value"], e["new_value"]) for e in self.db.get_task_history("task_1")], self.expected()[:-3]
+        )
+        history = self.db.get_task_history("task_1", since=old.isoformat())
+        self.assertEqual([(e["old_value"], e["new_value"]) for e in history][:7], self.expected()[:7])
+        self.assertEqual(sorted((e["old_value"], e["new_value"]) for e in history), sorted(self.expected()))
+
+class TestTaskDependencies(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        # a <- b <- c, a <- d, and e depending on both c and d
+        self.db.add_task(make_task("a"))
+        self.db.add_task(make_task("b", dependencies=["a"], priority=1))
+        self.db.add_task(make_task("d", dependencies=["a"], priority=3))
+        self.db.add_tasks_bulk([
+            make_task("c", dependencies=["b"]),
+            make_task("e", dependencies=["c", "d"])
+        ])
+    
+    def test_direct_and_transitive_dependents(self):
+        """Test that dependents are found through the edge table"""
+        self.assertEqual(self.db.get_dependents("a"), ["b", "d"])
+        self.assertEqual(self.db.get_dependents("a", transitive=True), ["b", "c", "d", "e"])
+        self.assertEqual(self.db.get_dependents("e", transitive=True), [])
+    
+    def test_cycles_terminate(self):
+        """Test that a dependency cycle does not loop forever"""
+        self.db.update_task("a", {"dependencies": ["e"]})
+        self.assertEqual(self.db.get_dependents("a", transitive=True), ["b", "c", "d", "e"])
+    
+    def test_update_task_rewires_edges(self):
+        """Test that changing the dependency list replaces the edges"""
+        updated = self.db.update_task("e", {"dependencies": ["b"]})
+        self.assertEqual(updated["dependencies"], ["b"])
+        self.assertEqual(self.db.get_dependents("b"), ["c", "e"])
+        self.assertEqual(self.db.get_dependents("d"), [])
+    
+    def test_ready_set(self):
+        """Test that only pending tasks with all dependencies completed are ready"""
+        self.assertEqual([t["id"] for t in self.db.get_ready_tasks()], ["a"])
+        
+        self.db.update_task("a", {"status": "completed"})
+        self.assertEqual([t["id"] for t in self.db.get_ready_tasks()], ["d", "b"])  # by priority
+        self.assertEqual([t["id"] for t in self.db.get_ready_tasks(limit=1)], ["d"])
+        self.assertEqual([t["id"] for t in self.db.get_ready_tasks(unblocked_by="a")], ["d", "b"])
+        self.assertEqual(self.db.get_ready_tasks(agent="OtherAgent"), [])
+        
+        self.db.update_task("b", {"status": "completed"})
+        self.db.update_task("c", {"status": "completed"})
+        self.assertEqual([t["id"] for t in self.db.get_ready_tasks(unblocked_by="c")], [])  # still waits on d
+        self.db.update_task("d", {"status": "completed"})
+        self.assertEqual([t["id"] for t in self.db.get_ready_tasks(unblocked_by="d")], ["e"])
+    
+    def test_missing_dependency_blocks(self):
+        """Test that a dependency on an unknown task keeps a task blocked"""
+        self.db.add_task(make_task("f", dependencies=["missing"]))
+        self.assertNotIn("f", [t["id"] for t in self.db.get_ready_tasks()])
+    
+    def test_lookups_use_indexes(self):
+        """Test that dependent and ready-set lookups are index driven"""
+        scans = lambda plan: [step for step in plan if step.startswith("SCAN")]
+        self.assertEqual(scans(self.db.explain(
+            "SELECT task_id FROM task_dependencies WHERE depends_on = ?", ("a",)
+        )), [])
+        plan = self.db.explain("""
+            SELECT t.id FROM tasks t WHERE t.status = 'pending'
+            AND NOT EXISTS (
+                SELECT 1 FROM task_dependencies d LEFT JOIN tasks p ON p.id = d.depends_on
+                WHERE d.task_id = t.id AND p.status IS NOT 'completed'
+            )
+            ORDER BY t.priority DESC, t.created_at ASC
+        """)
+        self.assertEqual(scans(plan), [])
+        self.assertFalse(any("TEMP B-TREE" in step for step in plan))
+    
+    def test_legacy_dependencies_backfilled(self):
+        """Test that JSON dependency lists are copied into the edge table on upgrade"""
+        with self.db._get_connection() as conn:
+            conn.execute("DROP TABLE task_dependencies")
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config=self.config)
+        self.assertEqual(self.db.get_dependents("a", transitive=True), ["b", "c", "d", "e"])
+
+class TestBulkUpdates(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.db.add_tasks_bulk(
+            [make_task(f"a_{i}", agent="AgentA") for i in range(5)] +
+            [make_task(f"b_{i}", agent="AgentB") for i in range(5)]
+        )
+    
+    def history_count(self):
+        with self.db._get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM task_history").fetchone()[0]
+    
+    def test_bulk_transitions_match_update_task(self):
+        """Test that a bulk update leaves the same tasks, history and stats as single updates"""
+        for i in range(3):
+            self.db.update_task(f"a_{i}", {"status": "completed", "priority": 2})
+        updated = self.db.update_tasks_bulk(
+            [(f"b_{i}", {"status": "completed", "priority": 2}) for i in range(3)] + [("missing", {"status": "completed"})]
+        )
+        
+        self.assertEqual([task["id"] for task in updated], ["b_0", "b_1", "b_2"])
+        self.assertTrue(all(task["status"] == "completed" and task["priority"] == 2 for task in updated))
+        self.assertEqual(self.history_count(), 12)
+        
+        stats_a, stats_b = self.db.get_agent_stats("AgentA"), self.db.get_agent_stats("AgentB")
+        for key in ("tasks_completed", "tasks_pending"):
+            self.assertEqual(stats_a[key], stats_b[key])
+        self.assertEqual(stats_b["tasks_completed"], 3)
+        self.assertEqual(stats_b["tasks_pending"], 2)
+    
+    def test_steps_for_one_task_apply_in_order(self):
+        """Test that several updates of one task are replayed in sequence"""
+        updated = self.db.update_tasks_bulk([
+            ("a_0", {"status": "in_progress"}),
+            ("a_0", {"status": "completed", "title": "Done"}),
+            ("a_0", {"status": "completed"})
+        ])
+        self.assertEqual(len(updated), 1)
+        self.assertEqual((updated[0]["status"], updated[0]["title"]), ("completed", "Done"))
+        
+        history = self.db.get_task_history("a_0")
+        self.assertEqual(
+            sorted((e["field"], e["old_value"], e["new_value"]) for e in history),
+            [("status", "in_progress", "completed"), ("status", "pending", "in_progress"), ("title", "Task a_0", "Done")]
+        )
+        self.assertEqual(self.db.get_agent_stats("AgentA")["tasks_completed"], 1)
+    
+    def test_dependencies_rewired(self):
+        """Test that bulk dependency changes update the edge table"""
+        self.db.update_tasks_bulk([("a_1", {"dependencies": ["a_0"]}), ("a_2", {"dependencies": ["a_0", "a_1"]})])
+        self.assertEqual(self.db.get_dependents("a_0"), ["a_1", "a_2"])
+        self.assertEqual(self.db.get_dependents("a_0", transitive=True), ["a_1", "a_2"])
+    
+    def test_fallback_without_returning(self):
+        """Test the UPDATE-then-SELECT path used on SQLite builds without RETURNING"""
+        with patch("agents.TaskOrchestrator.tools.database_manager.UPDATE_RETURNING", False):
+            updated = self.db.update_tasks_bulk([(f"a_{i}", {"status": "completed"}) for i in range(5)])
+        self.assertEqual([task["status"] for task in updated], ["completed"] * 5)
+        self.assertEqual(self.db.get_agent_stats("AgentA")["tasks_completed"], 5)
+    
+    def test_empty_input(self):
+        """Test that no updates is a no-op"""
+        self.assertEqual(self.db.update_tasks_bulk([]), [])
+
+class TestShardRouter(DatabaseManagerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = ShardRouter(os.path.join(self.temp_dir, "shards"), max_open_shards=2, config={"pool_size": 2})
+    
+    def tearDown(self):
+        self.router.close()
+        super().tearDown()
+    
+    def test_tenants_get_separate_files(self):
+        """Test that each key writes to its own database, apart from the singleton"""
+        self.router.run("acme", "add_task", make_task("task_1"))
+        self.router.run("globex", "add_task", make_task("task_2"))
+        
+        self.assertEqual(self.router.run("acme", "get_agent_stats", "TestAgent")["tasks_pending"], 1)
+        self.assertEqual(self.router.run("globex", "search_tasks", "task_1"), [])
+        self.assertIsNone(self.db.get_agent_stats("TestAgent"))
+        with self.router.shard("acme") as db:
+            self.assertIsNot(db, self.db)
+            self.assertIs(DatabaseManager(), self.db)
+        self.assertEqual(self.router.shard_keys(), ["acme", "globex"])
+    
+    def test_least_recently_used_shards_evicted(self):
+        """Test that idle shards beyond the cap are closed and reopen with their data"""
+        for key in ("a", "b", "c"):
+            self.router.run(key, "add_task", make_task(f"task_{key}"))
+        self.assertEqual(self.router.open_shards(), ["b", "c"])
+        
+        self.router.run("b", "get_agent_stats", "TestAgent")
+        self.router.run("a", "get_agent_stats", "TestAgent")
+        self.assertEqual(self.router.open_shards(), ["b", "a"])
+        self.assertEqual(self.router.run("c", "get_agent_stats", "TestAgent")["tasks_pending"], 1)
+    
+    def test_shards_in_use_are_not_evicted(self):
+        """Test that a shard held in a with block stays open past the cap"""
+        with self.router.shard("a") as db:
+            self.router.run("b", "add_task", make_task("task_b"))
+            self.router.run("c", "add_task", make_task("task_c"))
+            self.assertIn("a", self.router.open_shards())
+            db.add_task(make_task("task_a"))
+        self.assertEqual(len(self.router.open_shards()), 2)
+    
+    def test_keys_are_encoded_into_file_names(self):
+        """Test that keys with path characters stay inside the shard directory"""
+        self.router.run("../acme corp/eu", "add_task", make_task("task_1"))
+        path = self.router.shard_path("../acme corp/eu")
+        self.assertEqual(path.parent, self.router.shard_dir)
+        self.assertEqual(self.router.shard_keys(), ["../acme corp/eu"])
+        with self.assertRaises(ValueError):
+            self.router.shard_path("")
+    
+    def test_fan_out_reads_every_shard(self):
+        """Test that fan-out queries every shard read-only without opening it in the router"""
+        for n, key in enumerate(("a", "b", "c")):
+            self.router.run(key, "add_tasks_bulk", [make_task(f"{key}_{i}") for i in range(n + 1)])
+        self.router.close()
+        
+        counts = self.router.fan_out("SELECT COUNT(*) FROM tasks")
+        self.assertEqual({key: rows[0][0] for key, rows in counts.items()}, {"a": 1, "b": 2, "c": 3})
+        self.assertEqual(self.router.open_shards(), [])
+        
+        self.assertEqual(list(self.router.fan_out("SELECT 1", keys=["b"])), ["b"])
+        with self.assertRaises(sqlite3.OperationalError):
+            self.router.fan_out("DELETE FROM tasks")
+
+class TestBusyRetry(DatabaseManagerTestCase):
+    config = {"pool_size": 4, "busy_timeout": 20, "busy_retries": 3, "busy_retry_base_delay": 0.01}
+    
+    def retries(self, operation):
+        return REGISTRY.get_sample_value("db_busy_retries_total", {"operation": operation}) or 0
+    
+    def lock_database(self):
+        """Take the write lock from a separate connection, as another process would."""
+        other = sqlite3.connect(self.db_path, timeout=0, isolation_level=None, check_same_thread=False)
+        other.execute("BEGIN IMMEDIATE")
+        return other
+    
+    def test_write_transactions_take_the_lock_up_front(self):
+        """Test that write checkouts start with BEGIN IMMEDIATE"""
+        with self.db._get_connection(write=True) as conn:
+            self.assertTrue(conn.in_transaction)
+            with self.assertRaises(sqlite3.OperationalError):
+                self.lock_database()
+        with self.db._get_connection() as conn:
+            self.assertFalse(conn.in_transaction)
+    
+    def test_write_retried_until_lock_released(self):
+        """Test that a write blocked past busy_timeout is retried with backoff"""
+        other = self.lock_database()
+        retries = self.retries("add_task")
+        threading.Timer(0.05, other.rollback).start()
+        
+        self.db.add_task(make_task("task_1"))
+        
+        self.assertGreater(self.retries("add_task"), retries)
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 1)
+        other.close()
+    
+    def test_submit_without_writer_retried(self):
+        """Test that submit retries busy errors when the write runs immediately"""
+        other = self.lock_database()
+        retries = self.retries("add_task")
+        threading.Timer(0.05, other.rollback).start()
+        
+        self.db.submit("add_task", make_task("task_1")).result()
+        
+        self.assertGreater(self.retries("add_task"), retries)
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 1)
+        other.close()
+    
+    def test_bulk_generator_input_survives_retry(self):
+        """Test that a busy error after part of a generator was read still inserts every row on the retry"""
+        def busy_once(original):
+            calls = []
+            
+            def fail_on_second_chunk(*args):
+                calls.append(args)
+                if len(calls) == 2:
+                    raise sqlite3.OperationalError("database is locked")
+                return original(*args)
+            return fail_on_second_chunk
+        
+        with patch.object(self.db, "_write_dependencies", busy_once(DatabaseManager._write_dependencies)):
+            self.assertEqual(self.db.add_tasks_bulk((make_task(f"task_{i}") for i in range(7)), chunk_size=2), 7)
+        with patch.object(self.db, "_index_compressed_messages", busy_once(self.db._index_compressed_messages)):
+            self.assertEqual(self.db.add_messages_bulk((make_message(f"msg_{i}") for i in range(5)), chunk_size=2), 5)
+        
+        self.assertEqual(self.db.get_agent_stats("TestAgent")["tasks_pending"], 7)
+        with self.db._get_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0], 7)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0], 5)
+    
+    def test_gives_up_after_max_retries(self):
+        """Test that a lock held for good still surfaces as an OperationalError"""
+        other = self.lock_database()
+        retries = self.retries("update_task")
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                self.db.update_task("task_1", {"status": "completed"})
+        finally:
+            other.close()
+        self.assertEqual(self.retries("update_task"), retries + 3)
+    
+    def test_concurrent_processes(self):
+        """Test that several processes can write to one database file without errors"""
+        script = f"""
+import sys
+sys.path.insert(0, {os.getcwd()!r})
+from agents.TaskOrchestrator.tools.database_manager import DatabaseManager
+db = DatabaseManager({self.db_path!r}, config={{"busy_timeout": 5}})
+worker = sys.argv[1]
+for i in range(50):
+    task = {{"id": f"{{worker}}_{{i}}", "title": "t", "description": "d", "priority": 1, "agent": worker,
+            "status": "pending", "created_at": "2024-01-01T00:00:00", "updated_at": "2024-01-01T00:00:00"}}
+    db.add_task(task)
+    db.update_task(task["id"], {{"status": "completed"}})
+"""
+        workers = [subprocess.Popen([sys.executable, "-c", script, f"worker{n}"]) for n in range(4)]
+        self.assertEqual([worker.wait(timeout=120) for worker in workers], [0, 0, 0, 0])
+        
+        for n in range(4):
+            self.assertEqual(self.db.get_agent_stats(f"worker{n}")["tasks_completed"], 50)
+
+class TestQueryInstrumentation(DatabaseManagerTestCase):
+    config = {"pool_size": 1, "instrument_queries": True, "slow_query_ms": 1000}
+    
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+    
+    def test_statement_templates_fold_literals(self):
+        """Test that statements differing only in literals share a template"""
+        self.assertEqual(
+            statement_template("SELECT *\n  FROM tasks WHERE priority = 3 AND status = 'done' AND id IN (?, ?, ?)"),
+            "SELECT * FROM tasks WHERE priority = ? AND status = ? AND id IN (?, ...)"
+        )
+        self.assertEqual(statement_template("RELEASE pool_sp_2"), "RELEASE pool_sp_2")
+    
+    def test_latency_and_rows_recorded_per_template(self):
+        """Test that reads and writes are timed and counted under their template"""
+        self.db.add_tasks_bulk([make_task(f"task_{i}") for i in range(5)])
+        query = "SELECT id FROM tasks WHERE agent = ?"
+        template = statement_template(query)
+        count = self.sample("db_statement_duration_seconds_count", statement=template)
+        rows = self.sample("db_statement_rows_total", statement=template)
+        
+        with self.db._get_connection() as conn:
+            self.assertEqual(len(list(conn.execute(query, ("TestAgent",)))), 5)
+            self.assertEqual(conn.execute(query, ("TestAgent",)).fetchone()[0], "task_0")
+        
+        self.assertEqual(self.sample("db_statement_duration_seconds_count", statement=template), count + 2)
+        self.assertEqual(self.sample("db_statement_rows_total", statement=template), rows + 6)
+        self.assertGreater(self.sample("db_statement_duration_seconds_count", statement="COMMIT"), 0)
+    
+    def test_slow_queries_logged(self):
+        """Test that statements above the threshold go to the slow-query log"""
+        self.db.connection_pool.instrumentation.slow_query_seconds = 0
+        with self.assertLogs("agents.TaskOrchestrator.tools.database_manager.slow_queries", "WARNING") as logs:
+            self.db.get_agent_stats("TestAgent")
+        self.assertTrue(any("task_stats" in line for line in logs.output))
+    
+    def test_pool_wait_recorded(self):
+        """Test that waiting for a pooled connection counts as lock wait"""
+        waits = self.sample("db_lock_wait_seconds_count", kind="pool")
+        checked_out = threading.Event()
+        release = threading.Event()
+        
+        def hold():
+            with self.db._get_connection():
+                checked_out.set()
+                release.wait()
+        
+        holder = threading.Thread(target=hold)
+        holder.start()
+        checked_out.wait()
+        threading.Timer(0.05, release.set).start()
+        self.db.get_agent_stats("TestAgent")
+        holder.join()
+        
+        self.assertEqual(self.sample("db_lock_wait_seconds_count", kind="pool"), waits + 1)
+    
+    def test_disabled_hands_out_plain_connections(self):
+        """Test that uninstrumented pools hand out plain sqlite3 connections"""
+        self.db.cleanup()
+        DatabaseManager._instance = None
+        self.db = DatabaseManager(self.db_path, config={"pool_size": 1, "instrument_queries": False})
+        with self.db._get_connection() as conn:
+            self.assertIs(type(conn), sqlite3.Connection)
+
+if __name__ == '__main__':
+    unittest.main()
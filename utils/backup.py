@@ -1,13 +1,108 @@
+import gzip
 import shutil
+import sqlite3
 from pathlib import Path
 import datetime
 
+from agency.config import DATABASE_CONFIG
+
+def online_backup(source, dest_path, compress=False, pages=None, sleep=None):
+    """
+    Copy a live SQLite database with the SQLite backup API.
+    
+    ``source`` is a path or an open connection. Pages are copied in batches of
+    ``pages`` with ``sleep`` seconds between batches so writers are not starved.
+    A read transaction is held on the source for the whole copy, which in WAL
+    mode pins a consistent snapshot and keeps concurrent writes from restarting
+    the backup. With ``compress`` the finished copy is gzipped into
+    ``dest_path`` and then deleted: the backup API only writes to a database
+    file, so the uncompressed copy briefly needs as much free disk space as
+    the database on top of the compressed one.
+    """
+    pages = pages or DATABASE_CONFIG['backup_pages_per_step']
+    sleep = DATABASE_CONFIG['backup_step_sleep'] if sleep is None else sleep
+    dest_path = Path(dest_path)
+    partial_path = dest_path.with_name(dest_path.name + ".partial")
+    
+    src = source if isinstance(source, sqlite3.Connection) else sqlite3.connect(source)
+    began = not src.in_transaction
+    try:
+        if began:
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+        dest = sqlite3.connect(partial_path)
+        try:
+            src.backup(dest, pages=pages, sleep=sleep)
+        finally:
+            dest.close()
+    finally:
+        if began:
+            src.rollback()
+        if src is not source:
+            src.close()
+    
+    if compress:
+        with open(partial_path, "rb") as fin, gzip.open(dest_path, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        partial_path.unlink()
+    else:
+        partial_path.replace(dest_path)
+    return dest_path
+
+def restore_backup(backup_path, dest, pages=None, sleep=0):
+    """
+    Restore a backup into the open connection ``dest`` with the backup API.
+    
+    The destination is rewritten inside a single write transaction, so other
+    connections to the same database keep seeing the old contents until the
+    restore commits and the new contents afterwards. Gzipped backups are
+    decompressed to a temporary file first.
+    """
+    pages = pages or DATABASE_CONFIG['backup_pages_per_step']
+    backup_path = Path(backup_path)
+    temp_path = None
+    
+    if backup_path.suffix == ".gz":
+        temp_path = backup_path.with_name(backup_path.name + ".restore")
+        with gzip.open(backup_path, "rb") as fin, open(temp_path, "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        backup_path = temp_path
+    
+    try:
+        src = sqlite3.connect(f"file:{backup_path}?mode=ro", uri=True)
+        try:
+            src.backup(dest, pages=pages, sleep=sleep)
+        finally:
+            src.close()
+    finally:
+        if temp_path is not None:
+            temp_path.unlink()
+
+def prune_backups(backup_dir, pattern="*.db*", keep=None, max_age_days=None):
+    """Delete backups beyond the newest ``keep`` and those older than ``max_age_days``."""
+    keep = DATABASE_CONFIG['backup_keep'] if keep is None else keep
+    max_age_days = DATABASE_CONFIG['backup_max_age_days'] if max_age_days is None else max_age_days
+    
+    backups = sorted(
+        (path for path in Path(backup_dir).glob(pattern) if not path.name.endswith(".partial")),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True
+    )
+    cutoff = datetime.datetime.now().timestamp() - max_age_days * 86400 if max_age_days else None
+    
+    removed = []
+    for index, path in enumerate(backups):
+        if index >= keep or (cutoff is not None and path.stat().st_mtime < cutoff):
+            path.unlink()
+            removed.append(path)
+    return removed
+
 class BackupManager:
     def __init__(self):
         self.backup_dir = Path("backups")
         self.backup_dir.mkdir(parents=True, exist_ok=True)
     
-    def create_backup(self):
+    def create_backup(self, compress=False):
         """Create a backup of the database"""
         try:
             db_path = Path("data/agency.db")
@@ -16,11 +111,14 @@ class BackupManager:
             
             timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_path = self.backup_dir / f"agency_backup_{timestamp}.db"
+            if compress:
+                backup_path = backup_path.with_suffix(".db.gz")
             
-            shutil.copy2(db_path, backup_path)
+            online_backup(db_path, backup_path, compress=compress)
+            prune_backups(self.backup_dir, "agency_backup_*")
             return str(backup_path)
         except Exception as e:
             print(f"Backup failed: {str(e)}")
             return None
 
-backup_manager = BackupManager() 
\ No newline at end of file
+backup_manager = BackupManager()
\ No newline at end of file